@@ -1,30 +1,293 @@
 import os
+import sys
 import logging
+import random
+import re
+import threading
+import time
 import uuid
 import traceback
 import requests
 import json
 import hashlib
+import hmac
 import base64
+import csv
+import io
+import gzip
+import mimetypes
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone, timedelta
-from flask import Flask, request, jsonify, send_from_directory, session
+from flask import Flask, request, jsonify, send_file, abort, session, g, has_request_context, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
+from cachetools import TTLCache
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud.firestore_v1.field_path import FieldPath
+from werkzeug.security import safe_join
+from flask.json.provider import DefaultJSONProvider
 import firebase_admin
 from firebase_admin import credentials, auth, firestore
+# chat_core.py is shared with the Cloud Functions and deployed with them from functions/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "functions"))
+import chat_core
+from chat_core import (
+    BackendHooks, LLMUnavailable, LLM_RETRY_MAX_DELAY, ResilientCompletions, UserAliases,
+    answer_from_dictionary, load_model_routes, classify_question, CHAT_LISTING_FIELDS, CHAT_VERSION_FIELDS, version_etag, session_version,
+    EXPORT_CONTENT_TYPES, EXPORT_FIELDS, EXPORT_FILTER_FIELDS, decode_export_cursor, parse_export_date,
+    export_session_rows, USAGE_COLLECTION, USAGE_SHARDS, USAGE_GRANULARITIES, USAGE_MAX_PERIODS,
+    USAGE_COUNTER_FIELDS, usage_key, add_usage_counters, parse_usage_date, usage_periods, mark_usage_live,
+    MaterialsStore, LessonContents, create_arabic_teaching_prompt, SUMMARY_MODEL, SUMMARY_MAX_TOKENS, summary_target,
+    build_summary_request,
+    MONTHLY_USAGE_COLLECTION, MONTHLY_USAGE_RETENTION, MAX_MONTHLY_MESSAGES, usage_month, legacy_message_count,
+    ACTIVE_SUBSCRIPTION_STATUSES, subscription_end, has_premium_entitlement,
+)
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 # Load environment variables
 load_dotenv()
 
-# Setup logging
+# ------------------------------
+# Structured logging
+# ------------------------------
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+LOG_FIELD_MAX_CHARS = int(os.getenv("LOG_FIELD_MAX_CHARS", "256"))
+LOG_FIELD_MAX_ITEMS = 20
+
+# Fraction of occurrences logged per high-volume event; unlisted events are always logged
+LOG_SAMPLE_RATES = {
+    "auth_verified": float(os.getenv("LOG_SAMPLE_AUTH", "0.1")),
+    "materials_loaded": float(os.getenv("LOG_SAMPLE_MATERIALS", "0.1")),
+    "session_loaded": float(os.getenv("LOG_SAMPLE_SESSION", "0.1")),
+}
+
+def cap_field(value, max_chars=LOG_FIELD_MAX_CHARS):
+    """Render a log field with bounded size, however large the underlying value is"""
+    if callable(value):
+        value = value()
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)):
+        capped = [cap_field(v, max_chars) for v in value[:LOG_FIELD_MAX_ITEMS]]
+        if len(value) > LOG_FIELD_MAX_ITEMS:
+            capped.append(f"... {len(value) - LOG_FIELD_MAX_ITEMS} more")
+        return capped
+    if isinstance(value, dict):
+        items = list(value.items())
+        capped = {str(k): cap_field(v, max_chars) for k, v in items[:LOG_FIELD_MAX_ITEMS]}
+        if len(items) > LOG_FIELD_MAX_ITEMS:
+            capped["..."] = f"{len(items) - LOG_FIELD_MAX_ITEMS} more"
+        return capped
+    text = str(value)
+    if len(text) > max_chars:
+        return f"{text[:max_chars]}... ({len(text)} chars)"
+    return text
+
+class RequestContextFilter(logging.Filter):
+    """Attaches the current request ID and stage durations to every record"""
+    def filter(self, record):
+        record.request_id = None
+        record.stages = None
+        if has_request_context():
+            record.request_id = getattr(g, "request_id", None)
+            record.stages = getattr(g, "stage_durations", None) or None
+        return True
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with structured fields rendered size-capped"""
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        if getattr(record, "request_id", None):
+            entry["requestId"] = record.request_id
+        if getattr(record, "event", None):
+            entry["event"] = record.event
+        if getattr(record, "stages", None):
+            entry["stagesMs"] = {k: round(v, 1) for k, v in record.stages.items()}
+        for key, value in (getattr(record, "fields", None) or {}).items():
+            entry[key] = cap_field(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local development, with the same field caps"""
+    def format(self, record):
+        line = super().format(record)
+        if getattr(record, "request_id", None):
+            line += f" [request_id={record.request_id}]"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={cap_field(v)}" for k, v in fields.items())
+        return line
+
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.INFO)
+logger.setLevel(LOG_LEVEL)
 handler = logging.StreamHandler()
-handler.setLevel(logging.INFO)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
+handler.setLevel(LOG_LEVEL)
+handler.addFilter(RequestContextFilter())
+if LOG_FORMAT == "json":
+    handler.setFormatter(JsonFormatter())
+else:
+    handler.setFormatter(TextFormatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
 logger.addHandler(handler)
 
+def log_event(event, level=logging.INFO, **fields):
+    """
+    Log a structured event. Nothing is formatted unless the level is enabled
+    and the event survives sampling; callable field values are evaluated
+    only at that point.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    sample_rate = LOG_SAMPLE_RATES.get(event, 1.0)
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    logger.log(level, event, extra={"event": event, "fields": fields})
+
+# ------------------------------
+# Metrics (exposed in Prometheus text format on /metrics)
+# ------------------------------
+class Counter:
+    """Monotonic counter keyed by a tuple of label values"""
+    def __init__(self, name, help_text, label_names):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{format_labels(self.label_names, label_values)} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by a tuple of label values"""
+    def __init__(self, name, help_text, label_names, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.setdefault(label_values, {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for label_values, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series["counts"]):
+                    labels = format_labels(self.label_names + ("le",), label_values + (str(bound),))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = format_labels(self.label_names + ("le",), label_values + ("+Inf",))
+                lines.append(f"{self.name}_bucket{labels} {series['count']}")
+                labels = format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {series['sum']:.6f}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+STAGE_LATENCY = Histogram(
+    "ask_stage_duration_seconds", "Time spent in each stage of /ask", ("stage",),
+    (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+ASK_REQUESTS = Counter("ask_requests_total", "Completed /ask requests by outcome", ("outcome",))
+CACHE_EVENTS = Counter("cache_events_total", "Cache lookups by cache and result", ("cache", "result"))
+FIRESTORE_READS = Counter("firestore_reads_total", "Firestore document reads by collection", ("collection",))
+FIRESTORE_WRITES = Counter("firestore_writes_total", "Firestore document writes by collection", ("collection",))
+OPENAI_TOKENS = Counter("openai_tokens_total", "OpenAI tokens by model and kind", ("model", "kind"))
+LLM_ROUTE_LATENCY = Histogram(
+    "llm_route_duration_seconds", "OpenAI answer latency by route and model", ("route", "model"),
+    (0.25, 0.5, 1, 2, 3, 5, 8, 13, 20, 30, 60)
+)
+LLM_ROUTE_TOKENS = Counter("llm_route_tokens_total", "OpenAI answer tokens by route, model and kind", ("route", "model", "kind"))
+LLM_EVENTS = Counter("llm_resilience_events_total", "OpenAI retries, hedges, exhausted calls and circuit rejections", ("event",))
+METRICS = [STAGE_LATENCY, ASK_REQUESTS, CACHE_EVENTS, FIRESTORE_READS, FIRESTORE_WRITES, OPENAI_TOKENS,
+           LLM_ROUTE_LATENCY, LLM_ROUTE_TOKENS, LLM_EVENTS]
+
+def record_cache(cache, hit):
+    CACHE_EVENTS.inc(cache, "hit" if hit else "miss")
+
+def record_token_usage(model, usage):
+    """Count prompt/completion tokens from an OpenAI response.usage object"""
+    if usage is None:
+        return
+    OPENAI_TOKENS.inc(model, "prompt", amount=usage.prompt_tokens or 0)
+    OPENAI_TOKENS.inc(model, "completion", amount=usage.completion_tokens or 0)
+
+@contextmanager
+def timed_stage(name):
+    """Record how long a stage of the current request took, in the log context and the stage histogram"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_LATENCY.observe(elapsed, name)
+        if has_request_context():
+            if "stage_durations" not in g:
+                g.stage_durations = {}
+            g.stage_durations[name] = elapsed * 1000
+
+class AppHooks(BackendHooks):
+    """Reports the shared chat_core code to this app's metrics and log"""
+    def firestore_read(self, collection, amount=1):
+        FIRESTORE_READS.inc(collection, amount=amount)
+
+    def firestore_write(self, collection, amount=1):
+        FIRESTORE_WRITES.inc(collection, amount=amount)
+
+    def cache(self, name, hit):
+        record_cache(name, hit)
+
+    def llm_event(self, event, **fields):
+        if event == "circuit_opened":
+            logger.warning(f"⚠️ OpenAI circuit opened after {fields['failures']} failed calls")
+            return
+        LLM_EVENTS.inc(event)
+        if event == "retry":
+            log_event("llm_retry", level=logging.WARNING, **fields)
+
+    def log(self, event, severity="INFO", **fields):
+        log_event(event, level=getattr(logging, severity), **fields)
+
+backend_hooks = AppHooks()
+
 # Initialize Firebase
 firebase_initialized = False
 if not firebase_admin._apps:
@@ -57,6 +320,24 @@ except Exception as e:
     logger.error(f"❌ OpenAI client initialization failed: {e}")
     client = None
 
+# ------------------------------
+# OpenAI resilience: see chat_core.ResilientCompletions
+# ------------------------------
+LLM_UNAVAILABLE_ANSWER = "Laith is temporarily unavailable. Please try again in a minute."
+llm = ResilientCompletions(backend_hooks)
+
+def create_chat_completion(openai_client, hedge=True, **params):
+    return llm.create(openai_client, hedge=hedge, **params)
+
+# Idempotency for /ask retries
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENT_REPLAY_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_COLLECTION = "askIdempotency"
+IDEMPOTENCY_TTL = timedelta(hours=24)
+IDEMPOTENCY_PENDING_TIMEOUT = timedelta(minutes=2)
+idempotency_cache = TTLCache(maxsize=2048, ttl=IDEMPOTENCY_TTL.total_seconds())
+idempotency_lock = threading.Lock()
+
 # Email encoding/decoding helpers
 def encode_email(email):
     """Encode email to use as a user ID"""
@@ -85,7 +366,7 @@ def get_user_email(user_id):
         if user_record.email:
             return user_record.email
     except Exception as e:
-        logger.warning(f"Could not get user email from auth: {e}")
+        logger.warning("Could not get user email from auth: %s", e)
         
         # Try to decode in case it's already an encoded email
         decoded = decode_email(user_id)
@@ -98,11 +379,67 @@ def get_user_id_from_email(email):
     """Convert email to a consistent user ID format"""
     return encode_email(email)
 
+# Canonical user identity: see chat_core.UserAliases
+user_aliases = UserAliases(backend_hooks)
+
+def resolve_user_id(uid=None, email=None):
+    """Canonical users/ document ID for an authenticated user"""
+    return user_aliases.resolve(db if firebase_initialized else None, uid, email)
+
+# JSON responses: UTF-8 without \uXXXX escapes (chat logs are mostly Hebrew and
+# Arabic), encoded with orjson when installed and compressed when large
+JSON_COMPRESS_MIN_BYTES = int(os.getenv("JSON_COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify() with orjson; dates and other extra types still go through Flask's default()"""
+    ensure_ascii = False
+    sort_keys = False
+
+    def dumps(self, obj, **kwargs):
+        # Pretty-printing (debug mode) and explicit options take the stdlib path
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME).decode("utf-8")
+
 # Initialize Flask app
-app = Flask(__name__, static_folder='./build', static_url_path='')
+# The built frontend is served by StaticAssets below, not Flask's static route
+app = Flask(__name__, static_folder=None)
+app.json = FastJSONProvider(app)
 app.secret_key = os.getenv("FLASK_SECRET_KEY", "dev_secret_key")
 CORS(app, resources={r"/*": {"origins": "*"}}, supports_credentials=True)
 
+REQUEST_ID_HEADER = "X-Request-ID"
+
+@app.before_request
+def assign_request_id():
+    """Tag every request with an ID that appears in all of its log lines"""
+    g.request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+    g.stage_durations = {}
+
+@app.after_request
+def return_request_id(response):
+    response.headers[REQUEST_ID_HEADER] = g.get("request_id", "")
+    return response
+
+@app.after_request
+def compress_json_response(response):
+    """br/gzip for JSON bodies over JSON_COMPRESS_MIN_BYTES, when the client accepts it"""
+    if (response.mimetype != "application/json" or response.direct_passthrough or response.is_streamed
+            or "Content-Encoding" in response.headers or response.content_length is None
+            or response.content_length < JSON_COMPRESS_MIN_BYTES):
+        return response
+    response.vary.add("Accept-Encoding")
+    if brotli is not None and request.accept_encodings["br"]:
+        response.set_data(brotli.compress(response.get_data(), quality=BROTLI_QUALITY))
+        response.headers["Content-Encoding"] = "br"
+    elif request.accept_encodings["gzip"]:
+        response.set_data(gzip.compress(response.get_data(), compresslevel=GZIP_LEVEL))
+        response.headers["Content-Encoding"] = "gzip"
+    return response
+
 # (1) Global 500 Error Handler
 @app.errorhandler(500)
 def handle_500_error(error):
@@ -127,7 +464,8 @@ def healthcheck():
             "status": "ok",
             "message": "API server is running",
             "timestamp": datetime.now(timezone.utc).isoformat(),
-            "version": "1.0.0"
+            "version": "1.0.0",
+            "openaiCircuit": llm.breaker.state
         }), 200
     except Exception as e:
         logger.error(f"❌ Health check failed: {e}", exc_info=True)
@@ -137,6 +475,23 @@ def healthcheck():
             "timestamp": datetime.now(timezone.utc).isoformat(),
         }), 500
 
+# (3) Metrics Endpoint
+# Scrapers send METRICS_TOKEN as a bearer token; admins can use their ID token
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus text exposition of stage latencies, cache, Firestore and token counters"""
+    auth_header = request.headers.get("Authorization", "")
+    if not (METRICS_TOKEN and hmac.compare_digest(auth_header, f"Bearer {METRICS_TOKEN}")):
+        _, denied = verify_admin()
+        if denied:
+            return denied
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n", 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
 # Additional Test Endpoint
 @app.route('/api/test', methods=['GET'])
 def test_api():
@@ -150,8 +505,7 @@ def verify_token():
         return None, None
     
     auth_header = request.headers.get("Authorization")
-    logger.debug(f"Auth header: {auth_header}")
-    
+
     if not auth_header or not auth_header.startswith("Bearer "):
         logger.warning("Missing or malformed Authorization header")
         return None, "Unauthorized - Missing token"
@@ -166,8 +520,11 @@ def verify_token():
         decoded_token = auth.verify_id_token(token)
         user_id = decoded_token["uid"]
         # Get user's email to use as the consistent identifier
-        user_email = get_user_email(user_id)
-        logger.info(f"Authenticated user: {user_id}, email: {user_email}")
+        user_email = decoded_token.get("email") or get_user_email(user_id)
+        # The uid is kept for resolve_user_id(), the claims for verify_admin()
+        g.auth_uid = user_id
+        g.auth_claims = decoded_token
+        log_event("auth_verified", uid=user_id, email=user_email)
         # Return the email as the primary user ID
         return user_email, None
     except auth.ExpiredIdTokenError:
@@ -180,64 +537,93 @@ def verify_token():
         logger.error(f"Auth error: {str(e)}")
         return None, "Authentication failed"
 
-# (5) Arabic Teaching Prompt Generator
-def create_arabic_teaching_prompt(level, week, question, gender, language, materials, conversation_history=None):
-    """
-    Dynamically generates an Arabic teaching prompt to feed into OpenAI
-    for specialized Levantine dialect tutoring. Includes context from
-    conversation history and user-provided learning materials.
-    """
-    base_prompt = f"""
-    You are 'Laith', an expert Levantine Arabic dialect tutor. Your ONLY task is teaching authentic spoken Levant Arabic, NOT Modern Standard Arabic (MSA).
-
-    STRICT RULES:
-    1. ONLY use information from the provided reference materials. Do not introduce vocabulary, phrases or concepts not included in these materials.
-    2. NEVER use MSA (فصحى) forms - use EXCLUSIVELY Levantine dialect (لهجة شامية) as spoken in daily conversation.
-    3. IGNORE any questions unrelated to Levantine Arabic learning.
-
-    Student profile:
-    - Level: {level}
-    - Week: {week}
-    - Gender: {gender}
-    - Language: {language}
-
-    TEACHING APPROACH:
-    - AUTHENTICITY: Teach how natives actually speak, not textbook forms
-    - PERSONALIZATION: For beginners (level {level}, week {week}), use more {language}. For advanced, use more Arabic
-    - EXAMPLES: Every vocabulary item must include realistic usage examples
-    - PRONUNCIATION: Include Hebrew transliteration (תעתיק עברי) for all Arabic words
-    - GENDER: Use appropriate forms for {gender} students
-    - DIALOGUES: Create practice conversations using ONLY vocabulary from materials
-    """
-    materials_prompt = "\nYOU MUST EXCLUSIVELY USE THESE MATERIALS AS YOUR SOURCE:\n"
-    for i, mat in enumerate(materials, 1):
-        # Example: incorporate materials as needed
-        materials_prompt += f"Material {i}: {mat}\n"
-
-    final_warning = "\nIMPORTANT: If asked about anything not covered in these materials, redirect to content you CAN teach from the materials. ALWAYS use Levantine dialect exclusively.\n"
-
-    # Adjust language usage
-    if language == "arabic":
-        language_guidance = "\nRespond primarily in Arabic script with minimal explanations in Hebrew.\n"
-    elif language == "transliteration-hebrew":
-        language_guidance = "\nProvide Arabic responses in Hebrew characters, plus short Hebrew explanations.\n"
-    elif language == "transliteration-english":
-        language_guidance = "\nProvide Arabic responses with English transliteration, plus Hebrew explanations.\n"
-    else:
-        language_guidance = "\nProvide main responses in Hebrew, with Arabic phrases in both script and Hebrew transliteration.\n"
+# Admin-only endpoints accept an ID token with the `admin` custom claim
+# or one belonging to an address in ADMIN_EMAILS (comma-separated)
+ADMIN_EMAILS = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
 
-    complete_prompt = base_prompt + materials_prompt + final_warning + language_guidance
+def verify_admin():
+    """(user_email, None) for an admin caller, else (None, (error response, status))"""
+    user_email, error = verify_token()
+    if error or not user_email:
+        return None, (jsonify({"error": error or "Unauthorized - Missing token"}), 401)
+    if (g.get("auth_claims") or {}).get("admin") is True or user_email.lower() in ADMIN_EMAILS:
+        return user_email, None
+    logger.warning("🔒 Non-admin %s denied access to %s", user_email, request.path)
+    return None, (jsonify({"error": "Forbidden - admin access required"}), 403)
+
+# (5) Arabic Teaching Prompt Generator: see chat_core.create_arabic_teaching_prompt
+# Model routing: see chat_core.classify_question
+MODEL_ROUTES = load_model_routes(backend_hooks)
+
+def record_llm_route(route, model, seconds, usage):
+    """Per-route latency and tokens, for tuning MODEL_ROUTES"""
+    LLM_ROUTE_LATENCY.observe(seconds, route, model)
+    if usage is not None:
+        LLM_ROUTE_TOKENS.inc(route, model, "prompt", amount=usage.prompt_tokens or 0)
+        LLM_ROUTE_TOKENS.inc(route, model, "completion", amount=usage.completion_tokens or 0)
+    log_event("llm_routed", route=route, model=model, latency_ms=round(seconds * 1000, 1),
+              completion_tokens=usage.completion_tokens if usage is not None else None)
+
+
+# Rolling session summaries: see chat_core.summary_target
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "2"))
+# Who summarizes the sessions app.py writes: "app" (this process) or "trigger"
+# (the summarize_chat_session function). It is stamped on each session as
+# `summarizer`, and the function skips sessions app.py summarizes itself.
+SESSION_SUMMARIZER = os.getenv("SESSION_SUMMARIZER", "app")
+
+_summary_executor = None
+_summary_lock = threading.Lock()
+_summaries_pending = set()
+
+def update_session_summary(session_id, previous_summary, messages, summary_through):
+    """Summarize `messages` into the session's summary; runs on the summary executor"""
+    try:
+        response = create_chat_completion(
+            client,
+            hedge=False,
+            model=SUMMARY_MODEL,
+            messages=build_summary_request(previous_summary, messages),
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS
+        )
+        record_token_usage(SUMMARY_MODEL, response.usage)
+        summary = (response.choices[0].message.content or "").strip()
+        if summary:
+            # update() rather than set(): a session deleted meanwhile must not come back
+            db.collection("chatLogs").document(session_id).update({
+                "summary": summary,
+                "summaryThrough": summary_through,
+                "summaryUpdatedAt": datetime.now(timezone.utc).isoformat(),
+                "revision": firestore.Increment(1)
+            })
+            FIRESTORE_WRITES.inc("chatLogs")
+            log_event("session_summarized", session_id=session_id, summary_through=summary_through, summary_chars=len(summary))
+    except Exception as e:
+        logger.warning(f"⚠️ Could not update the summary of session {session_id}: {e}")
+    finally:
+        with _summary_lock:
+            _summaries_pending.discard(session_id)
+
+def schedule_session_summary(session_id, chat_session):
+    """Refresh the session summary off the request path if enough new messages piled up"""
+    global _summary_executor
+    summary_through = summary_target(chat_session)
+    if SESSION_SUMMARIZER != "app" or summary_through is None or not client or not firebase_initialized or not db:
+        return False
+    with _summary_lock:
+        if session_id in _summaries_pending:
+            return False
+        _summaries_pending.add(session_id)
+        if _summary_executor is None:
+            _summary_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="session-summary")
+    messages = chat_session["messages"][chat_session.get("summaryThrough", 0):summary_through]
+    _summary_executor.submit(update_session_summary, session_id, chat_session.get("summary"), messages, summary_through)
+    return True
 
-    if conversation_history and len(conversation_history) > 0:
-        recent_messages = conversation_history[-5:]  # only the last 5
-        history_prompt = "\nPREVIOUS CONVERSATION CONTEXT:\n"
-        for msg in recent_messages:
-            role = "Student" if msg.get("isUser", msg.get("sender") == "user") else "You (Laith)"
-            content = msg.get("text", msg.get("content", ""))
-            history_prompt += f"{role}: {content}\n"
-        complete_prompt += history_prompt
 
-    return complete_prompt
+# Pre-generated lesson content: see chat_core.LessonContents
+lesson_contents = LessonContents(backend_hooks)
 
 # (6) Firestore Database Utilities
 def safe_firestore_get(collection, document_id, default_value=None):
@@ -246,6 +632,7 @@ def safe_firestore_get(collection, document_id, default_value=None):
         return default_value
     try:
         doc_ref = db.collection(collection).document(document_id).get()
+        FIRESTORE_READS.inc(collection)
         return doc_ref.to_dict() if doc_ref.exists else default_value
     except Exception as e:
         logger.error(f"❌ Firestore get error: {e}", exc_info=True)
@@ -257,13 +644,94 @@ def safe_firestore_set(collection, document_id, data, merge=False):
         return False
     try:
         db.collection(collection).document(document_id).set(data, merge=merge)
+        FIRESTORE_WRITES.inc(collection)
         return True
     except Exception as e:
         logger.error(f"❌ Firestore set error for collection {collection}: {e}", exc_info=True)
         return False
 
+def save_session_messages(session_id, chat_session, messages, is_new_session):
+    """
+    Append `messages` to the stored session. Existing sessions get an
+    update() with ArrayUnion, like add_messages_to_session() in the functions,
+    so a summary stored meanwhile is not overwritten by this request's copy.
+    """
+    if not firebase_initialized or not db:
+        logger.warning("⚠ Firebase not initialized, skipping Firestore update")
+        return False
+    doc_ref = db.collection("chatLogs").document(session_id)
+    try:
+        if is_new_session:
+            try:
+                doc_ref.create(chat_session)
+                FIRESTORE_WRITES.inc("chatLogs")
+                return True
+            except AlreadyExists:
+                # A concurrent request created the session first
+                pass
+        updates = {
+            "messages": firestore.ArrayUnion(messages),
+            "updatedAt": chat_session["updatedAt"],
+            "revision": firestore.Increment(1)
+        }
+        if chat_session.get("summarizer") != SESSION_SUMMARIZER:
+            updates["summarizer"] = SESSION_SUMMARIZER
+        doc_ref.update(updates)
+        FIRESTORE_WRITES.inc("chatLogs")
+        return True
+    except Exception as e:
+        logger.error(f"❌ Firestore update error for session {session_id}: {e}", exc_info=True)
+        return False
+
+# Free-plan quota: see chat_core.usage_month
+def monthly_usage_ref(user_id, month):
+    return db.collection("users").document(user_id).collection(MONTHLY_USAGE_COLLECTION).document(month)
+
+def get_monthly_message_count(user_id, month):
+    """Messages the user sent in `month`, or None if the month has no counter document yet"""
+    if not firebase_initialized or not db:
+        return None
+    try:
+        snapshot = monthly_usage_ref(user_id, month).get()
+        FIRESTORE_READS.inc(MONTHLY_USAGE_COLLECTION)
+        return (snapshot.to_dict() or {}).get("messages", 0) if snapshot.exists else None
+    except Exception as e:
+        logger.error(f"❌ Error reading monthly usage for {user_id}: {e}", exc_info=True)
+        return None
+
+def increment_monthly_message_count(user_id, month, carried=0):
+    """Count one message; `carried` legacy messages are added when the month's document is created"""
+    if not firebase_initialized or not db:
+        return
+    now = datetime.now(timezone.utc)
+    counter = {
+        "month": month,
+        "updatedAt": now.isoformat(),
+        "expiresAt": now + MONTHLY_USAGE_RETENTION
+    }
+    try:
+        usage_ref = monthly_usage_ref(user_id, month)
+        if carried:
+            # create() so only one of two concurrent first requests carries the legacy count over
+            try:
+                usage_ref.create(dict(counter, messages=carried + 1))
+                FIRESTORE_WRITES.inc(MONTHLY_USAGE_COLLECTION)
+                return
+            except AlreadyExists:
+                pass
+        usage_ref.set(dict(counter, messages=firestore.Increment(1)), merge=True)
+        FIRESTORE_WRITES.inc(MONTHLY_USAGE_COLLECTION)
+    except Exception as e:
+        logger.error(f"❌ Error counting monthly usage for {user_id}: {e}", exc_info=True)
+
+# Lesson materials: see chat_core.MaterialsStore. "listen" watches the version
+# document, "poll" re-reads it at most every MATERIALS_POLL_SECONDS, "off"
+# queries the materials collection on every request
+MATERIALS_SYNC_MODE = os.getenv("MATERIALS_SYNC_MODE", "listen")
+materials_store = MaterialsStore(backend_hooks, MATERIALS_SYNC_MODE)
+
 def safe_get_materials(level, week):
-    """Safely get teaching materials from Firestore"""
+    """Safely get teaching materials, from memory unless the lesson changed"""
     if not firebase_initialized or not db:
         logger.warning("⚠️ Firebase not initialized, skipping materials retrieval")
         return []
@@ -272,121 +740,153 @@ def safe_get_materials(level, week):
         # Remove the 'week' prefix if it exists
         clean_week = week.replace('week', '').zfill(2)
         lesson_key = f"{level}_week_{clean_week}"
-        logger.info(f"🔍 Searching for materials with lesson key: {lesson_key}")
-
-        # Query for documents where the ID starts with the lesson key
-        docs = db.collection("materials").where("id", ">=", lesson_key).where("id", "<", lesson_key + "_z").stream()
 
-        # Convert to list of dictionaries
-        materials = [doc.to_dict() for doc in docs]
+        materials = materials_store.get(db, lesson_key)
 
-        logger.info(f"📚 Retrieved {len(materials)} relevant teaching materials.")
-
-        # Log the retrieved materials for debugging
-        for mat in materials:
-            logger.info(f"Retrieved material: {mat['id']}")
+        log_event(
+            "materials_loaded",
+            lesson_key=lesson_key,
+            count=len(materials),
+            version=materials_store.version,
+            material_ids=lambda: [mat.get('id') for mat in materials]
+        )
 
         return materials
     except Exception as e:
         logger.error(f"❌ Error fetching materials: {e}", exc_info=True)
         return []
 
+# Premium entitlement: see chat_core.has_premium_entitlement
 # Check if user has an active subscription
-def check_subscription_status(user_email):
-    """Verify if a user has an active subscription using email as ID"""
+def check_subscription_status(user_email, user_data=None):
+    """Whether the user is entitled to premium; pass the user document if it was already read"""
+    if user_data:
+        return has_premium_entitlement(user_data)
     if not firebase_initialized or not db:
         logger.warning("⚠ Firebase not initialized, skipping subscription check")
         return False
     
     try:
-        # Convert email to consistent user ID format
-        user_id = get_user_id_from_email(user_email)
-        
-        # First check user document for isPremium flag
+        user_id = resolve_user_id(g.get("auth_uid") if has_request_context() else None, user_email)
         user_ref = db.collection("users").document(user_id).get()
-        
+        FIRESTORE_READS.inc("users")
         if not user_ref.exists:
-            # Try with the raw email as fallback
-            user_ref = db.collection("users").document(user_email).get()
-            if user_ref.exists:
-                # Update the user_id to use the raw email if found
-                user_id = user_email
-            else:
-                return False
-            
-        user_data = user_ref.to_dict()
-        
-        # Quick check on isPremium flag
-        if not user_data.get("isPremium", False):
             return False
-            
-        # Verify with subscription document
-        subscription_ref = db.collection("subscriptions").document(user_id).get()
-        
-        if not subscription_ref.exists:
-            # Try with raw email as fallback
-            if user_id != user_email:
-                subscription_ref = db.collection("subscriptions").document(user_email).get()
-                if subscription_ref.exists:
-                    user_id = user_email
-                else:
-                    # Update user document to reflect no subscription
-                    db.collection("users").document(user_id).update({
-                        "isPremium": False,
-                        "updatedAt": datetime.now(timezone.utc).isoformat()
-                    })
-                    return False
-            else:
-                # Update user document to reflect no subscription
-                db.collection("users").document(user_id).update({
-                    "isPremium": False,
-                    "updatedAt": datetime.now(timezone.utc).isoformat()
-                })
-                return False
-            
-        subscription_data = subscription_ref.to_dict()
-        
-        # Check if subscription is active and not expired
-        if subscription_data.get("status") not in ["active", "trial"]:
-            return False
-            
-        # Check expiration date
-        end_date = datetime.fromisoformat(subscription_data.get("endDate", "2000-01-01"))
-        if end_date <= datetime.now(timezone.utc):
-            # Subscription expired, update status
-            db.collection("subscriptions").document(user_id).update({
-                "status": "expired",
-                "updatedAt": datetime.now(timezone.utc).isoformat()
-            })
-            
-            # Update user document
-            db.collection("users").document(user_id).update({
-                "isPremium": False,
-                "updatedAt": datetime.now(timezone.utc).isoformat()
-            })
-            
-            return False
-            
-        # Valid subscription found
-        return True
+
+        return has_premium_entitlement(user_ref.to_dict() or {})
         
     except Exception as e:
         logger.error(f"❌ Error checking subscription status: {e}", exc_info=True)
         return False
 
+# Idempotency store for /ask retries
+def get_idempotency_doc_id(user_email, idempotency_key):
+    """Dedup record ID for an ask request, scoped to the user so keys cannot collide"""
+    return hashlib.sha256(f"{user_email}:{idempotency_key}".encode()).hexdigest()
+
+def claim_idempotency_key(user_email, idempotency_key):
+    """
+    Claim an idempotency key before running the ask pipeline.
+    Returns (claimed, stored_response); a stored response should be replayed,
+    and claimed=False without one means the same key is still being processed.
+    """
+    cache_key = (user_email, idempotency_key)
+    with idempotency_lock:
+        cached = idempotency_cache.get(cache_key)
+    record_cache("idempotency", cached is not None)
+    if cached is not None:
+        return False, attach_current_session(cached)
+
+    if not firebase_initialized or not db:
+        return True, None
+
+    now = datetime.now(timezone.utc)
+    doc_ref = db.collection(IDEMPOTENCY_COLLECTION).document(get_idempotency_doc_id(user_email, idempotency_key))
+    pending = {
+        "userEmail": user_email,
+        "status": "pending",
+        "createdAt": now.isoformat(),
+        "expiresAt": now + IDEMPOTENCY_TTL
+    }
+    try:
+        doc_ref.create(pending)
+        return True, None
+    except AlreadyExists:
+        snapshot = doc_ref.get()
+        record = snapshot.to_dict() or {}
+    except Exception as e:
+        logger.error(f"❌ Error claiming idempotency key: {e}", exc_info=True)
+        return True, None
+
+    if record.get("expiresAt") and record["expiresAt"] <= now:
+        # Firestore TTL deletion is lazy, so treat expired records as absent
+        return take_over_idempotency_key(doc_ref, snapshot, pending), None
+
+    if record.get("status") == "completed":
+        stored = json.loads(record["response"])
+        with idempotency_lock:
+            idempotency_cache[cache_key] = stored
+        return False, attach_current_session(stored)
+
+    if record.get("status") == "pending" and datetime.fromisoformat(record["createdAt"]) + IDEMPOTENCY_PENDING_TIMEOUT <= now:
+        # The attempt holding the claim died without releasing it
+        return take_over_idempotency_key(doc_ref, snapshot, pending), None
+
+    return False, None
+
+def take_over_idempotency_key(doc_ref, snapshot, pending):
+    """Replace a stale claim, unless a concurrent retry replaced it first"""
+    try:
+        doc_ref.update(pending, option=db.write_option(last_update_time=snapshot.update_time))
+        FIRESTORE_WRITES.inc(IDEMPOTENCY_COLLECTION)
+        return True
+    except (FailedPrecondition, NotFound):
+        return False
+
+def store_idempotent_response(user_email, idempotency_key, response_body):
+    """Persist a successful answer so retries with the same key can replay it"""
+    # The chat session is re-read on replay rather than duplicated in the dedup store
+    stored = {k: v for k, v in response_body.items() if k != "chatSession"}
+    with idempotency_lock:
+        idempotency_cache[(user_email, idempotency_key)] = stored
+    safe_firestore_set(IDEMPOTENCY_COLLECTION, get_idempotency_doc_id(user_email, idempotency_key), {
+        "status": "completed",
+        "response": json.dumps(stored),
+        "updatedAt": datetime.now(timezone.utc).isoformat()
+    }, merge=True)
+
+def release_idempotency_key(user_email, idempotency_key):
+    """Drop a claim after a failed attempt so the client's retry is processed normally"""
+    if not firebase_initialized or not db:
+        return
+    try:
+        db.collection(IDEMPOTENCY_COLLECTION).document(get_idempotency_doc_id(user_email, idempotency_key)).delete()
+    except Exception as e:
+        logger.error(f"❌ Error releasing idempotency key: {e}", exc_info=True)
+
+def attach_current_session(stored_response):
+    """Return a replayable response with the up-to-date chat session attached"""
+    response = dict(stored_response)
+    chat_session = safe_firestore_get("chatLogs", response["sessionId"])
+    if chat_session:
+        response["chatSession"] = chat_session
+    return response
+
 # (7) Ask Endpoint
 @app.route('/ask', methods=['POST'])
 def ask():
     """
     Processes user messages, enforces usage limits for non-premium users,
     integrates with OpenAI (optional), and stores conversation logs in Firestore.
+    Requests carrying an Idempotency-Key header are answered at most once.
     """
     try:
         logger.info("📝 Received request to /ask endpoint")
     
-        user_email, error = verify_token()
+        with timed_stage("auth"):
+            user_email, error = verify_token()
         if error:
-            logger.warning(f"🔒 Authentication error: {error}")
+            logger.warning("🔒 Authentication error: %s", error)
             return jsonify({"error": error}), 401
             
         data = request.json
@@ -407,155 +907,244 @@ def ask():
 
         # Ensure we have an email
         if not user_email or '@' not in user_email:
-            logger.warning(f"⚠ Invalid user email: {user_email}")
+            logger.warning("⚠ Invalid user email: %s", user_email)
             return jsonify({"error": "Valid user email required"}), 400
-        
-        # Convert email to consistent user ID format
-        user_id = get_user_id_from_email(user_email)
-        
-        # Create a session ID based on the user's email
-        session_id = f"session_{user_email.split('@')[0]}"
-        session['conversation_id'] = session_id
 
-        logger.info(f"Session ID: {session_id}, User ID: {user_id}, Email: {user_email}")
+        # Retries carrying the same Idempotency-Key get the stored answer
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER, '').strip()
+        if idempotency_key:
+            claimed, stored_response = claim_idempotency_key(user_email, idempotency_key)
+            if stored_response is not None:
+                ASK_REQUESTS.inc("replayed")
+                log_event("ask_replayed", email=user_email)
+                return jsonify(stored_response), 200, {IDEMPOTENT_REPLAY_HEADER: "true"}
+            if not claimed:
+                ASK_REQUESTS.inc("conflict")
+                return jsonify({"error": "A request with this idempotency key is already in progress"}), 409
+
+        try:
+            response_body, status = answer_question(user_email, question, week, level, gender, language)
+        except Exception:
+            if idempotency_key:
+                release_idempotency_key(user_email, idempotency_key)
+            raise
+
+        # Only answers are replayed; a retry after a 503 asks OpenAI again
+        if idempotency_key:
+            if status == 200:
+                store_idempotent_response(user_email, idempotency_key, response_body)
+            else:
+                release_idempotency_key(user_email, idempotency_key)
+
+        if status != 200:
+            ASK_REQUESTS.inc("unavailable")
+            return jsonify(response_body), status
+        ASK_REQUESTS.inc("limited" if response_body.get("isSubscriptionLimit") else "answered")
+        return jsonify(response_body)
+    except Exception as e:
+        ASK_REQUESTS.inc("error")
+        stack_trace = traceback.format_exc()
+        logger.error("❌ Unhandled error in /ask endpoint: %s\n%s", e, stack_trace)
+        return jsonify({
+            "error": "An unexpected error occurred",
+            "message": f"Error: {str(e)}"
+        }), 500
+
+def answer_question(user_email, question, week, level, gender, language):
+    """
+    Runs the ask pipeline for an authenticated user and returns (response body, status).
+    Without OpenAI and without a dictionary fallback it answers 503 and saves nothing.
+    """
+    # Canonical user document ID (uid, or a legacy email-based ID)
+    with timed_stage("identity"):
+        user_id = resolve_user_id(g.get("auth_uid"), user_email)
 
-        # Retrieve user data from Firestore or create if none
+    # Create a session ID based on the user's email
+    session_id = f"session_{user_email.split('@')[0]}"
+    session['conversation_id'] = session_id
+
+    log_event("ask_started", session_id=session_id, user_id=user_id, email=user_email)
+
+    # Retrieve user data from Firestore or create if none
+    with timed_stage("user_doc"):
         user_data = safe_firestore_get("users", user_id, {})
         if not user_data:
-            # Try with raw email as fallback
-            user_data = safe_firestore_get("users", user_email, {})
-            if user_data:
-                # Use the raw email as user_id if that's where the data is
-                user_id = user_email
-            else:
-                # Create new user document
-                user_data = {
-                    "userId": user_id,
-                    "email": user_email,
-                    "createdAt": datetime.now(timezone.utc).isoformat(),
-                    "totalMessages": {},
-                    "isPremium": False
-                }
-                safe_firestore_set("users", user_id, user_data)
-
-        # Check if user has premium access
-        has_premium = check_subscription_status(user_email)
-        
-        # Usage Limiter for non-premium users
-        if not has_premium:
-            current_month = datetime.now().strftime("%m_%y")
-            total_messages = user_data.get("totalMessages", {}).get(current_month, 0)
-            
-            # If not premium and beyond limit, stop here
-            if total_messages >= 50:
-                limit_message = {
-                    "answer": "You have reached your monthly limit of 50 messages. Please upgrade to premium for unlimited access.",
-                    "_id": session_id,
-                    "sessionId": session_id,
-                    "isSubscriptionLimit": True,
-                    "upgradeLink": "/subscription"
-                }
-                return jsonify(limit_message), 200
-
-            # Update message count for free users
-            safe_firestore_set(
-                "users",
-                user_id,
-                {"totalMessages": {current_month: total_messages + 1}},
-                merge=True
-            )
-
-        # Retrieve chat session from Firestore
-        logger.info(f"🔍 User data retrieved: {user_data}")
-        chat_session = safe_firestore_get("chatLogs", session_id)
-        logger.info(f"🔍 Retrieved chat session from Firestore: {chat_session}")
+            # Create new user document
+            user_data = {
+                "userId": user_id,
+                "email": user_email,
+                "createdAt": datetime.now(timezone.utc).isoformat(),
+                "isPremium": False
+            }
+            safe_firestore_set("users", user_id, user_data)
 
-        if not chat_session:
-            chat_session = {
+    # Check if user has premium access
+    with timed_stage("subscription"):
+        has_premium = check_subscription_status(user_email, user_data)
+    
+    # Usage Limiter for non-premium users
+    if not has_premium:
+        with timed_stage("quota"):
+            current_month = usage_month()
+            total_messages = get_monthly_message_count(user_id, current_month)
+            carried = 0
+            if total_messages is None:
+                carried = total_messages = legacy_message_count(user_data, current_month)
+        
+        # If not premium and beyond limit, stop here
+        if total_messages >= MAX_MONTHLY_MESSAGES:
+            limit_message = {
+                "answer": f"You have reached your monthly limit of {MAX_MONTHLY_MESSAGES} messages. Please upgrade to premium for unlimited access.",
                 "_id": session_id,
-                "userId": user_email,
-                "userEmail": user_email,
-                "userName": user_data.get("displayName", user_email.split('@')[0]),
-                "messages": [],
-                "createdAt": datetime.now(timezone.utc).isoformat(),
-                "updatedAt": datetime.now(timezone.utc).isoformat(),
-                "level": level,
-                "language": language,
-                "week": week,
-                "gender": gender
+                "sessionId": session_id,
+                "isSubscriptionLimit": True,
+                "upgradeLink": "/subscription"
             }
+            return limit_message, 200
 
-        conversation_history = chat_session.get("messages", [])
+        # Update message count for free users
+        increment_monthly_message_count(user_id, current_month, carried)
 
-        # Append the user's message
-        user_message = {
-            "id": f"{user_id}_{str(uuid.uuid4())}",
-            "sender": "user",
-            "text": question,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "isUser": True
+    # Retrieve chat session from Firestore
+    with timed_stage("session_load"):
+        chat_session = safe_firestore_get("chatLogs", session_id)
+    log_event(
+        "session_loaded",
+        session_id=session_id,
+        is_premium=has_premium,
+        message_count=len(chat_session.get("messages", [])) if chat_session else 0
+    )
+
+    if not chat_session:
+        chat_session = {
+            "_id": session_id,
+            "userId": user_email,
+            "userEmail": user_email,
+            "userName": user_data.get("displayName", user_email.split('@')[0]),
+            "messages": [],
+            "createdAt": datetime.now(timezone.utc).isoformat(),
+            "updatedAt": datetime.now(timezone.utc).isoformat(),
+            "level": level,
+            "language": language,
+            "week": week,
+            "gender": gender,
+            "summarizer": SESSION_SUMMARIZER
         }
-        conversation_history.append(user_message)
-
-        # Retrieve materials
+        is_new_session = True
+    else:
+        is_new_session = False
+
+    conversation_history = chat_session.get("messages", [])
+
+    # Append the user's message
+    user_message = {
+        "id": f"{user_id}_{str(uuid.uuid4())}",
+        "sender": "user",
+        "text": question,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "isUser": True
+    }
+    conversation_history.append(user_message)
+
+    # Retrieve materials
+    with timed_stage("materials"):
         materials = safe_get_materials(level, week)
-        prompt = create_arabic_teaching_prompt(level, week, question, gender, language, materials, conversation_history)
 
-        # If OpenAI is configured, generate a response
-        if not client:
+    # Vocabulary lookups are answered straight from the materials, without the LLM
+    with timed_stage("dictionary"):
+        bot_answer = answer_from_dictionary(question, materials, language)
+    answer_source = "dictionary"
+    token_usage = None
+    record_cache("dictionary", bool(bot_answer))
+
+    # So are plain requests for the lesson's practice dialogues, drills and quizzes
+    if not bot_answer:
+        with timed_stage("lesson_content"):
+            bot_answer = lesson_contents.answer(db, question, materials, gender, language)
+        answer_source = "lesson_content"
+
+    if not bot_answer and not client:
+        bot_answer = answer_from_dictionary(question, materials, language, fallback=True)
+        answer_source = "dictionary_fallback"
+        if not bot_answer:
             logger.warning("OpenAI client not available, returning mock response in dev mode.")
             bot_answer = "This is a mock response; OpenAI is not configured."
-        else:
-            try:
-                # Call ChatCompletion
-                response = client.chat.completions.create(
-                    model="gpt-4-turbo",
+            answer_source = "mock"
+    elif not bot_answer:
+        with timed_stage("prompt_build"):
+            prompt = create_arabic_teaching_prompt(level, week, question, gender, language, materials, conversation_history,
+                                                   chat_session.get("summary"))
+        route = classify_question(question)
+        model = MODEL_ROUTES[route]["model"]
+        try:
+            # Call ChatCompletion
+            with timed_stage("llm"):
+                started = time.perf_counter()
+                response = create_chat_completion(
+                    client,
+                    model=model,
                     messages=[
                         {"role": "system", "content": prompt},
                         {"role": "user", "content": question}
                     ],
                     temperature=0.3,
-                    max_tokens=1000
+                    max_tokens=MODEL_ROUTES[route]["max_tokens"]
                 )
-                bot_answer = response.choices[0].message.content
-
-            except Exception as openai_error:
-                logger.error(f"❌ OpenAI error: {openai_error}", exc_info=True)
-                bot_answer = "We encountered an issue calling OpenAI. Please try again later."
-
-        # Append the bot's message
-        bot_message = {
-            "id": f"{user_id}_{str(uuid.uuid4())}",
-            "sender": "bot",
-            "text": bot_answer,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "isUser": False
-        }
-        conversation_history.append(bot_message)
-
-        # Update the chat session data
-        chat_session["messages"] = conversation_history
-        chat_session["updatedAt"] = datetime.now(timezone.utc).isoformat()
-
-        # Save to Firestore
-        safe_firestore_set("chatLogs", session_id, chat_session)
-        logger.info(f"📝 Chat session saved to Firestore: {session_id}")
-
-        return jsonify({
-            "answer": bot_answer,
-            "language": language,
-            "direction": "rtl" if language == 'arabic' else "ltr",
-            "_id": session_id,
-            "sessionId": session_id,
-            "chatSession": chat_session
-        })
-    except Exception as e:
-        stack_trace = traceback.format_exc()
-        logger.error(f"❌ Unhandled error in /ask endpoint: {e}\n{stack_trace}")
-        return jsonify({
-            "error": "An unexpected error occurred",
-            "message": f"Error: {str(e)}"
-        }), 500
+            record_llm_route(route, model, time.perf_counter() - started, response.usage)
+            record_token_usage(model, response.usage)
+            token_usage = response.usage
+            bot_answer = response.choices[0].message.content
+            answer_source = "llm"
+
+        except Exception as openai_error:
+            if isinstance(openai_error, LLMUnavailable):
+                logger.warning(f"⚠️ OpenAI unavailable: {openai_error}")
+            else:
+                logger.error("❌ OpenAI error: %s", openai_error, exc_info=True)
+            # With OpenAI unavailable, still answer whatever the materials cover
+            bot_answer = answer_from_dictionary(question, materials, language, fallback=True)
+            answer_source = "dictionary_fallback"
+            if not bot_answer and isinstance(openai_error, LLMUnavailable):
+                return {
+                    "error": LLM_UNAVAILABLE_ANSWER,
+                    "degraded": True,
+                    "retryAfter": round(openai_error.retry_after or LLM_RETRY_MAX_DELAY)
+                }, 503
+            if not bot_answer:
+                return {"error": "We encountered an issue calling OpenAI. Please try again later."}, 503
+
+    # Append the bot's message
+    bot_message = {
+        "id": f"{user_id}_{str(uuid.uuid4())}",
+        "sender": "bot",
+        "text": bot_answer,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "isUser": False,
+        "source": answer_source
+    }
+    conversation_history.append(bot_message)
+
+    # Update the chat session data
+    chat_session["messages"] = conversation_history
+    chat_session["updatedAt"] = datetime.now(timezone.utc).isoformat()
+    chat_session["revision"] = chat_session.get("revision", 0) + 1
+
+    # Save to Firestore
+    with timed_stage("persistence"):
+        save_session_messages(session_id, chat_session, [user_message, bot_message], is_new_session)
+        record_usage(level, week, has_premium, answer_source, token_usage)
+    schedule_session_summary(session_id, chat_session)
+    log_event("ask_completed", session_id=session_id, message_count=len(conversation_history))
+
+    return {
+        "answer": bot_answer,
+        "language": language,
+        "direction": "rtl" if language == 'arabic' else "ltr",
+        "_id": session_id,
+        "sessionId": session_id,
+        "chatSession": chat_session,
+        "answerSource": answer_source
+    }, 200
 
 # (8) Aliased Ask Endpoint
 @app.route('/api/ask', methods=['POST'])
@@ -563,6 +1152,20 @@ def api_ask():
     return ask()
 
 # (9) Chat Log Management
+# Conditional GETs: ETags from chat_core.version_etag, bodiless 304s on a match
+_materials_listing = None   # (version, etag, items) of the last materials collection read
+_materials_listing_lock = threading.Lock()
+
+def conditional_json(etag, build, cache_control="private, no-cache"):
+    """304 when the client holds `etag`, otherwise the JSON of build(); both carry the ETag"""
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag, weak=True)
+    response.headers["Cache-Control"] = cache_control
+    return response
+
 @app.route('/api/chatlogs', methods=['GET'])
 def get_chatlogs():
     """
@@ -575,8 +1178,9 @@ def get_chatlogs():
             
         logger.info("📋 Attempting to fetch chat logs from Firestore")
         try:
-            chat_docs = db.collection("chatLogs").stream()
-            chat_logs = [doc.to_dict() for doc in chat_docs]
+            chat_docs = db.collection("chatLogs").select(CHAT_LISTING_FIELDS).stream()
+            chat_logs = [(doc.id, doc.to_dict() or {}) for doc in chat_docs]
+            FIRESTORE_READS.inc("chatLogs", amount=max(len(chat_logs), 1))
             logger.info(f"✅ Successfully retrieved {len(chat_logs)} chat logs")
         except Exception as firebase_error:
             logger.error(f"❌ Firebase error retrieving chat logs: {firebase_error}", exc_info=True)
@@ -599,7 +1203,7 @@ def get_chatlogs():
         # Apply filters
         if search_term:
             chat_logs = [
-                c for c in chat_logs
+                (doc_id, c) for doc_id, c in chat_logs
                 if search_term in c.get("userName", "").lower()
                 or search_term in c.get("userId", "").lower()
                 or search_term in c.get("userEmail", "").lower()
@@ -609,14 +1213,14 @@ def get_chatlogs():
         # Filter by userId
         if user_filter:
             chat_logs = [
-                c for c in chat_logs 
+                (doc_id, c) for doc_id, c in chat_logs
                 if user_filter in c.get("userId", "").lower()
             ]
 
         # Filter by userEmail
         if email_filter:
             chat_logs = [
-                c for c in chat_logs
+                (doc_id, c) for doc_id, c in chat_logs
                 if email_filter in c.get("userEmail", "").lower()
             ]
 
@@ -633,25 +1237,261 @@ def get_chatlogs():
                     dt = datetime.fromisoformat(created)
                     return from_dt <= dt <= to_dt
 
-                chat_logs = [c for c in chat_logs if in_range(c)]
+                chat_logs = [(doc_id, c) for doc_id, c in chat_logs if in_range(c)]
             except Exception as date_err:
                 logger.error(f"Date parsing error: {date_err}")
 
         # Sort by createdAt descending
-        chat_logs.sort(key=lambda x: x.get("createdAt", ""), reverse=True)
+        chat_logs.sort(key=lambda x: x[1].get("createdAt", ""), reverse=True)
 
         # Pagination
         total = len(chat_logs)
         total_pages = (total + page_size - 1) // page_size
         start = (page - 1) * page_size
         end = start + page_size
-        paginated_logs = chat_logs[start:end]
+        page_ids = [doc_id for doc_id, _ in chat_logs[start:end]]
+        etag = version_etag(total_pages, [session_version(doc_id, c) for doc_id, c in chat_logs[start:end]])
 
-        return jsonify({"chats": paginated_logs, "totalPages": total_pages}), 200
+        def load_page():
+            collection = db.collection("chatLogs")
+            sessions = {doc.id: doc.to_dict() for doc in db.get_all([collection.document(doc_id) for doc_id in page_ids])
+                        if doc.exists}
+            FIRESTORE_READS.inc("chatLogs", amount=len(page_ids))
+            return {"chats": [sessions[doc_id] for doc_id in page_ids if doc_id in sessions], "totalPages": total_pages}
+
+        return conditional_json(etag, load_page)
     except Exception as e:
         logger.error(f"Error retrieving chat logs: {e}", exc_info=True)
         return jsonify({"error": "Failed to retrieve chat logs", "message": str(e)}), 500
 
+@app.route('/api/chatlogs/<session_id>', methods=['GET'])
+def get_chatlog(session_id):
+    """One chat session; a revalidation reads only the version fields while nothing changed"""
+    try:
+        doc_ref = db.collection("chatLogs").document(session_id)
+        if request.if_none_match:
+            version = doc_ref.get(field_paths=CHAT_VERSION_FIELDS)
+            FIRESTORE_READS.inc("chatLogs")
+            if not version.exists:
+                return jsonify({"error": "Chat session not found"}), 404
+            etag = version_etag(*session_version(session_id, version.to_dict() or {}))
+            if request.if_none_match.contains_weak(etag):
+                return conditional_json(etag, None)
+        snapshot = doc_ref.get()
+        FIRESTORE_READS.inc("chatLogs")
+        if not snapshot.exists:
+            return jsonify({"error": "Chat session not found"}), 404
+        chat_session = snapshot.to_dict()
+        return conditional_json(version_etag(*session_version(session_id, chat_session)), lambda: chat_session)
+    except Exception as e:
+        logger.error(f"Error retrieving chat log {session_id}: {e}", exc_info=True)
+        return jsonify({"error": "Failed to retrieve chat log", "message": str(e)}), 500
+
+def materials_listing():
+    """(version, etag, items) of the materials collection, read once per published version"""
+    global _materials_listing
+    materials_store.refresh(db)
+    version = materials_store.version
+    listing = _materials_listing
+    if version is not None and listing is not None and listing[0] == version:
+        return listing
+    items = [{"id": doc.id, **(doc.to_dict() or {})} for doc in db.collection("materials").stream()]
+    FIRESTORE_READS.inc("materials", amount=max(len(items), 1))
+    items.sort(key=lambda item: str(item["id"]))
+    # Without a published version the content itself is the validator
+    listing = (version, version_etag("materials", version if version is not None else items), items)
+    if version is not None:
+        with _materials_listing_lock:
+            _materials_listing = listing
+    return listing
+
+@app.route('/api/materials', methods=['GET'])
+def get_materials_listing():
+    """All teaching materials; while the version is unchanged they come from memory, or as a 304"""
+    try:
+        if not firebase_initialized or not db:
+            return jsonify({"materials": [], "version": None}), 200
+        version, etag, items = materials_listing()
+        return conditional_json(etag, lambda: {"materials": items, "version": version}, cache_control="no-cache")
+    except Exception as e:
+        logger.error(f"Error retrieving materials: {e}", exc_info=True)
+        return jsonify({"error": "Failed to retrieve materials", "message": str(e)}), 500
+
+# Chat log export: see chat_core.export_session_rows
+EXPORT_PAGE_SIZE = int(os.getenv("EXPORT_PAGE_SIZE", "100"))
+
+def iter_export_sessions(filters, after_session_id=None, page_size=EXPORT_PAGE_SIZE):
+    """(session_id, session) for chat logs matching the equality filters, one page in memory at a time"""
+    query = db.collection("chatLogs")
+    for field, value in filters.items():
+        query = query.where(field, "==", value)
+    query = query.order_by(FieldPath.document_id()).limit(page_size)
+    while True:
+        page = query.start_after({FieldPath.document_id(): after_session_id}) if after_session_id else query
+        docs = list(page.stream())
+        FIRESTORE_READS.inc("chatLogs", amount=max(len(docs), 1))
+        for doc in docs:
+            yield doc.id, doc.to_dict()
+        if len(docs) < page_size:
+            return
+        after_session_id = docs[-1].id
+
+def generate_export(kind, export_format, filters, after_session_id, date_from, date_to, max_sessions):
+    """Yields the export one session at a time"""
+    fields = EXPORT_FIELDS[kind]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    if export_format == "csv":
+        writer.writeheader()
+        yield buffer.getvalue()
+
+    sessions_exported = rows_exported = 0
+    for session_id, chat_session in iter_export_sessions(filters, after_session_id):
+        if max_sessions and sessions_exported >= max_sessions:
+            break
+        rows = export_session_rows(kind, session_id, chat_session, date_from, date_to)
+        if not rows:
+            continue
+        if export_format == "csv":
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue()
+        else:
+            yield "".join(app.json.dumps({field: row.get(field) for field in fields}) + "\n" for row in rows)
+        sessions_exported += 1
+        rows_exported += len(rows)
+    log_event("chatlogs_exported", kind=kind, format=export_format, sessions=sessions_exported, rows=rows_exported)
+
+@app.route('/api/chatlogs/export', methods=['GET'])
+def export_chatlogs():
+    """
+    Stream chat logs as NDJSON or CSV.
+    Query: format=ndjson|csv, rows=messages|sessions, userId, userEmail, level, week,
+    dateFrom/dateTo (ISO, applied to message timestamps), cursor, limit (sessions).
+    Admins only: the rows carry every user's messages and email.
+    """
+    _, denied = verify_admin()
+    if denied:
+        return denied
+    if not firebase_initialized or not db:
+        return jsonify({"error": "Firebase not initialized"}), 503
+
+    export_format = request.args.get("format", "ndjson").lower()
+    kind = request.args.get("rows", "messages").lower()
+    if export_format not in EXPORT_CONTENT_TYPES or kind not in EXPORT_FIELDS:
+        return jsonify({"error": "format must be ndjson or csv and rows must be messages or sessions"}), 400
+    try:
+        cursor = request.args.get("cursor")
+        after_session_id = decode_export_cursor(cursor) if cursor else None
+        date_from = parse_export_date(request.args.get("dateFrom"))
+        date_to = parse_export_date(request.args.get("dateTo"))
+        max_sessions = int(request.args.get("limit", 0))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    filters = {field: request.args[field] for field in EXPORT_FILTER_FIELDS if request.args.get(field)}
+
+    log_event("chatlogs_export_started", kind=kind, format=export_format, filters=filters, resumed=bool(after_session_id))
+    generator = generate_export(kind, export_format, filters, after_session_id, date_from, date_to, max_sessions)
+    return app.response_class(stream_with_context(generator), content_type=EXPORT_CONTENT_TYPES[export_format], headers={
+        "Content-Disposition": f'attachment; filename="chatlogs-{kind}.{export_format}"',
+        "Cache-Control": "no-store",
+    })
+
+# Usage rollups: see chat_core.usage_periods
+USAGE_STATS_CACHE_TTL_SECONDS = int(os.getenv("USAGE_STATS_CACHE_TTL_SECONDS", "60"))
+_usage_stats_cache = TTLCache(maxsize=64, ttl=USAGE_STATS_CACHE_TTL_SECONDS)
+_usage_stats_lock = threading.Lock()
+
+def record_usage(level, week, is_premium, answer_source, token_usage=None):
+    """Add one answered question (a user and a bot message) to today's and this month's rollups"""
+    if not firebase_initialized or not db:
+        return
+    now = datetime.now(timezone.utc)
+    shard = random.randrange(USAGE_SHARDS)
+    counters = {
+        "messages": firestore.Increment(2),
+        "questions": firestore.Increment(1),
+        "sources": {usage_key(answer_source): firestore.Increment(1)},
+        "lessons": {usage_key(f"{level}_{week}"): firestore.Increment(1)},
+        "plans": {"premium" if is_premium else "free": firestore.Increment(1)},
+    }
+    if token_usage is not None:
+        counters["tokens"] = {
+            "prompt": firestore.Increment(token_usage.prompt_tokens or 0),
+            "completion": firestore.Increment(token_usage.completion_tokens or 0),
+        }
+    try:
+        mark_usage_live(db, backend_hooks)
+        batch = db.batch()
+        for granularity, period_format in USAGE_GRANULARITIES.items():
+            period = now.strftime(period_format)
+            doc_ref = db.collection(USAGE_COLLECTION).document(f"{granularity}_{period}_{shard}")
+            batch.set(doc_ref, dict(counters, granularity=granularity, period=period, updatedAt=now.isoformat()), merge=True)
+        batch.commit()
+        FIRESTORE_WRITES.inc(USAGE_COLLECTION, amount=len(USAGE_GRANULARITIES))
+    except Exception as e:
+        logger.warning(f"⚠️ Usage rollup update failed: {e}")
+
+def load_usage_stats(granularity, periods):
+    """Counters per period, summed over shards; one query however many messages there were"""
+    docs = db.collection(USAGE_COLLECTION) \
+        .where("granularity", "==", granularity) \
+        .where("period", ">=", periods[0]) \
+        .where("period", "<=", periods[-1]) \
+        .stream()
+    by_period = {period: {"messages": 0, "questions": 0} for period in periods}
+    read_count = 0
+    for doc in docs:
+        read_count += 1
+        data = doc.to_dict()
+        if data.get("period") in by_period:
+            add_usage_counters(by_period[data["period"]], {field: data[field] for field in USAGE_COUNTER_FIELDS if field in data})
+    FIRESTORE_READS.inc(USAGE_COLLECTION, amount=max(read_count, 1))
+    return [dict(counters, period=period) for period, counters in by_period.items()]
+
+@app.route('/api/usage/stats', methods=['GET'])
+def get_usage_stats():
+    """
+    Usage rollups for dashboards.
+    Query: granularity=day|month (default day), from/to (YYYY-MM-DD or YYYY-MM;
+    default the last 30 days or 12 months). Admins only.
+    """
+    _, denied = verify_admin()
+    if denied:
+        return denied
+    if not firebase_initialized or not db:
+        return jsonify({"error": "Firebase not initialized"}), 503
+
+    granularity = request.args.get("granularity", "day")
+    if granularity not in USAGE_GRANULARITIES:
+        return jsonify({"error": "granularity must be day or month"}), 400
+    try:
+        end = parse_usage_date(request.args["to"]) if request.args.get("to") else datetime.now(timezone.utc).date()
+        default_span = timedelta(days=29) if granularity == "day" else timedelta(days=334)
+        start = parse_usage_date(request.args["from"]) if request.args.get("from") else end - default_span
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e}"}), 400
+    if granularity == "month":
+        start, end = start.replace(day=1), end.replace(day=1)
+    periods = usage_periods(granularity, start, end)
+    if not periods or len(periods) > USAGE_MAX_PERIODS[granularity]:
+        return jsonify({"error": f"from/to must span 1 to {USAGE_MAX_PERIODS[granularity]} {granularity}s"}), 400
+
+    cache_key = (granularity, periods[0], periods[-1])
+    with _usage_stats_lock:
+        cached = _usage_stats_cache.get(cache_key)
+    record_cache("usage_stats", cached is not None)
+    if cached is None:
+        stats = load_usage_stats(granularity, periods)
+        totals = {}
+        for counters in stats:
+            add_usage_counters(totals, {field: counters[field] for field in USAGE_COUNTER_FIELDS if field in counters})
+        cached = {"granularity": granularity, "from": periods[0], "to": periods[-1], "periods": stats, "totals": totals}
+        with _usage_stats_lock:
+            _usage_stats_cache[cache_key] = cached
+    return jsonify(cached), 200
+
 @app.route('/api/chatlogs/<session_id>', methods=['DELETE'])
 def delete_chatlog(session_id):
     try:
@@ -673,9 +1513,118 @@ def delete_all_chatlogs():
         return jsonify({"error": "Failed to delete all chat logs", "message": str(e)}), 500
 
 # (10) Frontend Serving
+# Precompressed variants and ETags come from compress_static.py (run after
+# `vite build`); without its manifest, files are served as-is with stat ETags.
+# Entries are cached for the life of the process, so restart after a rebuild.
+STATIC_ROOT = os.path.join(app.root_path, 'build')
+STATIC_MANIFEST = '.static-manifest.json'
+STATIC_INDEX = 'index.html'
+STATIC_ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+# Vite emits content-hashed bundles under assets/, e.g. assets/index-3f9a1c2b.js
+HASHED_ASSET = re.compile(r'^assets/.+[-.][A-Za-z0-9_-]{8,}\.\w+$')
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+STATIC_CACHE_CONTROL = "public, max-age=3600"
+INDEX_CACHE_CONTROL = "no-cache"
+STATIC_MEMORY_MAX_BYTES = 256 * 1024
+
+class StaticAssets:
+    """Files of the frontend build with their ETag, cache policy and compressed variants"""
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._manifest = None
+
+    def _manifest_files(self):
+        if self._manifest is None:
+            try:
+                with open(os.path.join(self.root, STATIC_MANIFEST), encoding='utf-8') as file:
+                    self._manifest = json.load(file).get("files") or {}
+            except (OSError, ValueError):
+                self._manifest = {}
+        return self._manifest
+
+    def _load(self, path):
+        full_path = safe_join(self.root, path)
+        if full_path is None or not os.path.isfile(full_path):
+            return None
+        stat = os.stat(full_path)
+        known = self._manifest_files().get(path)
+        if known and known.get("size") == stat.st_size:
+            etag, encodings = known["etag"], known.get("encodings") or []
+        else:
+            etag = f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+            encodings = [encoding for encoding, suffix in STATIC_ENCODINGS if os.path.isfile(full_path + suffix)]
+
+        variants = {"identity": full_path}
+        for encoding, suffix in STATIC_ENCODINGS:
+            if encoding in encodings:
+                variants[encoding] = full_path + suffix
+        # Small files (index.html, most bundles) are answered from memory
+        cached = {}
+        for encoding, variant_path in variants.items():
+            if os.path.getsize(variant_path) <= STATIC_MEMORY_MAX_BYTES:
+                with open(variant_path, 'rb') as file:
+                    cached[encoding] = file.read()
+
+        if path == STATIC_INDEX:
+            cache_control = INDEX_CACHE_CONTROL
+        elif HASHED_ASSET.match(path):
+            cache_control = IMMUTABLE_CACHE_CONTROL
+        else:
+            cache_control = STATIC_CACHE_CONTROL
+        return {
+            "etag": etag,
+            "variants": variants,
+            "cached": cached,
+            "mimetype": mimetypes.guess_type(path)[0] or "application/octet-stream",
+            "cache_control": cache_control,
+        }
+
+    def entry(self, path):
+        entry = self._entries.get(path)
+        if entry is None:
+            entry = self._load(path)
+            if entry is not None:
+                with self._lock:
+                    self._entries = {**self._entries, path: entry}
+        return entry
+
+    def response(self, path):
+        """Response for a built file (304 when the client's copy is current), or None if there is no such file"""
+        entry = self.entry(path)
+        if entry is None:
+            return None
+        encoding = next((name for name, _ in STATIC_ENCODINGS
+                         if name in entry["variants"] and request.accept_encodings[name]), "identity")
+        etag = entry["etag"] if encoding == "identity" else f"{entry['etag']}-{encoding}"
+
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+        elif encoding in entry["cached"]:
+            response = app.response_class(entry["cached"][encoding], mimetype=entry["mimetype"])
+        else:
+            response = send_file(entry["variants"][encoding], mimetype=entry["mimetype"], conditional=False, etag=False)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+        if len(entry["variants"]) > 1:
+            response.headers["Vary"] = "Accept-Encoding"
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = entry["cache_control"]
+        return response
+
+    def index_response(self):
+        """The SPA shell, for client-side routes"""
+        response = self.response(STATIC_INDEX)
+        if response is None:
+            abort(404)
+        return response
+
+static_assets = StaticAssets(STATIC_ROOT)
+
 @app.route('/')
 def serve():
-    return send_from_directory(app.static_folder, 'index.html')
+    return static_assets.index_response()
 
 
 @app.route('/api/subscription/info', methods=['GET'])
@@ -692,8 +1641,8 @@ def get_subscription_info():
         if not user_email:
             return jsonify({"error": "User email not found"}), 400
             
-        # Get user ID from email
-        user_id = get_user_id_from_email(user_email)
+        # Canonical user ID, which also keys the subscription
+        user_id = resolve_user_id(g.get("auth_uid"), user_email)
         
         if not firebase_initialized or not db:
             logger.warning("⚠ Firebase not initialized, returning empty subscription")
@@ -708,26 +1657,15 @@ def get_subscription_info():
                 return jsonify({"subscription": None}), 200
                 
             subscription_data = subscription_ref.to_dict()
+            end_date = subscription_end(subscription_data.get("endDate"))
             
-            # Check if subscription is still valid
-            if subscription_data.get("status") in ["active", "trial"]:
-                end_date = datetime.fromisoformat(subscription_data.get("endDate").replace('Z', '+00:00') if subscription_data.get("endDate").endswith('Z') else subscription_data.get("endDate"))
-                
-                if end_date <= datetime.now(timezone.utc):
-                    # Subscription expired
-                    subscription_data["status"] = "expired"
-                    
-                    # Update status in Firestore
-                    db.collection("subscriptions").document(user_id).update({
-                        "status": "expired",
-                        "updatedAt": datetime.now(timezone.utc).isoformat()
-                    })
-                    
-                    # Update user's premium status
-                    db.collection("users").document(user_id).update({
-                        "isPremium": False,
-                        "updatedAt": datetime.now(timezone.utc).isoformat()
-                    })
+            # Report an expiry the sweeper has not recorded yet
+            if subscription_data.get("status") in ACTIVE_SUBSCRIPTION_STATUSES and end_date and end_date <= datetime.now(timezone.utc):
+                subscription_data["status"] = "expired"
+            subscription_data = {
+                key: value.isoformat() if isinstance(value, datetime) else value
+                for key, value in subscription_data.items()
+            }
             
             return jsonify({"subscription": subscription_data}), 200
             
@@ -788,8 +1726,8 @@ def create_checkout_session():
         if firebase_initialized and db:
             logger.info(f"Storing pending subscription for user: {user_email}")
             
-            # Get user ID from email
-            user_id = get_user_id_from_email(user_email)
+            # Canonical user ID, which also keys the subscription
+            user_id = resolve_user_id(g.get("auth_uid"), user_email)
             
             # Determine expiration date based on billing cycle
             now = datetime.now(timezone.utc)
@@ -806,7 +1744,7 @@ def create_checkout_session():
                 "billingCycle": billing_cycle,
                 "status": "pending",
                 "startDate": now.isoformat(),
-                "endDate": end_date.isoformat(),
+                "endDate": end_date,
                 "autoRenew": True,
                 "paymentMethod": "meshulam",
                 "sessionId": session_id,
@@ -846,9 +1784,30 @@ def create_checkout_session():
 def catch_all(path):
     if path.startswith('api/'):
         return jsonify({"error": f"Unknown API endpoint: /{path}"}), 404
-    elif path == 'auth/complete' or path.startswith('auth/'):
-        return send_from_directory(app.static_folder, 'index.html')
-    return send_from_directory(app.static_folder, 'index.html')
+    response = static_assets.response(path)
+    if response is not None:
+        return response
+    # A missing bundle or image must not be answered with the HTML shell
+    if path.startswith('assets/') or mimetypes.guess_type(path)[0]:
+        abort(404)
+    return static_assets.index_response()
+
+# ------------------------------
+# Production serving (gunicorn -c gunicorn.conf.py app:app)
+# ------------------------------
+def init_worker():
+    """Per-process setup for a worker forked from the preloaded app"""
+    global client, _summary_executor
+    # Connections opened by the master (the API key check) must not be shared
+    # between processes; the old client is dropped without closing its sockets
+    if client is not None:
+        client = OpenAI(api_key=api_key)
+    materials_store.after_fork()
+    # Executor threads do not survive the fork; the worker starts its own on first use
+    _summary_executor = None
+    chat_core.after_fork()
+    _summaries_pending.clear()
+    log_event("worker_started", pid=os.getpid())
 
 if __name__ == '__main__':
     if os.getenv("FLASK_SECRET_KEY"):
@@ -856,6 +1815,6 @@ if __name__ == '__main__':
     else:
         logger.critical("❌ No secret key configured!")
     
-    logger.info("🚀 Starting Flask server...")
+    logger.info("🚀 Starting Flask development server (production: gunicorn -c gunicorn.conf.py app:app)...")
     app.run(debug=True, host='0.0.0.0', port=8888)
     #app.run(debug=False) # Always disable debug in production
\ No newline at end of file
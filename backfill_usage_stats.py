@@ -0,0 +1,156 @@
+"""
+Backfill the usage rollups (usageStats) from the existing chat logs.
+
+The backends keep per-day and per-month counters current from the moment
+they first record usage (usageStats/meta.liveSince). This job counts every
+message older than that from chatLogs, reading sessions a page at a time,
+and writes one extra shard per period (`day_2024-05-01_backfill`,
+`month_2024-05_backfill`). The stats endpoint sums it with the live shards.
+
+liveSince is the start of the first process that maintained rollups, not
+the end of the rollout. Messages answered by instances still running the
+previous code after that moment are in neither count. The gap lasts as
+long as the rollout; move the cutover with --until only if no live
+rollups were written before it, or those messages are counted twice.
+
+Re-running replaces the backfill shards, so the job is idempotent. Plans
+are recorded as "unknown" because a user's plan at the time of a past
+message is not stored. Token counts are not backfilled.
+
+Usage:
+    python backfill_usage_stats.py --dry-run
+    python backfill_usage_stats.py
+    python backfill_usage_stats.py --until 2025-06-01T00:00:00+00:00
+"""
+import re
+import argparse
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from seed_data import MAX_BATCH_SIZE, initialize_firebase
+
+CHAT_LOGS_COLLECTION = 'chatLogs'
+USAGE_COLLECTION = 'usageStats'
+USAGE_META_DOC = 'meta'
+USAGE_GRANULARITIES = {"day": "%Y-%m-%d", "month": "%Y-%m"}
+BACKFILL_SHARD = 'backfill'
+PAGE_SIZE = 200
+
+def usage_key(value):
+    """Map key safe for a Firestore field name (same as the backends)"""
+    return re.sub(r'[^A-Za-z0-9_-]', '_', str(value)) if value else "unknown"
+
+def parse_timestamp(value):
+    """Aware datetime from a stored ISO timestamp (naive values are UTC), or None"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def iter_sessions(db, page_size=PAGE_SIZE):
+    """Chat sessions in document ID order, one page in memory at a time"""
+    query = db.collection(CHAT_LOGS_COLLECTION) \
+        .select(["messages", "level", "week"]) \
+        .order_by(FieldPath.document_id()) \
+        .limit(page_size)
+    last_id = None
+    while True:
+        page = query.start_after({FieldPath.document_id(): last_id}) if last_id else query
+        docs = list(page.stream())
+        for doc in docs:
+            yield doc.to_dict() or {}
+        if len(docs) < page_size:
+            return
+        last_id = docs[-1].id
+
+def aggregate(sessions, until):
+    """{(granularity, period): counters} for every message before `until`, plus (sessions, messages) seen"""
+    rollups, session_count, message_count = {}, 0, 0
+    for session in sessions:
+        session_count += 1
+        lesson = usage_key(f"{session.get('level')}_{session.get('week')}")
+        for message in session.get("messages") or []:
+            moment = parse_timestamp(message.get("timestamp"))
+            if moment is None or moment >= until:
+                continue
+            message_count += 1
+            is_question = message.get("sender") == "user" or message.get("isUser") is True
+            for granularity, period_format in USAGE_GRANULARITIES.items():
+                counters = rollups.setdefault((granularity, moment.strftime(period_format)), {
+                    "messages": 0, "questions": 0, "sources": {}, "lessons": {}, "plans": {},
+                })
+                counters["messages"] += 1
+                if is_question:
+                    counters["questions"] += 1
+                    counters["lessons"][lesson] = counters["lessons"].get(lesson, 0) + 1
+                    counters["plans"]["unknown"] = counters["plans"].get("unknown", 0) + 1
+                else:
+                    source = usage_key(message.get("source"))
+                    counters["sources"][source] = counters["sources"].get(source, 0) + 1
+    return rollups, session_count, message_count
+
+def resolve_until(db, until_arg):
+    if until_arg:
+        until = parse_timestamp(until_arg)
+        if until is None:
+            raise SystemExit(f"❌ --until must be an ISO timestamp, got {until_arg}")
+        return until
+    meta = db.collection(USAGE_COLLECTION).document(USAGE_META_DOC).get()
+    live_since = (meta.to_dict() or {}).get("liveSince") if meta.exists else None
+    if live_since:
+        return parse_timestamp(live_since)
+    print("⚠️ No live rollups recorded yet (usageStats/meta.liveSince); backfilling up to now")
+    return datetime.now(timezone.utc)
+
+def write_rollups(db, rollups, until):
+    """Replace the backfill shards with `rollups`; returns (written, deleted)"""
+    collection = db.collection(USAGE_COLLECTION)
+    stale = {doc.id for doc in collection.where("backfill", "==", True).select(["period"]).stream()}
+    backfilled_at = datetime.now(timezone.utc).isoformat()
+    operations = []
+    for (granularity, period), counters in sorted(rollups.items()):
+        doc_id = f"{granularity}_{period}_{BACKFILL_SHARD}"
+        stale.discard(doc_id)
+        operations.append((collection.document(doc_id), dict(
+            counters, granularity=granularity, period=period, backfill=True,
+            backfillUntil=until.isoformat(), updatedAt=backfilled_at,
+        )))
+    operations += [(collection.document(doc_id), None) for doc_id in sorted(stale)]
+
+    for start in range(0, len(operations), MAX_BATCH_SIZE):
+        batch = db.batch()
+        for doc_ref, data in operations[start:start + MAX_BATCH_SIZE]:
+            if data is None:
+                batch.delete(doc_ref)
+            else:
+                batch.set(doc_ref, data)
+        batch.commit()
+    return len(operations) - len(stale), len(stale)
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill usage rollups from existing chat logs")
+    parser.add_argument("--credentials", default="serviceAccountKey.json")
+    parser.add_argument("--until", help="count messages before this ISO timestamp (default: usageStats/meta.liveSince)")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="aggregate and report without writing")
+    args = parser.parse_args()
+
+    initialize_firebase(args.credentials)
+    db = firestore.client()
+    until = resolve_until(db, args.until)
+
+    rollups, sessions, messages = aggregate(iter_sessions(db, args.page_size), until)
+    days = sum(1 for granularity, _ in rollups if granularity == "day")
+    months = len(rollups) - days
+    print(f"📊 {messages} messages before {until.isoformat()} in {sessions} sessions: {days} days, {months} months")
+    if args.dry_run:
+        print("🔎 Dry run, nothing written")
+        return
+    written, deleted = write_rollups(db, rollups, until)
+    print(f"✅ Wrote {written} backfill rollups" + (f", removed {deleted} stale ones" if deleted else ""))
+
+if __name__ == "__main__":
+    main()
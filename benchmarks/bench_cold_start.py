@@ -0,0 +1,110 @@
+"""
+Cold-start latency of the Cloud Functions: process start to first response.
+
+Each run spawns a fresh interpreter that imports functions/main.py against
+the in-memory Firestore, fake auth and the local OpenAI stub, then serves
+one request. Time spent seeding the fake database is excluded:
+
+    python benchmarks/bench_cold_start.py
+    python benchmarks/bench_cold_start.py --functions ask_user --runs 10 --openai-latency-ms 0
+
+Reported per function (medians over --runs):
+    startup  interpreter start until the benchmark code runs
+    import   `import main` (plus the small harness)
+    first    the first request, including lazy imports and client creation
+    total    spawn to response, excluding seeding
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import synthetic
+from stats import percentile
+from stub_openai import StubOpenAIServer
+
+FUNCTIONS = ["ask_user", "on_user_purchase", "api_chatlogs"]
+
+
+def child(function_name):
+    """Runs inside the spawned interpreter; prints one JSON line of timings"""
+    started = time.time()
+    import harness
+    from fake_firestore import FakeFirestore
+
+    seed_started = time.time()
+    db = FakeFirestore()
+    users = synthetic.generate_users(1)
+    documents = [("materials", m["id"], m) for m in synthetic.generate_materials(["beginner"], [1])]
+    documents += synthetic.user_documents(users[0]) + synthetic.session_documents(users[0], 10)
+    harness.seed(db, documents)
+    seed_s = time.time() - seed_started
+
+    harness.FakeAuth(users).install()
+    main_module = harness.load_functions_backend(db)
+    imported = time.time()
+
+    if function_name == "ask_user":
+        status, _, _ = harness.call_function(main_module.ask_user, "POST", "/", json_body={
+            "question": synthetic.QUESTIONS[3], "week": "01", "level": "beginner", "gender": "male", "language": "Hebrew"
+        }, headers={"Authorization": f"Bearer {harness.bench_token(users[0])}"})
+    elif function_name == "on_user_purchase":
+        status, _, _ = harness.call_function(main_module.on_user_purchase, "POST", "/",
+                                             json_body=synthetic.purchase_payload("cold_start", users[0]["email"]))
+    else:
+        status, _, _ = harness.call_function(main_module.api_chatlogs, "GET", "/api/chatlogs",
+                                             query={"page": 1, "pageSize": 20})
+    responded = time.time()
+
+    print(json.dumps({"started": started, "seed_s": seed_s, "import_s": imported - started - seed_s,
+                      "first_s": responded - imported, "responded": responded, "status": status}))
+
+
+def spawn(function_name, env):
+    spawned = time.time()
+    result = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", function_name],
+                            cwd=synthetic.REPO_ROOT, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings["startup_s"] = timings["started"] - spawned
+    timings["total_s"] = timings["responded"] - spawned - timings["seed_s"]
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--functions", default=",".join(FUNCTIONS))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--openai-latency-ms", type=float, default=0.0)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child)
+        return 0
+
+    stub = StubOpenAIServer(latency_ms=args.openai_latency_ms).start()
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_BASE_URL": stub.base_url, "OPENAI_API_KEY": "bench-key", "OPENAI_KEY": "bench-key",
+        "GOOGLE_CLOUD_PROJECT": "arabicchatbot-bench", "LOG_LEVEL": "ERROR", "LOG_FORMAT": "text",
+    })
+
+    print(f"{'function':<18} {'startup':>9} {'import':>9} {'first':>9} {'total':>9}   status")
+    for name in args.functions.split(","):
+        runs = [spawn(name, env) for _ in range(args.runs)]
+        medians = {key: percentile([r[key] * 1000 for r in runs], 50)
+                   for key in ("startup_s", "import_s", "first_s", "total_s")}
+        statuses = sorted({r["status"] for r in runs})
+        print(f"{name:<18} {medians['startup_s']:7.0f}ms {medians['import_s']:7.0f}ms "
+              f"{medians['first_s']:7.0f}ms {medians['total_s']:7.0f}ms   {statuses}")
+
+    stub.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+Memory and throughput of the streaming chat-log export against fetching
+everything through GET /api/chatlogs with a huge page size.
+
+Runs app.py and the functions backend in-process against the in-memory
+Firestore; the response is consumed chunk by chunk and the peak Python
+heap allocated while serving it is reported (tracemalloc):
+
+    python benchmarks/bench_export.py
+    python benchmarks/bench_export.py --sessions 2000 --messages-per-session 200 --format csv
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import harness
+import synthetic
+
+
+def measure(label, consume):
+    tracemalloc.start()
+    started = time.perf_counter()
+    total_bytes, rows = consume()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<40} {elapsed:7.2f}s {rows:>9} rows {total_bytes / 1e6:8.1f} MB out "
+          f"peak heap {peak / 1e6:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--messages-per-session", type=int, default=100)
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    args = parser.parse_args()
+
+    harness.configure_environment("http://127.0.0.1:9/v1")
+    # The export is admin-only
+    admin = {"uid": "bench_admin", "email": "admin@example.com"}
+    os.environ["ADMIN_EMAILS"] = admin["email"]
+    harness.FakeAuth([admin]).install()
+    admin_headers = {"Authorization": f"Bearer {harness.bench_token(admin)}"}
+    db = harness.create_db()
+    rng = random.Random(5)
+    documents = []
+    for user in synthetic.generate_users(args.sessions, rng=rng):
+        documents += synthetic.session_documents(user, args.messages_per_session, rng=rng)[1:]
+    harness.seed(db, documents)
+    app_module = harness.load_app_backend(db)
+    main_module = harness.load_functions_backend(db)
+    client = app_module.app.test_client()
+    print(f"{len(documents)} sessions x {args.messages_per_session} messages in chatLogs\n")
+
+    def paged_chatlogs():
+        response = client.get(f"/api/chatlogs?page=1&pageSize={len(documents)}")
+        body = response.get_data()
+        return len(body), len(response.get_json()["chats"]) * args.messages_per_session
+
+    def streamed(query):
+        def consume():
+            response = client.get("/api/chatlogs/export", query_string=query, headers=admin_headers, buffered=False)
+            total_bytes = rows = 0
+            for chunk in response.response:
+                total_bytes += len(chunk)
+                rows += chunk.count(b"\n")
+            response.close()
+            return total_bytes, rows
+        return consume
+
+    def functions_streamed():
+        # call_function buffers the body, so walk the generator the handler returns
+        with app_module.app.app_context():
+            generator = main_module.generate_export("messages", args.format, {}, None, None, None, 0)
+            total_bytes = rows = 0
+            for chunk in generator:
+                total_bytes += len(chunk)
+                rows += chunk.count(b"\n")
+        return total_bytes, rows
+
+    measure("app.py GET /api/chatlogs (one page)", paged_chatlogs)
+    measure(f"app.py export messages {args.format}", streamed({"format": args.format}))
+    measure(f"app.py export sessions {args.format}", streamed({"format": args.format, "rows": "sessions"}))
+    measure(f"functions export messages {args.format}", functions_streamed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
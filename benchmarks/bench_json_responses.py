@@ -0,0 +1,134 @@
+"""
+Size and encode time of the chat-log JSON responses.
+
+Part 1 encodes realistic chat sessions (Hebrew and Arabic messages) the
+old way (`json.dumps`, ASCII-escaped) and the new way (UTF-8, orjson when
+installed), then gzip/brotli on top. Part 2 calls the real endpoints
+(app.py GET /api/chatlogs, functions api_chatlogs and ask_user) and
+reports the bytes on the wire with and without Accept-Encoding:
+
+    python benchmarks/bench_json_responses.py
+    python benchmarks/bench_json_responses.py --messages-per-session 400 --page-size 50
+"""
+import argparse
+import gzip
+import json
+import random
+import sys
+import time
+
+import harness
+import synthetic
+from stub_openai import StubOpenAIServer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def time_ms(fn, value, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(value)
+    return (time.perf_counter() - started) * 1000 / repeat, result
+
+
+def encoding_table(page, repeat):
+    encoders = [
+        ("json.dumps (ascii escapes)", lambda v: json.dumps(v).encode("utf-8")),
+        ("json.dumps ensure_ascii=False", lambda v: json.dumps(v, ensure_ascii=False, separators=(",", ":")).encode("utf-8")),
+    ]
+    if orjson is not None:
+        encoders.append(("orjson", lambda v: orjson.dumps(v, option=orjson.OPT_NON_STR_KEYS)))
+    compressors = [("gzip-6", lambda b: gzip.compress(b, compresslevel=6))]
+    if brotli is not None:
+        compressors.append(("br-5", lambda b: brotli.compress(b, quality=5)))
+
+    print(f"{'encoder':<32} {'encode':>9} {'bytes':>9}" + "".join(f" {name:>18}" for name, _ in compressors))
+    for name, encode in encoders:
+        encode_ms, payload = time_ms(encode, page, repeat)
+        cells = []
+        for _, compress in compressors:
+            compress_ms, compressed = time_ms(compress, payload, max(1, repeat // 5))
+            cells.append(f"{len(compressed):>9} {compress_ms:6.2f}ms")
+        print(f"{name:<32} {encode_ms:7.2f}ms {len(payload):>9}" + "".join(f" {cell:>18}" for cell in cells))
+    if orjson is None:
+        print("(orjson is not installed; the backends fall back to json.dumps ensure_ascii=False)")
+
+
+def wire_sizes(args, users, db):
+    app_module = harness.load_app_backend(db)
+    main_module = harness.load_functions_backend(db)
+    client = app_module.app.test_client()
+    question = {"question": synthetic.QUESTIONS[3], "week": "01", "level": "beginner", "gender": "male", "language": "Hebrew"}
+
+    def app_chatlogs(headers):
+        response = client.get(f"/api/chatlogs?page=1&pageSize={args.page_size}", headers=headers)
+        return response.status_code, response.headers, response.get_data()
+
+    def functions_chatlogs(headers):
+        return harness.call_function(main_module.api_chatlogs, "GET", "/api/chatlogs", headers=headers,
+                                     query={"page": 1, "pageSize": args.page_size})
+
+    def app_ask(headers):
+        response = client.post("/ask", json=question,
+                               headers=dict(headers, Authorization=f"Bearer {harness.bench_token(users[0])}"))
+        return response.status_code, response.headers, response.get_data()
+
+    def functions_ask(headers):
+        return harness.call_function(main_module.ask_user, "POST", "/", json_body=question,
+                                     headers=dict(headers, Authorization=f"Bearer {harness.bench_token(users[1])}"))
+
+    accepts = [("identity", {})]
+    accepts.append(("gzip", {"Accept-Encoding": "gzip"}))
+    if brotli is not None:
+        accepts.append(("br", {"Accept-Encoding": "br, gzip"}))
+
+    print(f"\n{'endpoint':<32} {'accept':<10} {'status':>6} {'encoding':>9} {'bytes':>9} {'time':>9}")
+    for label, call in [("app.py GET /api/chatlogs", app_chatlogs), ("functions api_chatlogs", functions_chatlogs),
+                        ("app.py POST /ask", app_ask), ("functions ask_user", functions_ask)]:
+        for accept, headers in accepts:
+            started = time.perf_counter()
+            status, response_headers, body = call(headers)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            print(f"{label:<32} {accept:<10} {status:>6} {response_headers.get('Content-Encoding', '-'):>9} "
+                  f"{len(body):>9} {elapsed_ms:7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=40)
+    parser.add_argument("--messages-per-session", type=int, default=120)
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    rng = random.Random(3)
+    users = synthetic.generate_users(args.sessions, premium_ratio=1.0, rng=rng)
+    documents = [("materials", m["id"], m) for m in synthetic.generate_materials(["beginner"], [1])]
+    for user in users:
+        documents += synthetic.user_documents(user) + synthetic.session_documents(user, args.messages_per_session, rng=rng)
+    page = {"chats": [data for collection, _, data in documents if collection == "chatLogs"][:args.page_size],
+            "totalPages": 1}
+
+    print(f"One page of {args.page_size} chat sessions x {args.messages_per_session} messages\n")
+    encoding_table(page, args.repeat)
+
+    stub = StubOpenAIServer(latency_ms=0).start()
+    harness.configure_environment(stub.base_url)
+    db = harness.create_db()
+    harness.seed(db, documents)
+    harness.FakeAuth(users).install()
+    wire_sizes(args, users, db)
+    stub.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+"""
+Behaviour of the OpenAI resilience layer (create_chat_completion) against
+the local stub with injected latency, slow tails, errors, hangs and an
+outage.
+
+Each scenario reconfigures the stub, gives the backend a fresh
+chat_core.ResilientCompletions with the scenario's policy and sends
+sequential-in-parallel calls through the real OpenAI SDK:
+
+- tail: 10% of calls take +3s; hedging off vs p95 vs a fixed 0.5s
+- errors: 30% of calls answer 503; retried with jittered backoff
+- hangs: 10% of calls never answer; bounded by the per-attempt deadline
+- outage: every call fails; the circuit opens and calls fail fast, then
+  it closes again once the stub recovers
+
+With --check each scenario also asserts the behaviour it demonstrates
+(hedging keeps the p95 out of the slow tail, retries recover most errors,
+hangs stay within the deadline, the breaker sheds load and recovers) and
+the script exits 1 if any check fails, so it can gate changes to the
+resilience layer.
+
+    python benchmarks/bench_llm_resilience.py
+    python benchmarks/bench_llm_resilience.py --backend functions --calls 400 --scenarios tail,outage
+    python benchmarks/bench_llm_resilience.py --check
+"""
+import argparse
+import sys
+import threading
+import time
+from collections import Counter
+
+import harness
+from stats import percentile, report
+from stub_openai import StubOpenAIServer
+
+chat_core = harness.load_chat_core()
+
+SCENARIOS = ["tail", "errors", "hangs", "outage"]
+
+
+def reset_policy(module, **policy):
+    """The default policy (with overrides) with a fresh breaker and latency window"""
+    defaults = {"hedge": "off", "attempt_timeout": 25.0, "total_deadline": 45.0, "max_attempts": 3,
+                "breaker_failures": 5, "breaker_cooldown": 30.0}
+    defaults.update(policy)
+    module.llm = chat_core.ResilientCompletions(module.backend_hooks, **defaults)
+
+
+def configure_stub(stub, **config):
+    defaults = {"latency_ms": 200.0, "jitter_ms": 100.0, "error_rate": 0.0, "hang_rate": 0.0, "tail_rate": 0.0, "tail_ms": 0.0}
+    defaults.update(config)
+    for name, value in defaults.items():
+        setattr(stub.config, name, value)
+    stub.config.requests = 0
+
+
+def run_calls(label, module, client, stub, calls, concurrency, warmup=0):
+    """
+    `calls` completions from `concurrency` threads; reports latency (of every
+    outcome) and outcomes. Returns (outcomes, latencies, upstream requests).
+    """
+    latencies, outcomes = [], Counter()
+    lock = threading.Lock()
+    remaining = [calls + warmup]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+                measured = remaining[0] < calls
+            started = time.perf_counter()
+            try:
+                module.create_chat_completion(client, model="gpt-4o-mini", max_tokens=50,
+                                              messages=[{"role": "user", "content": "שלום"}])
+                outcome = "ok"
+            except chat_core.LLMUnavailable as e:
+                outcome = "rejected" if "circuit" in str(e) else "exhausted"
+            except Exception as e:
+                outcome = type(e).__name__
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            if measured:
+                with lock:
+                    outcomes[outcome] += 1
+                    latencies.append(elapsed_ms)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+    upstream = f"upstream={stub.config.requests}"
+    report(label, latencies, wall_seconds, " ".join([upstream] + [f"{k}={v}" for k, v in sorted(outcomes.items())]))
+    return outcomes, latencies, stub.config.requests
+
+
+def check(checks, description, passed):
+    """Record one expectation of a scenario; the thresholds leave room for the stub's randomness"""
+    checks.append((description, bool(passed)))
+
+
+def scenario_tail(module, client, stub, args, checks):
+    tail_ms = 3000
+    for hedge in ["off", "p95", "0.5"]:
+        configure_stub(stub, tail_rate=0.1, tail_ms=tail_ms)
+        reset_policy(module, hedge=hedge, hedge_min_delay=0.3)
+        outcomes, latencies, _ = run_calls(f"tail, hedge={hedge}", module, client, stub, args.calls, args.concurrency,
+                                           warmup=chat_core.LLM_HEDGE_MIN_SAMPLES + args.concurrency)
+        check(checks, f"tail, hedge={hedge}: every call answered", outcomes["ok"] == args.calls)
+        if hedge != "off":
+            # Measured against the injected tail: the unhedged p95 only lands in it when enough calls drew it
+            check(checks, f"tail, hedge={hedge}: p95 under half the {tail_ms}ms tail", percentile(latencies, 95) < tail_ms / 2)
+
+
+def scenario_errors(module, client, stub, args, checks):
+    failed = {}
+    for attempts in [1, 3]:
+        configure_stub(stub, error_rate=0.3)
+        reset_policy(module, max_attempts=attempts, breaker_failures=10 ** 6)
+        outcomes, _, _ = run_calls(f"30% 503s, {attempts} attempt(s)", module, client, stub, args.calls, args.concurrency)
+        failed[attempts] = args.calls - outcomes["ok"]
+    check(checks, "30% 503s: retries answer at least 90% of calls", failed[3] <= args.calls * 0.1)
+    check(checks, "30% 503s: retries at least halve the failures", failed[3] <= failed[1] / 2)
+
+
+def scenario_hangs(module, client, stub, args, checks):
+    configure_stub(stub, hang_rate=0.1)
+    reset_policy(module, attempt_timeout=2.0, total_deadline=10.0, breaker_failures=10 ** 6)
+    calls = max(args.calls // 4, 20)
+    outcomes, latencies, _ = run_calls("10% hangs, 2s attempt deadline", module, client, stub, calls, args.concurrency)
+    check(checks, "10% hangs: at least 95% of calls answered", outcomes["ok"] >= calls * 0.95)
+    check(checks, "10% hangs: no call outlives the total deadline", max(latencies) <= module.llm.total_deadline * 1000 + 500)
+
+
+def scenario_outage(module, client, stub, args, checks):
+    configure_stub(stub, error_rate=1.0)
+    reset_policy(module, breaker_cooldown=2.0)
+    outcomes, _, _ = run_calls("outage, breaker on", module, client, stub, args.calls, args.concurrency)
+    check(checks, "outage: the open circuit rejects most calls", outcomes["rejected"] >= args.calls / 2)
+    print(f"{'':<32} circuit after outage: {module.llm.breaker.retry_after():.1f}s until a trial call")
+    configure_stub(stub)
+    time.sleep(module.llm.breaker.cooldown)
+    _, _, upstream = run_calls("first burst after cooldown", module, client, stub, args.calls, args.concurrency)
+    check(checks, "outage: the half-open circuit lets a single trial call through", upstream == 1)
+    outcomes, _, _ = run_calls("after the trial call", module, client, stub, args.calls, args.concurrency)
+    check(checks, "outage: the closed circuit answers every call", outcomes["ok"] == args.calls)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backend", choices=["app", "functions"], default="app")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--calls", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--check", action="store_true", help="assert each scenario's expected behaviour; exit 1 on failure")
+    args = parser.parse_args()
+
+    stub = StubOpenAIServer().start()
+    harness.configure_environment(stub.base_url)
+    db = harness.create_db()
+    module = harness.load_app_backend(db) if args.backend == "app" else harness.load_functions_backend(db)
+    from openai import OpenAI
+    client = OpenAI(api_key="bench", base_url=stub.base_url)
+
+    print(f"{args.backend}: {args.calls} calls per run, {args.concurrency} concurrent; stub 200ms + up to 100ms jitter\n")
+    checks = []
+    for name in args.scenarios.split(","):
+        globals()[f"scenario_{name}"](module, client, stub, args, checks)
+    stub.stop()
+
+    if not args.check:
+        return 0
+    print()
+    for description, passed in checks:
+        print(f"{'PASS' if passed else 'FAIL'}  {description}")
+    failed = [description for description, passed in checks if not passed]
+    print(f"\n{len(checks) - len(failed)}/{len(checks)} checks passed")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Prompt size of the materials block: legacy dict repr vs the compact TSV block.
+
+Renders every lesson in data_files/materials_data_set.json (or --materials)
+both ways and reports UTF-8 bytes and tokens per lesson, plus the size of
+a complete teaching prompt:
+
+    python benchmarks/bench_prompt_tokens.py
+    python benchmarks/bench_prompt_tokens.py --encoding o200k_base
+
+Tokens are counted with tiktoken when it is installed and its encoding can
+be loaded; otherwise an estimate of UTF-8 bytes / 3 is used and labelled
+as such (Hebrew and Arabic tokenize at roughly that rate).
+"""
+import argparse
+import json
+import sys
+from collections import OrderedDict
+
+import harness
+import synthetic
+from fake_firestore import FakeFirestore
+
+
+def legacy_materials_prompt(materials):
+    """The materials section as create_arabic_teaching_prompt rendered it before"""
+    materials_prompt = "\nYOU MUST EXCLUSIVELY USE THESE MATERIALS AS YOUR SOURCE:\n"
+    for i, mat in enumerate(materials, 1):
+        materials_prompt += f"Material {i}: {mat}\n"
+    return materials_prompt
+
+
+def load_counter(encoding_name):
+    """(name, count_fn) using tiktoken if available, else a byte-based estimate"""
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding(encoding_name)
+        return f"tiktoken {encoding_name}", lambda text: len(encoding.encode(text))
+    except Exception:
+        return "estimate (UTF-8 bytes / 3)", lambda text: max(1, len(text.encode("utf-8")) // 3)
+
+
+def group_by_lesson(materials):
+    lessons = OrderedDict()
+    for mat in materials:
+        lesson_key = mat.get("id", "").rsplit("_", 1)[0]
+        lessons.setdefault(lesson_key, []).append(mat)
+    return lessons
+
+
+def sizes(text, count_tokens):
+    return len(text), len(text.encode("utf-8")), count_tokens(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--materials", default=synthetic.MATERIALS_PATH, help="materials JSON file")
+    parser.add_argument("--encoding", default="cl100k_base", help="tiktoken encoding name")
+    args = parser.parse_args()
+
+    harness.configure_environment("http://127.0.0.1:9/v1")
+    main_module = harness.load_functions_backend(FakeFirestore())
+    chat_core = harness.load_chat_core()
+    name, count_tokens = load_counter(args.encoding)
+
+    with open(args.materials, "r", encoding="utf-8") as file:
+        lessons = group_by_lesson(json.load(file))
+
+    print(f"Token counter: {name}\n")
+    print(f"{'lesson':<28} {'items':>5} {'legacy tok':>10} {'compact tok':>11} {'saved':>6}   "
+          f"{'legacy B':>8} {'compact B':>9}")
+    totals = [0, 0]
+    for lesson_key, materials in lessons.items():
+        level, _, week = lesson_key.partition("_week_")
+        legacy = legacy_materials_prompt(materials)
+        compact = main_module.get_materials_block(level, week, materials)
+        _, legacy_bytes, legacy_tokens = sizes(legacy, count_tokens)
+        _, compact_bytes, compact_tokens = sizes(compact, count_tokens)
+        totals[0] += legacy_tokens
+        totals[1] += compact_tokens
+        print(f"{lesson_key:<28} {len(materials):>5} {legacy_tokens:>10} {compact_tokens:>11} "
+              f"{1 - compact_tokens / legacy_tokens:>6.0%}   {legacy_bytes:>8} {compact_bytes:>9}")
+
+    if totals[0]:
+        print(f"\n{'all lessons':<28} {'':>5} {totals[0]:>10} {totals[1]:>11} {1 - totals[1] / totals[0]:>6.0%}")
+
+    # Whole prompt for the first lesson, as sent on every /ask turn
+    lesson_key, materials = next(iter(lessons.items()))
+    level, _, week = lesson_key.partition("_week_")
+    history = synthetic.generate_messages(5, "bench")
+    prompt = main_module.create_arabic_teaching_prompt(level, week, synthetic.QUESTIONS[3], "male", "Hebrew",
+                                                       materials, history)
+    compact_block = main_module.get_materials_block(level, week, materials)
+    legacy_prompt = prompt.replace(chat_core.MATERIALS_PROMPT_HEADER + compact_block,
+                                   legacy_materials_prompt(materials), 1)
+    print(f"\nFull prompt ({lesson_key}, 5 history messages): "
+          f"legacy {count_tokens(legacy_prompt)} tokens, compact {count_tokens(prompt)} tokens")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
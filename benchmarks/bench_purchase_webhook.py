@@ -0,0 +1,77 @@
+"""
+Benchmark the on_user_purchase payment webhook against the Firebase emulators.
+
+Start the emulators first (`firebase emulators:start --only functions,firestore,auth`),
+then run:
+
+    python benchmarks/bench_purchase_webhook.py --transactions 50 --retries 3
+
+Every transaction is delivered once and then re-delivered `--retries` times
+with the same transactionCode, the way Meshulam retries a webhook. First
+deliveries and retries are reported separately so the cost of the idempotent
+no-op path is visible.
+"""
+import argparse
+import time
+import uuid
+
+import requests
+
+from stats import report
+
+DEFAULT_URL = "http://127.0.0.1:5001/arabicchatbot-24bb2/us-central1/on_user_purchase"
+
+
+def build_payload(transaction_code, email):
+    return {
+        "webhookKey": "BENCH",
+        "transactionCode": transaction_code,
+        "transactionType": "אשראי",
+        "paymentSum": 30,
+        "paymentType": "monthly",
+        "payerEmail": email,
+        "fullName": "Bench User",
+    }
+
+
+def post(session, url, payload):
+    started = time.perf_counter()
+    response = session.post(url, json=payload, timeout=30)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    response.raise_for_status()
+    return elapsed_ms, response.json()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=DEFAULT_URL, help="on_user_purchase URL in the functions emulator")
+    parser.add_argument("--transactions", type=int, default=20, help="number of distinct transactions")
+    parser.add_argument("--retries", type=int, default=2, help="re-deliveries per transaction")
+    args = parser.parse_args()
+
+    first_delivery, retries = [], []
+    duplicates_missed = 0
+    run_id = uuid.uuid4().hex[:8]
+
+    with requests.Session() as session:
+        for i in range(args.transactions):
+            transaction_code = f"bench_{run_id}_{i}"
+            payload = build_payload(transaction_code, f"bench_{run_id}_{i}@example.com")
+
+            elapsed_ms, _ = post(session, args.url, payload)
+            first_delivery.append(elapsed_ms)
+
+            for _ in range(args.retries):
+                elapsed_ms, body = post(session, args.url, payload)
+                retries.append(elapsed_ms)
+                if not body.get("duplicate"):
+                    duplicates_missed += 1
+
+    report("first delivery", first_delivery)
+    report("retry", retries)
+    if duplicates_missed:
+        print(f"⚠️ {duplicates_missed} retries were processed again instead of being deduplicated")
+
+
+if __name__ == "__main__":
+    main()
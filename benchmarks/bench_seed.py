@@ -0,0 +1,97 @@
+"""
+Materials sync throughput for seed_data.py against the in-memory Firestore.
+
+Generates a curriculum of --items materials, then times three runs: the
+initial load, an identical re-run (should write nothing) and a re-run
+with --changed of the items edited:
+
+    python benchmarks/bench_seed.py
+    python benchmarks/bench_seed.py --items 50000 --firestore-latency-ms 40 --writer batch --workers 8
+
+Also times the previous approach (one doc_ref.set() per material,
+sequentially) for comparison unless --skip-legacy is given.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from contextlib import redirect_stdout
+
+import synthetic
+from fake_firestore import FakeFirestore
+
+sys.path.insert(0, synthetic.REPO_ROOT)
+import seed_data  # noqa: E402
+
+
+def write_curriculum(path, items):
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(items, file, ensure_ascii=False)
+
+
+def timed_sync(db, path, **options):
+    db.reset_counters()
+    started = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        counts = seed_data.sync_materials(db, path, progress_every=0, **options)
+    return time.perf_counter() - started, counts, db.reads, db.writes
+
+
+def legacy_seed(db, items):
+    db.reset_counters()
+    started = time.perf_counter()
+    materials_coll = db.collection("materials")
+    for item in items:
+        materials_coll.document(item["id"]).set(item)
+    return time.perf_counter() - started, db.writes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--changed", type=float, default=0.01, help="fraction of items edited for the third run")
+    parser.add_argument("--firestore-latency-ms", type=float, default=20.0, help="simulated round trip per commit/write")
+    parser.add_argument("--writer", choices=["bulk", "batch"], default="batch")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=seed_data.MAX_BATCH_SIZE)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+
+    levels = synthetic.LEVELS
+    weeks = range(1, -(-args.items // (len(levels) * 40)) + 1)
+    items = synthetic.generate_materials(levels, weeks)[:args.items]
+    options = dict(writer=args.writer, workers=args.workers, batch_size=args.batch_size)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "materials.json")
+        write_curriculum(path, items)
+        db = FakeFirestore(latency_ms=args.firestore_latency_ms)
+        print(f"{len(items)} materials, {args.firestore_latency_ms:.0f}ms per round trip, "
+              f"{args.writer} writer ({args.workers} workers)\n")
+
+        for label in ("initial load", "unchanged re-run"):
+            seconds, counts, reads, writes = timed_sync(db, path, **options)
+            print(f"{label:<22} {seconds:7.2f}s  writes={writes:<7} reads={reads:<7} "
+                  f"new={counts['created']} changed={counts['updated']} unchanged={counts['unchanged']}")
+
+        rng = random.Random(3)
+        for item in rng.sample(items, int(len(items) * args.changed)):
+            item["pronunciation"] += " "
+            item["hebrew_input"] += "!"
+        write_curriculum(path, items)
+        seconds, counts, reads, writes = timed_sync(db, path, **options)
+        print(f"{f'{args.changed:.0%} edited re-run':<22} {seconds:7.2f}s  writes={writes:<7} reads={reads:<7} "
+              f"new={counts['created']} changed={counts['updated']} unchanged={counts['unchanged']}")
+
+    if not args.skip_legacy:
+        seconds, writes = legacy_seed(FakeFirestore(latency_ms=args.firestore_latency_ms), items)
+        print(f"{'legacy per-doc set()':<22} {seconds:7.2f}s  writes={writes}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Sustained concurrent POST /ask throughput of app.py over real HTTP: the
+Werkzeug development server (`python app.py`) against gunicorn with
+gunicorn.conf.py.
+
+Each server runs in its own process against the in-memory Firestore and
+the local OpenAI stub; a pool of keep-alive clients sends /ask for a fixed
+duration:
+
+    python benchmarks/bench_serving.py
+    python benchmarks/bench_serving.py --concurrency 128 --duration 30 --openai-latency-ms 2000
+    python benchmarks/bench_serving.py --servers gunicorn --workers 4 --threads 64
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+
+import harness
+import synthetic
+from stats import report
+from stub_openai import StubOpenAIServer
+
+SERVERS = ["dev", "gunicorn"]
+USERS_ENV = "BENCH_SERVING_USERS"
+
+
+def bench_users():
+    # Premium users only, so every request reaches the OpenAI stub
+    return synthetic.generate_users(int(os.getenv(USERS_ENV, "50")), premium_ratio=1.0, rng=random.Random(1))
+
+
+def create_app():
+    """WSGI app for the server processes: app.py against a seeded FakeFirestore"""
+    db = harness.create_db()
+    users = bench_users()
+    documents = [("materials", m["id"], m) for m in synthetic.generate_materials(["beginner"], [1])]
+    for user in users:
+        documents += synthetic.user_documents(user)
+    harness.seed(db, documents)
+    harness.FakeAuth(users).install()
+    return harness.load_app_backend(db).app
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(kind, port, args, env):
+    env = dict(env, PORT=str(port))
+    if kind == "dev":
+        command = [sys.executable, os.path.abspath(__file__), "--serve-dev", str(port)]
+    else:
+        env.update({"WEB_CONCURRENCY": str(args.workers), "GUNICORN_THREADS": str(args.threads),
+                    "GUNICORN_WORKER_CLASS": args.worker_class})
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+                   "--chdir", harness.REPO_ROOT, "--pythonpath", os.path.dirname(os.path.abspath(__file__)),
+                   "bench_serving:create_app()"]
+    process = subprocess.Popen(command, cwd=harness.REPO_ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{kind} server exited:\n{process.stderr.read()[-2000:]}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            connection.request("GET", "/api/healthcheck")
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not become ready on port {port}")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def run_load(label, port, users, concurrency, duration):
+    """Keep `concurrency` keep-alive clients busy for `duration` seconds"""
+    latencies, statuses = [], Counter()
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client(worker):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        rng = random.Random(worker)
+        i = worker
+        while time.perf_counter() < stop_at:
+            user = users[i % len(users)]
+            i += concurrency
+            body = json.dumps({"question": rng.choice(synthetic.QUESTIONS), "week": "01",
+                               "level": "beginner", "gender": "male", "language": "Hebrew"})
+            started = time.perf_counter()
+            try:
+                connection.request("POST", "/ask", body=body, headers={
+                    "Content-Type": "application/json", "Authorization": f"Bearer {harness.bench_token(user)}"})
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with lock:
+                statuses[status] += 1
+                if status == 200:
+                    latencies.append(elapsed_ms)
+        connection.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+    report(label, latencies, wall_seconds, "statuses=" + ",".join(f"{k}:{v}" for k, v in sorted(statuses.items(), key=str)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--servers", default=",".join(SERVERS))
+    parser.add_argument("--concurrency", type=int, default=64, help="simultaneous keep-alive clients")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of load per server")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=32, help="threads per gunicorn worker")
+    parser.add_argument("--worker-class", default="gthread", choices=["gthread", "gevent"])
+    parser.add_argument("--openai-latency-ms", type=float, default=1500.0)
+    parser.add_argument("--openai-jitter-ms", type=float, default=300.0)
+    parser.add_argument("--serve-dev", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve_dev:
+        # The same dev server app.py's __main__ block starts, minus the reloader
+        create_app().run(debug=True, host="127.0.0.1", port=args.serve_dev, use_reloader=False)
+        return 0
+
+    stub = StubOpenAIServer(latency_ms=args.openai_latency_ms, jitter_ms=args.openai_jitter_ms).start()
+    harness.configure_environment(stub.base_url)
+    os.environ[USERS_ENV] = str(args.users)
+    env, users = dict(os.environ), bench_users()
+
+    print(f"POST /ask for {args.duration:.0f}s per server, {args.concurrency} clients; "
+          f"OpenAI stub {args.openai_latency_ms:.0f}ms ± {args.openai_jitter_ms:.0f}ms\n")
+    for kind in args.servers.split(","):
+        label = "werkzeug dev server" if kind == "dev" else f"gunicorn {args.workers} {args.worker_class} workers"
+        port = free_port()
+        process = start_server(kind, port, args, env)
+        try:
+            run_load(label, port, users, args.concurrency, args.duration)
+        finally:
+            stop_server(process)
+
+    stub.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,491 @@
+"""
+In-memory stand-in for the parts of the Firestore client the backends use.
+
+It covers documents (get/set/create/update/delete), merge writes, dotted
+field paths, ArrayUnion/Increment/DELETE_FIELD transforms, simple queries
+(where/order_by/limit/offset/stream), batches and transactions. Every
+operation can be slowed down by a configurable latency to approximate
+network round trips, and reads/writes are counted so scenarios can report
+Firestore cost per request.
+"""
+import copy
+import random
+import threading
+import time
+
+
+class AlreadyExistsError(Exception):
+    """Raised by create() when the document exists (mirrors google.api_core AlreadyExists)"""
+
+
+def _already_exists(message):
+    try:
+        from google.api_core.exceptions import AlreadyExists
+        return AlreadyExists(message)
+    except ImportError:
+        return AlreadyExistsError(message)
+
+
+def _get_path(data, field_path):
+    value = data
+    for part in field_path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _is_transform(value, name):
+    return type(value).__name__ == name
+
+
+def _apply_value(target, key, value):
+    if _is_transform(value, "ArrayUnion"):
+        current = list(target.get(key) or [])
+        for item in value.values:
+            if item not in current:
+                current.append(copy.deepcopy(item))
+        target[key] = current
+    elif _is_transform(value, "ArrayRemove"):
+        target[key] = [item for item in (target.get(key) or []) if item not in value.values]
+    elif _is_transform(value, "Increment"):
+        target[key] = (target.get(key) or 0) + value.value
+    elif _is_transform(value, "Sentinel") and "delete" in repr(value).lower():
+        target.pop(key, None)
+    elif _is_transform(value, "Sentinel"):
+        from datetime import datetime, timezone
+        target[key] = datetime.now(timezone.utc)
+    else:
+        target[key] = copy.deepcopy(value)
+
+
+def _merge(target, updates):
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        elif isinstance(value, dict):
+            target[key] = {}
+            _merge(target[key], value)
+        else:
+            _apply_value(target, key, value)
+
+
+def _update(target, updates):
+    for field_path, value in updates.items():
+        parts = field_path.split(".")
+        node = target
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        _apply_value(node, parts[-1], value)
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+        # Write preconditions are accepted but not enforced
+        self.update_time = None
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field_path):
+        return _get_path(self._data or {}, field_path)
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection_name, doc_id):
+        self._client = client
+        self._collection = collection_name
+        self.id = doc_id
+        self.path = f"{collection_name}/{doc_id}"
+
+    def collection(self, name):
+        return FakeCollectionReference(self._client, f"{self.path}/{name}")
+
+    def get(self, transaction=None, field_paths=None):
+        self._client._delay()
+        with self._client._lock:
+            self._client.reads += 1
+            data = self._client._store.get(self._collection, {}).get(self.id)
+            return FakeSnapshot(self, copy.deepcopy(data))
+
+    def set(self, data, merge=False):
+        self._client._delay()
+        with self._client._lock:
+            self._client._write(self, data, merge=merge)
+
+    def create(self, data):
+        self._client._delay()
+        with self._client._lock:
+            if self.id in self._client._store.get(self._collection, {}):
+                raise _already_exists(f"Document already exists: {self.path}")
+            self._client._write(self, data)
+
+    def update(self, data, option=None):
+        self._client._delay()
+        with self._client._lock:
+            self._client._update(self, data)
+
+    def delete(self):
+        self._client._delay()
+        with self._client._lock:
+            self._client._delete(self)
+
+    def on_snapshot(self, callback):
+        return self._client._watch(self, callback)
+
+
+class FakeQuery:
+    def __init__(self, client, collection_name, filters=None, orders=None, limit=None, offset=0, projection=None):
+        self._client = client
+        self._collection = collection_name
+        self._filters = filters or []
+        self._orders = orders or []
+        self._limit = limit
+        self._offset = offset
+        self._projection = projection
+
+    def _copy(self, **changes):
+        params = dict(filters=list(self._filters), orders=list(self._orders), limit=self._limit,
+                      offset=self._offset, projection=self._projection)
+        params.update(changes)
+        return FakeQuery(self._client, self._collection, **params)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + [(field_path, op_string, value)])
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + [(field_path, direction)])
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def select(self, field_paths):
+        return self._copy(projection=list(field_paths))
+
+    def offset(self, num_to_skip):
+        return self._copy(offset=num_to_skip)
+
+    def start_after(self, values):
+        if isinstance(values, FakeSnapshot):
+            values = {field: values.reference.id if field == "__name__" else values.get(field) for field, _ in self._orders}
+        return self._copy(filters=self._filters + [("__start_after__", None, values)])
+
+    @staticmethod
+    def _matches(data, field_path, op, value):
+        actual = _get_path(data, field_path)
+        try:
+            if op == "==":
+                return actual == value
+            if op == "!=":
+                return actual != value
+            if op == "in":
+                return actual in value
+            if op == "array-contains":
+                return isinstance(actual, list) and value in actual
+            if actual is None:
+                return False
+            if op == "<":
+                return actual < value
+            if op == "<=":
+                return actual <= value
+            if op == ">":
+                return actual > value
+            if op == ">=":
+                return actual >= value
+        except TypeError:
+            return False
+        raise ValueError(f"Unsupported operator in fake Firestore: {op}")
+
+    @staticmethod
+    def _value(doc_id, data, field):
+        """Field value, with "__name__" (FieldPath.document_id()) meaning the document ID"""
+        if field == "__name__":
+            return doc_id
+        return _get_path(data, field)
+
+    def _sort_key(self, item, field):
+        value = self._value(*item, field)
+        return (value is not None, value)
+
+    def stream(self, transaction=None):
+        self._client._delay()
+        with self._client._lock:
+            items = list(self._client._store.get(self._collection, {}).items())
+        start_after = None
+        for field_path, op, value in self._filters:
+            if field_path == "__start_after__":
+                start_after = value
+                continue
+            items = [(doc_id, data) for doc_id, data in items
+                     if self._matches({"__name__": doc_id} if field_path == "__name__" else data, field_path, op, value)]
+        for field, direction in reversed(self._orders):
+            items.sort(key=lambda item: self._sort_key(item, field), reverse=(direction == "DESCENDING"))
+        if start_after is not None and self._orders:
+            cursor = tuple(getattr(v, "id", v) for v in (start_after.get(field) for field, _ in self._orders))
+            descending = self._orders[0][1] == "DESCENDING"
+            items = [
+                item for item in items
+                if (tuple(self._value(*item, f) for f, _ in self._orders) < cursor if descending
+                    else tuple(self._value(*item, f) for f, _ in self._orders) > cursor)
+            ]
+        items = items[self._offset:]
+        if self._limit is not None:
+            items = items[:self._limit]
+        # Only the documents returned are copied, as a real query would transfer only those
+        with self._client._lock:
+            snapshots = [
+                FakeSnapshot(FakeDocumentReference(self._client, self._collection, doc_id), copy.deepcopy(data))
+                for doc_id, data in items
+            ]
+        if self._projection is not None:
+            snapshots = [
+                FakeSnapshot(s.reference, {f: _get_path(s._data, f) for f in self._projection
+                                           if _get_path(s._data, f) is not None})
+                for s in snapshots
+            ]
+        with self._client._lock:
+            self._client.reads += max(len(snapshots), 1)
+        return iter(snapshots)
+
+    def get(self, transaction=None):
+        return list(self.stream())
+
+    def count(self):
+        return FakeAggregation(self)
+
+    def on_snapshot(self, callback):
+        return self._client._watch(self, callback)
+
+
+class FakeAggregation:
+    class _Result:
+        def __init__(self, value):
+            self.value = value
+
+    def __init__(self, query):
+        self._query = query
+
+    def get(self):
+        total = sum(1 for _ in self._query.stream())
+        return [[self._Result(total)]]
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+        self.id = name.split("/")[-1]
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._client, self._collection, doc_id or random.randbytes(10).hex())
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return None, ref
+
+    def list_documents(self):
+        with self._client._lock:
+            ids = list(self._client._store.get(self._collection, {}))
+        return [FakeDocumentReference(self._client, self._collection, doc_id) for doc_id in ids]
+
+
+class FakeWriteBatch:
+    """Buffers writes and applies them atomically on commit"""
+    def __init__(self, client):
+        self._client = client
+        self._ops = []
+
+    def set(self, reference, data, merge=False):
+        self._ops.append(("set", reference, data, merge))
+
+    def create(self, reference, data):
+        self._ops.append(("create", reference, data, False))
+
+    def update(self, reference, data, option=None):
+        self._ops.append(("update", reference, data, False))
+
+    def delete(self, reference):
+        self._ops.append(("delete", reference, None, False))
+
+    def __len__(self):
+        return len(self._ops)
+
+    def commit(self):
+        self._client._delay()
+        with self._client._lock:
+            for op, reference, data, merge in self._ops:
+                if op == "set":
+                    self._client._write(reference, data, merge=merge)
+                elif op == "create":
+                    if reference.id in self._client._store.get(reference._collection, {}):
+                        raise _already_exists(f"Document already exists: {reference.path}")
+                    self._client._write(reference, data)
+                elif op == "update":
+                    self._client._update(reference, data)
+                else:
+                    self._client._delete(reference)
+        self._ops = []
+
+
+class FakeTransaction(FakeWriteBatch):
+    """Reads go straight to the store; writes are applied on commit"""
+
+
+def fake_transactional(to_wrap):
+    """Counterpart of firestore.transactional for FakeTransaction"""
+    def wrapper(transaction, *args, **kwargs):
+        result = to_wrap(transaction, *args, **kwargs)
+        transaction.commit()
+        return result
+    wrapper.to_wrap = to_wrap
+    return wrapper
+
+
+class FakeWatch:
+    def __init__(self, client, target, callback):
+        self._client = client
+        self._target = target
+        self._callback = callback
+
+    def notify(self):
+        if isinstance(self._target, FakeDocumentReference):
+            snapshots = [self._target.get()]
+        else:
+            snapshots = list(self._target.stream())
+        self._callback(snapshots, [], None)
+
+    @property
+    def is_active(self):
+        return self in self._client._watches
+
+    def unsubscribe(self):
+        with self._client._lock:
+            if self in self._client._watches:
+                self._client._watches.remove(self)
+
+
+class FakeFirestore:
+    """
+    Thread-safe in-memory Firestore client.
+
+    latency_ms/jitter_ms add a sleep before every round trip; reads/writes
+    count documents touched since the last reset_counters().
+    """
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.reads = 0
+        self.writes = 0
+        self._store = {}
+        self._watches = []
+        self._lock = threading.RLock()
+
+    def _delay(self):
+        if self.latency_ms or self.jitter_ms:
+            time.sleep((self.latency_ms + random.uniform(0, self.jitter_ms)) / 1000)
+
+    def _write(self, reference, data, merge=False):
+        collection = self._store.setdefault(reference._collection, {})
+        if merge and reference.id in collection:
+            _merge(collection[reference.id], data)
+        else:
+            document = {}
+            _merge(document, data)
+            collection[reference.id] = document
+        self.writes += 1
+        self._notify(reference)
+
+    def _update(self, reference, data):
+        collection = self._store.setdefault(reference._collection, {})
+        if reference.id not in collection:
+            try:
+                from google.api_core.exceptions import NotFound
+                raise NotFound(f"No document to update: {reference.path}")
+            except ImportError:
+                raise KeyError(reference.path)
+        _update(collection[reference.id], data)
+        self.writes += 1
+        self._notify(reference)
+
+    def _delete(self, reference):
+        self._store.get(reference._collection, {}).pop(reference.id, None)
+        self.writes += 1
+        self._notify(reference)
+
+    def _watch(self, target, callback):
+        watch = FakeWatch(self, target, callback)
+        with self._lock:
+            self._watches.append(watch)
+        watch.notify()
+        return watch
+
+    def _notify(self, reference):
+        for watch in list(self._watches):
+            target = watch._target
+            if isinstance(target, FakeDocumentReference):
+                if target.path != reference.path:
+                    continue
+            elif target._collection != reference._collection:
+                continue
+            threading.Thread(target=watch.notify, daemon=True).start()
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def collection_group(self, name):
+        return FakeCollectionReference(self, name)
+
+    def document(self, path):
+        collection_name, doc_id = path.rsplit("/", 1)
+        return FakeDocumentReference(self, collection_name, doc_id)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def bulk_writer(self, options=None):
+        return FakeBulkWriter(self)
+
+    def transaction(self, **kwargs):
+        return FakeTransaction(self)
+
+    def write_option(self, **kwargs):
+        return None
+
+    def get_all(self, references, transaction=None):
+        return [reference.get() for reference in references]
+
+    def reset_counters(self):
+        with self._lock:
+            self.reads = 0
+            self.writes = 0
+
+    def seed(self, collection_name, documents, id_field="id"):
+        """Load documents directly, bypassing latency and counters"""
+        with self._lock:
+            collection = self._store.setdefault(collection_name, {})
+            for document in documents:
+                collection[document[id_field]] = copy.deepcopy(document)
+
+
+class FakeBulkWriter(FakeWriteBatch):
+    """BulkWriter-compatible surface; writes are applied on flush/close"""
+    def flush(self):
+        self.commit()
+
+    def close(self):
+        self.commit()
+
+    def on_write_result(self, callback):
+        pass
+
+    def on_write_error(self, callback):
+        pass
@@ -0,0 +1,148 @@
+"""
+Loads app.py and functions/main.py against local stand-ins.
+
+Firestore is replaced by FakeFirestore (or pointed at the emulator), OpenAI
+by the stub server via OPENAI_BASE_URL, and Firebase Auth token checks by
+bench tokens of the form "bench:<uid>:<email>". Nothing leaves the machine.
+"""
+import importlib
+import json
+import os
+import sys
+from types import SimpleNamespace
+
+from werkzeug.test import EnvironBuilder
+
+from fake_firestore import FakeFirestore, fake_transactional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS_DIR = os.path.join(REPO_ROOT, "functions")
+
+
+def bench_token(user):
+    return f"bench:{user['uid']}:{user['email']}"
+
+
+class FakeAuth:
+    """Replaces the firebase_admin.auth calls the backends make"""
+    def __init__(self, users):
+        self.by_uid = {u["uid"]: u for u in users}
+        self.by_email = {u["email"]: u for u in users}
+
+    def verify_id_token(self, token, *args, **kwargs):
+        _, uid, email = token.split(":", 2)
+        return {"uid": uid, "email": email}
+
+    def get_user(self, uid, *args, **kwargs):
+        user = self.by_uid.get(uid)
+        return SimpleNamespace(uid=uid, email=user["email"] if user else None)
+
+    def get_user_by_email(self, email, *args, **kwargs):
+        from firebase_admin import auth
+        user = self.by_email.get(email)
+        if not user:
+            raise auth.UserNotFoundError(f"No user record found for the provided email: {email}")
+        return SimpleNamespace(uid=user["uid"], email=email)
+
+    def create_user(self, email=None, display_name=None, **kwargs):
+        user = {"uid": f"uid_{len(self.by_uid):05d}", "email": email}
+        self.by_uid[user["uid"]] = user
+        self.by_email[email] = user
+        return SimpleNamespace(uid=user["uid"], email=email)
+
+    def install(self):
+        from firebase_admin import auth
+        for name in ("verify_id_token", "get_user", "get_user_by_email", "create_user"):
+            setattr(auth, name, getattr(self, name))
+
+
+def configure_environment(openai_base_url, quiet=True):
+    os.environ["OPENAI_BASE_URL"] = openai_base_url
+    os.environ["OPENAI_KEY"] = "bench-key"
+    os.environ["OPENAI_API_KEY"] = "bench-key"
+    os.environ.setdefault("GOOGLE_CLOUD_PROJECT", "arabicchatbot-bench")
+    os.environ.setdefault("GCLOUD_PROJECT", os.environ["GOOGLE_CLOUD_PROJECT"])
+    os.environ.setdefault("FLASK_SECRET_KEY", "bench")
+    if quiet:
+        os.environ["LOG_LEVEL"] = "ERROR"
+        os.environ["LOG_FORMAT"] = "text"
+
+
+def create_db(emulator_host=None, latency_ms=0.0, jitter_ms=0.0):
+    """A FakeFirestore, or a real client talking to the Firestore emulator"""
+    if not emulator_host:
+        return FakeFirestore(latency_ms=latency_ms, jitter_ms=jitter_ms)
+    os.environ["FIRESTORE_EMULATOR_HOST"] = emulator_host
+    import firebase_admin
+    from firebase_admin import firestore
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(options={"projectId": os.environ["GOOGLE_CLOUD_PROJECT"]})
+    return firestore.client()
+
+
+def seed(db, documents):
+    """Write (collection, doc_id, data) tuples, in batches for the emulator"""
+    if isinstance(db, FakeFirestore):
+        with db._lock:
+            for collection, doc_id, data in documents:
+                db._store.setdefault(collection, {})[doc_id] = json.loads(json.dumps(data))
+        return
+    batch, pending = db.batch(), 0
+    for collection, doc_id, data in documents:
+        batch.set(db.collection(collection).document(doc_id), data)
+        pending += 1
+        if pending >= 450:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+
+
+def silence_functions_logger():
+    from firebase_functions import logger
+    logger.write = lambda entry: None
+
+
+def load_app_backend(db):
+    """Import app.py with Firestore swapped for `db`"""
+    if REPO_ROOT not in sys.path:
+        sys.path.insert(0, REPO_ROOT)
+    app_module = importlib.import_module("app")
+    app_module.db = db
+    app_module.firebase_initialized = True
+    return app_module
+
+
+def load_chat_core():
+    """Import functions/chat_core.py, the code both backends share"""
+    if FUNCTIONS_DIR not in sys.path:
+        sys.path.insert(0, FUNCTIONS_DIR)
+    return importlib.import_module("chat_core")
+
+
+def load_functions_backend(db, quiet=True):
+    """Import functions/main.py with Firestore swapped for `db`"""
+    if FUNCTIONS_DIR not in sys.path:
+        sys.path.insert(0, FUNCTIONS_DIR)
+    main_module = importlib.import_module("main")
+    main_module._firestore_client = db
+    if isinstance(db, FakeFirestore):
+        for name in ("record_purchase", "store_session_summary"):
+            transactional = getattr(main_module, name)
+            if hasattr(transactional, "to_wrap"):
+                setattr(main_module, name, fake_transactional(transactional.to_wrap))
+    if quiet:
+        silence_functions_logger()
+    return main_module
+
+
+def call_function(handler, method="GET", path="/", json_body=None, headers=None, query=None):
+    """Invoke an https_fn.on_request handler in-process; returns (status, headers, body)"""
+    from flask import Flask, Request
+    builder = EnvironBuilder(method=method, path=path, json=json_body, headers=headers or {}, query_string=query)
+    request = Request(builder.get_environ())
+    # The CORS wrapper needs an app context; the undecorated function does not
+    target = getattr(handler, "__wrapped__", handler)
+    with Flask("bench").app_context():
+        response = target(request)
+    return response.status_code, response.headers, response.get_data()
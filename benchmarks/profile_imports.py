@@ -0,0 +1,93 @@
+"""
+Import-time profile of functions/main.py (or app.py).
+
+Runs `python -X importtime` in a fresh interpreter and reports the
+cumulative cost of each module the backend imports directly, plus self
+time aggregated by top-level package:
+
+    python benchmarks/profile_imports.py
+    python benchmarks/profile_imports.py --lazy ask_user     # include what ask_user loads on first use
+    python benchmarks/profile_imports.py --target app --top 25
+"""
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+import harness
+
+# Dependencies each function imports lazily on its first request
+LAZY_LOADS = {
+    "ask_user": "main.get_openai_client('bench-key'); main.get_auth()",
+    "on_user_purchase": "main.get_auth()",
+    "api_chatlogs": "",
+}
+
+
+def run_importtime(target, lazy):
+    if target == "app":
+        cwd, code = harness.REPO_ROOT, "import app"
+    else:
+        cwd, code = harness.FUNCTIONS_DIR, "import main"
+        if lazy:
+            code += "; " + LAZY_LOADS[lazy]
+    env = dict(os.environ)
+    env.setdefault("GOOGLE_CLOUD_PROJECT", "arabicchatbot-bench")
+    env.setdefault("OPENAI_KEY", "bench-key")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=cwd, env=env,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr[-2000:])
+        raise SystemExit(result.returncode)
+    return result.stderr
+
+
+def parse(output):
+    """[(depth, module, self_us, cumulative_us)] in the order Python reported them"""
+    rows = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        rows.append((depth, name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", choices=["functions", "app"], default="functions")
+    parser.add_argument("--lazy", choices=sorted(LAZY_LOADS), help="also load what this function imports on first use")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    rows = parse(run_importtime(args.target, args.lazy))
+    total_us = sum(self_us for _, _, self_us, _ in rows)
+    # Depth 0 is the backend module and whatever the lazy loaders pulled in; depth 1 rows
+    # are reported before their parent, so collect them until the backend's own row
+    backend = "app" if args.target == "app" else "main"
+    direct, pending = [], []
+    for depth, name, _, cumulative in rows:
+        if depth == 1:
+            pending.append((cumulative, name))
+        elif depth == 0:
+            direct += pending if name == backend else [(cumulative, name)]
+            pending = []
+    by_package = defaultdict(int)
+    for _, name, self_us, _ in rows:
+        by_package[name.split(".")[0]] += self_us
+
+    label = args.target + (f" + {args.lazy} lazy loads" if args.lazy else "")
+    print(f"Import time for {label}: {total_us / 1000:.0f}ms across {len(rows)} modules\n")
+    print("Direct imports (cumulative):")
+    for cumulative, name in sorted(direct, reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:8.1f}ms  {name}")
+    print("\nSelf time by top-level package:")
+    for name, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {self_us / 1000:8.1f}ms  {self_us / total_us:5.1%}  {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+"""
+Offline load test for ask(), ask_user, get_chatlogs and on_user_purchase.
+
+Both backends run in-process against an in-memory Firestore (or the
+emulator with --emulator) and a local stub of the OpenAI API with
+configurable latency, so results are reproducible on a laptop with no
+network:
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --scenarios ask_user --concurrency 16 --openai-latency-ms 1500
+    python benchmarks/run_benchmarks.py --firestore-latency-ms 15 --messages-per-session 400
+
+Each scenario prints throughput, p50/p95/p99 latency and Firestore
+reads/writes per request (fake Firestore only).
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import harness
+import synthetic
+from stats import report
+from stub_openai import StubOpenAIServer
+
+SCENARIOS = {}
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+def run_load(label, request_fn, total, concurrency, db):
+    """Run request_fn(i) `total` times across `concurrency` threads and report"""
+    if hasattr(db, "reset_counters"):
+        db.reset_counters()
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def timed(i):
+        started = time.perf_counter()
+        try:
+            ok = request_fn(i)
+        except Exception as e:
+            ok = False
+            with lock:
+                errors.append(repr(e))
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed_ms)
+            if ok is False and not errors:
+                errors.append("non-success response")
+
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(timed, range(total)))
+    wall_seconds = time.perf_counter() - wall_started
+
+    extra = ""
+    if hasattr(db, "reads") and total:
+        extra = f"reads/req={db.reads / total:5.1f} writes/req={db.writes / total:5.1f}"
+    if errors:
+        extra += f" errors={len(errors)} (first: {errors[0][:80]})"
+    report(label, latencies, wall_seconds, extra)
+
+
+@scenario("ask_app")
+def ask_app(ctx):
+    app_module = ctx.app_backend()
+
+    def request_fn(i):
+        user = ctx.users[i % len(ctx.users)]
+        client = app_module.app.test_client()
+        response = client.post("/ask", json={
+            "question": random.choice(synthetic.QUESTIONS),
+            "week": "01", "level": "beginner", "gender": "male", "language": "Hebrew"
+        }, headers={"Authorization": f"Bearer {harness.bench_token(user)}"})
+        return response.status_code == 200
+
+    run_load("app.py  POST /ask", request_fn, ctx.args.requests, ctx.args.concurrency, ctx.db)
+
+
+@scenario("ask_user")
+def ask_user(ctx):
+    main_module = ctx.functions_backend()
+
+    def request_fn(i):
+        user = ctx.users[i % len(ctx.users)]
+        status, _, _ = harness.call_function(main_module.ask_user, "POST", "/", json_body={
+            "question": random.choice(synthetic.QUESTIONS),
+            "week": "01", "level": "beginner", "gender": "male", "language": "Hebrew"
+        }, headers={"Authorization": f"Bearer {harness.bench_token(user)}"})
+        return status in (200, 403)
+
+    run_load("functions ask_user", request_fn, ctx.args.requests, ctx.args.concurrency, ctx.db)
+
+
+@scenario("chatlogs_app")
+def chatlogs_app(ctx):
+    app_module = ctx.app_backend()
+
+    def request_fn(i):
+        client = app_module.app.test_client()
+        response = client.get(f"/api/chatlogs?page={1 + i % 5}&pageSize=20")
+        return response.status_code == 200
+
+    run_load("app.py  GET /api/chatlogs", request_fn, ctx.args.requests, ctx.args.concurrency, ctx.db)
+
+
+@scenario("chatlogs_functions")
+def chatlogs_functions(ctx):
+    main_module = ctx.functions_backend()
+
+    def request_fn(i):
+        status, _, _ = harness.call_function(main_module.api_chatlogs, "GET", "/api/chatlogs",
+                                             query={"page": 1 + i % 5, "pageSize": 20})
+        return status == 200
+
+    run_load("functions api_chatlogs GET", request_fn, ctx.args.requests, ctx.args.concurrency, ctx.db)
+
+
+@scenario("purchase")
+def purchase(ctx):
+    main_module = ctx.functions_backend()
+    run_id = uuid.uuid4().hex[:8]
+
+    def deliver(i):
+        user = ctx.users[i % len(ctx.users)]
+        status, _, body = harness.call_function(main_module.on_user_purchase, "POST", "/",
+                                                json_body=synthetic.purchase_payload(f"bench_{run_id}_{i}", user["email"]))
+        return status == 200
+
+    def redeliver(i):
+        user = ctx.users[i % len(ctx.users)]
+        status, _, body = harness.call_function(main_module.on_user_purchase, "POST", "/",
+                                                json_body=synthetic.purchase_payload(f"bench_{run_id}_{i}", user["email"]))
+        return status == 200 and json.loads(body).get("duplicate") is True
+
+    run_load("functions on_user_purchase", deliver, ctx.args.requests, ctx.args.concurrency, ctx.db)
+    run_load("functions on_user_purchase retry", redeliver, ctx.args.requests, ctx.args.concurrency, ctx.db)
+
+
+class Context:
+    def __init__(self, args, db, users):
+        self.args = args
+        self.db = db
+        self.users = users
+        self._app = None
+        self._functions = None
+
+    def app_backend(self):
+        if self._app is None:
+            self._app = harness.load_app_backend(self.db)
+        return self._app
+
+    def functions_backend(self):
+        if self._functions is None:
+            self._functions = harness.load_functions_backend(self.db, quiet=not self.args.verbose)
+        return self._functions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--sessions", type=int, default=200, help="extra chat sessions to seed for listing scenarios")
+    parser.add_argument("--messages-per-session", type=int, default=40)
+    parser.add_argument("--weeks", type=int, default=12, help="weeks of materials per level")
+    parser.add_argument("--firestore-latency-ms", type=float, default=0.0, help="simulated Firestore round trip (fake only)")
+    parser.add_argument("--firestore-jitter-ms", type=float, default=0.0)
+    parser.add_argument("--openai-latency-ms", type=float, default=500.0)
+    parser.add_argument("--openai-jitter-ms", type=float, default=100.0)
+    parser.add_argument("--openai-error-rate", type=float, default=0.0)
+    parser.add_argument("--emulator", metavar="HOST:PORT", help="use the Firestore emulator instead of the in-memory fake")
+    parser.add_argument("--verbose", action="store_true", help="keep backend logging enabled")
+    args = parser.parse_args()
+
+    unknown = set(args.scenarios.split(",")) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    stub = StubOpenAIServer(latency_ms=args.openai_latency_ms, jitter_ms=args.openai_jitter_ms,
+                            error_rate=args.openai_error_rate).start()
+    harness.configure_environment(stub.base_url, quiet=not args.verbose)
+
+    db = harness.create_db(args.emulator, args.firestore_latency_ms, args.firestore_jitter_ms)
+    rng = random.Random(1)
+    users = synthetic.generate_users(args.users, rng=rng)
+    documents = [("materials", m["id"], m) for m in synthetic.generate_materials(synthetic.LEVELS, range(1, args.weeks + 1))]
+    for user in users:
+        documents += synthetic.user_documents(user)
+        documents += synthetic.session_documents(user, args.messages_per_session, rng=rng)
+    extra_users = synthetic.generate_users(args.sessions, rng=rng)
+    for i, user in enumerate(extra_users):
+        user = dict(user, uid=f"archived{i:05d}", email=f"archived{i:05d}@example.com")
+        documents += synthetic.session_documents(user, args.messages_per_session, rng=rng)
+    harness.seed(db, documents)
+    harness.FakeAuth(users).install()
+
+    print(f"Seeded {len(documents)} documents; OpenAI stub at {stub.base_url} "
+          f"({args.openai_latency_ms:.0f}ms ± {args.openai_jitter_ms:.0f}ms); "
+          f"Firestore {'emulator ' + args.emulator if args.emulator else 'fake'}; "
+          f"{args.requests} requests x {args.concurrency} threads\n")
+
+    ctx = Context(args, db, users)
+    for name in args.scenarios.split(","):
+        SCENARIOS[name](ctx)
+
+    stub.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
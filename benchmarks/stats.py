@@ -0,0 +1,39 @@
+"""Latency statistics shared by the benchmark scripts."""
+import statistics
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of samples"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+def summarize(samples_ms, wall_seconds=None):
+    """Count, throughput and latency percentiles for a list of millisecond samples"""
+    summary = {
+        "n": len(samples_ms),
+        "mean": statistics.mean(samples_ms) if samples_ms else 0.0,
+        "p50": percentile(samples_ms, 50),
+        "p95": percentile(samples_ms, 95),
+        "p99": percentile(samples_ms, 99),
+    }
+    if wall_seconds:
+        summary["rps"] = len(samples_ms) / wall_seconds
+    return summary
+
+
+def report(label, samples_ms, wall_seconds=None, extra=""):
+    """Print one aligned result line"""
+    if not samples_ms:
+        print(f"{label:<32} no samples")
+        return
+    s = summarize(samples_ms, wall_seconds)
+    throughput = f"rps={s['rps']:8.1f} " if "rps" in s else ""
+    print(
+        f"{label:<32} n={s['n']:<5} {throughput}"
+        f"mean={s['mean']:8.1f}ms p50={s['p50']:8.1f}ms "
+        f"p95={s['p95']:8.1f}ms p99={s['p99']:8.1f}ms {extra}".rstrip()
+    )
@@ -0,0 +1,221 @@
+"""
+Local stand-in for the OpenAI chat completions API.
+
+Serves GET /v1/models and POST /v1/chat/completions (including `stream: true`
+server-sent events) with configurable latency, jitter, slow-tail and error injection,
+so the backends can be exercised with the real OpenAI SDK and no network:
+
+    server = StubOpenAIServer(latency_ms=800, error_rate=0.05).start()
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+
+It can also run standalone:
+
+    python benchmarks/stub_openai.py --port 8765 --latency-ms 1500
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = (
+    "מַרְחַבַּא (مَرْحَبَا) פירושו 'שלום'. דוגמה: مَرْحَبَا، كِيفَك؟ - מַרְחַבַּא, כִּיפַכּ? "
+    "נסו לענות: منيح، الحمد لله."
+)
+
+
+class StubConfig:
+    """Mutable behaviour of the stub; scenarios may change it between runs"""
+    def __init__(self, latency_ms=500.0, jitter_ms=0.0, error_rate=0.0, error_status=503,
+                 hang_rate=0.0, tail_rate=0.0, tail_ms=0.0, stream_chunk_ms=20.0, answer=DEFAULT_ANSWER):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hang_rate = hang_rate
+        # A tail_rate fraction of requests takes tail_ms longer (slow-tail latency)
+        self.tail_rate = tail_rate
+        self.tail_ms = tail_ms
+        self.stream_chunk_ms = stream_chunk_ms
+        self.answer = answer
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token) for the usage block"""
+    return max(1, len(text) // 4)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [
+                {"id": model, "object": "model", "created": 0, "owned_by": "stub"}
+                for model in ("gpt-4-turbo", "gpt-4o", "gpt-4o-mini", "gpt-3.5-turbo")
+            ]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        config = self.config
+        with config.lock:
+            config.requests += 1
+
+        if config.hang_rate and random.random() < config.hang_rate:
+            time.sleep(3600)
+            return
+
+        delay_ms = config.latency_ms + random.uniform(0, config.jitter_ms)
+        if config.tail_rate and random.random() < config.tail_rate:
+            delay_ms += config.tail_ms
+        time.sleep(delay_ms / 1000)
+
+        if config.error_rate and random.random() < config.error_rate:
+            self._send_json(config.error_status, {"error": {
+                "message": "Injected upstream error", "type": "server_error", "code": None
+            }})
+            return
+
+        model = body.get("model", "gpt-4-turbo")
+        prompt_text = "".join(m.get("content") or "" for m in body.get("messages", []))
+        answer = config.answer
+        max_tokens = body.get("max_tokens")
+        if max_tokens:
+            answer = answer[:max_tokens * 4]
+        usage = {
+            "prompt_tokens": estimate_tokens(prompt_text),
+            "completion_tokens": estimate_tokens(answer),
+            "total_tokens": estimate_tokens(prompt_text) + estimate_tokens(answer),
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+
+        if body.get("stream"):
+            self._stream(completion_id, model, answer)
+            return
+
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def _stream(self, completion_id, model, answer):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def write_chunk(data):
+            payload = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(payload):X}\r\n".encode() + payload + b"\r\n")
+            self.wfile.flush()
+
+        words = answer.split(" ")
+        for i, word in enumerate(words):
+            delta = {"content": word + (" " if i < len(words) - 1 else "")}
+            if i == 0:
+                delta["role"] = "assistant"
+            write_chunk(json.dumps({
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }))
+            time.sleep(self.config.stream_chunk_ms / 1000)
+        write_chunk(json.dumps({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }))
+        write_chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class StubOpenAIServer:
+    """Runs the stub in a background thread"""
+    def __init__(self, host="127.0.0.1", port=0, **config):
+        self.config = StubConfig(**config)
+        self._server = ThreadingHTTPServer((host, port), StubHandler)
+        self._server.daemon_threads = True
+        self._server.config = self.config
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stub of the OpenAI chat completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=500.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("--hang-rate", type=float, default=0.0)
+    parser.add_argument("--tail-rate", type=float, default=0.0)
+    parser.add_argument("--tail-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = StubOpenAIServer(
+        host=args.host, port=args.port, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate, error_status=args.error_status, hang_rate=args.hang_rate,
+        tail_rate=args.tail_rate, tail_ms=args.tail_ms
+    ).start()
+    print(f"Stub OpenAI API listening on {server.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
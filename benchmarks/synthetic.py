@@ -0,0 +1,162 @@
+"""
+Synthetic users, chat sessions, materials and payment webhooks for benchmarks.
+
+Materials are derived from data_files/materials_data_set.json so prompt
+sizes and text (Hebrew/Arabic) match production; sessions mix Hebrew and
+Arabic messages of realistic length.
+"""
+import base64
+import json
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MATERIALS_PATH = os.path.join(REPO_ROOT, "data_files", "materials_data_set.json")
+
+LEVELS = ["beginner", "intermediate", "advanced"]
+
+QUESTIONS = [
+    "איך אומרים שלום בערבית?",
+    "מה זה أنَا?",
+    "how do I say thank you?",
+    "תן לי דיאלוג קצר עם המילים של השבוע",
+    "תודה!",
+    "תסביר לי את ההבדל בין مَرْحَبَا ל-أهْلًا وسَهْلًا",
+    "תכין לי חידון על אוצר המילים של השבוע",
+    "איך אומרים אני בערבית?",
+]
+
+BOT_REPLIES = [
+    "مَرْحَبَا (מַרְחַבַּא) - שלום. אפשר גם לומר أهْلًا (אַהְלַן). בוא נתרגל: مَرْحَبَا، كِيفَك؟",
+    "أنَا (אָנַא) פירושו 'אני'. לדוגמה: أنَا إسْمِي لَيْث - אָנַא אִסְמִי לֵית'.",
+    "שאלה מצוינת! הנה דיאלוג קצר:\nא: مَرْحَبَا!\nב: أهْلًا وسَهْلًا، كِيفَك؟\nא: منيح، الحمد لله.",
+]
+
+
+def encode_email(email):
+    """Same encoding app.py uses for user document IDs"""
+    return base64.urlsafe_b64encode(email.encode()).decode()
+
+
+def load_materials(path=MATERIALS_PATH):
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def generate_materials(levels=("beginner",), weeks=range(1, 13), per_lesson=40, seed_items=None):
+    """Materials for every (level, week), cycling through the real dataset's triples"""
+    seed_items = seed_items or load_materials()
+    materials = []
+    for level in levels:
+        for week in weeks:
+            for i in range(per_lesson):
+                source = seed_items[(week * per_lesson + i) % len(seed_items)]
+                materials.append({
+                    "id": f"{level}_week_{week:02d}_{i + 1:03d}",
+                    "hebrew_input": source["hebrew_input"],
+                    "arabic_response": source["arabic_response"],
+                    "pronunciation": source["pronunciation"],
+                })
+    return materials
+
+
+def generate_users(count, premium_ratio=0.2, rng=None):
+    rng = rng or random.Random(42)
+    usage_month = datetime.now(timezone.utc).strftime("%Y-%m")
+    users = []
+    for i in range(count):
+        email = f"student{i:05d}@example.com"
+        is_premium = rng.random() < premium_ratio
+        used = rng.randint(0, 30)
+        users.append({
+            "uid": f"uid{i:05d}",
+            "email": email,
+            "isPremium": is_premium,
+            "messagesThisMonth": used,
+            "usageMonth": usage_month,
+        })
+    return users
+
+
+def user_documents(user):
+    """(collection, doc_id, data) tuples for both backends' user/subscription schemes"""
+    now = datetime.now(timezone.utc)
+    docs = [
+        ("users", user["uid"], {
+            "userId": user["uid"],
+            "email": user["email"],
+            "isPremium": user["isPremium"],
+        }),
+        ("users", encode_email(user["email"]), {
+            "userId": encode_email(user["email"]),
+            "email": user["email"],
+            "isPremium": user["isPremium"],
+        }),
+    ]
+    for user_id in (user["uid"], encode_email(user["email"])):
+        docs.append((f"users/{user_id}/monthlyUsage", user["usageMonth"], {
+            "month": user["usageMonth"],
+            "messages": user["messagesThisMonth"],
+        }))
+    if user["isPremium"]:
+        subscription = {
+            "userEmail": user["email"],
+            "plan": "premium",
+            "status": "active",
+            "startDate": (now - timedelta(days=3)).isoformat(),
+            "endDate": (now + timedelta(days=27)).isoformat(),
+        }
+        docs.append(("subscriptions", user["uid"], dict(subscription, userId=user["uid"])))
+        docs.append(("subscriptions", encode_email(user["email"]), dict(subscription, userId=encode_email(user["email"]))))
+    return docs
+
+
+def generate_messages(count, id_prefix, rng=None, start=None):
+    rng = rng or random.Random(7)
+    start = start or datetime.now(timezone.utc) - timedelta(days=30)
+    messages = []
+    for i in range(count):
+        is_user = i % 2 == 0
+        messages.append({
+            "id": f"{id_prefix}_{i}",
+            "sender": "user" if is_user else "bot",
+            "text": rng.choice(QUESTIONS) if is_user else rng.choice(BOT_REPLIES),
+            "timestamp": (start + timedelta(minutes=i)).isoformat(),
+            "isUser": is_user,
+        })
+    return messages
+
+
+def session_documents(user, messages_per_session, level="beginner", week="01", rng=None):
+    """chatLogs documents in both backends' session ID schemes"""
+    created = datetime.now(timezone.utc) - timedelta(days=30)
+    base = {
+        "userEmail": user["email"],
+        "userName": user["email"].split("@")[0],
+        "createdAt": created.isoformat(),
+        "updatedAt": datetime.now(timezone.utc).isoformat(),
+        "level": level,
+        "language": "Hebrew",
+        "week": week,
+        "gender": "male",
+    }
+    app_session_id = f"session_{user['email'].split('@')[0]}"
+    return [
+        ("chatLogs", user["uid"], dict(base, _id=user["uid"], userId=user["uid"],
+                                       messages=generate_messages(messages_per_session, user["uid"], rng))),
+        ("chatLogs", app_session_id, dict(base, _id=app_session_id, userId=user["email"],
+                                          messages=generate_messages(messages_per_session, app_session_id, rng))),
+    ]
+
+
+def purchase_payload(transaction_code, email, payment_sum=30):
+    return {
+        "webhookKey": "BENCH",
+        "transactionCode": transaction_code,
+        "transactionType": "אשראי",
+        "paymentSum": payment_sum,
+        "paymentType": "monthly",
+        "payerEmail": email,
+        "fullName": "Bench User",
+    }
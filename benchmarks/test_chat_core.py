@@ -0,0 +1,111 @@
+"""
+Unit tests for the pure helpers in functions/chat_core.py:
+
+    python -m pytest -q benchmarks/test_chat_core.py
+"""
+import json
+import os
+
+import harness
+
+chat_core = harness.load_chat_core()
+
+MATERIALS_PATH = os.path.join(harness.REPO_ROOT, "data_files", "materials_data_set.json")
+
+
+def load_materials():
+    with open(MATERIALS_PATH, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def test_normalize_arabic_keeps_letters():
+    assert chat_core.normalize_arabic("مرحبا كيفك") == "مرحبا كيفك"
+    assert chat_core.normalize_arabic("مَرْحَبًا") == "مرحبا"
+    assert chat_core.normalize_arabic("أهْلًا") == "اهلا"
+
+
+def test_arabic_index_resolves_dataset_words():
+    materials = load_materials()
+    index = chat_core.MaterialsIndex(materials)
+    assert index.by_arabic
+    welcome = next(mat for mat in materials if mat["arabic_response"] == "أهْلًا وسَهْلًا")
+    matches, direction = index.lookup("اهلا وسهلا")
+    assert direction == "arabic"
+    assert welcome in matches
+
+
+def test_hebrew_lookup_ignores_niqqud_notes_and_final_letters():
+    material = {"id": "m1", "hebrew_input": "מה שלומך (זכר)", "arabic_response": "كيفك", "pronunciation": "כיפכ"}
+    index = chat_core.MaterialsIndex([material])
+    for term in ("מה שלומך", "מַה שְׁלוֹמְךָ", "מה שלומכ?", "מה שלומך (זכר)"):
+        assert index.lookup(term) == ([material], "hebrew")
+    assert index.lookup("كيفك") == ([material], "arabic")
+    assert index.lookup("בוקר טוב") == ([], "hebrew")
+
+
+def test_find_mentions_in_free_text():
+    materials = [
+        {"id": "m1", "hebrew_input": "בוקר טוב", "arabic_response": "صباح الخير", "pronunciation": ""},
+        {"id": "m2", "hebrew_input": "תודה", "arabic_response": "شكرا", "pronunciation": ""},
+    ]
+    index = chat_core.MaterialsIndex(materials)
+    assert index.find_mentions("אני לא זוכר איך אומרים בוקר טוב, תודה") == materials
+    assert index.find_mentions("قلتلو صباح الخير") == [materials[0]]
+    assert index.find_mentions("שלום לכולם") == []
+
+
+def test_extract_lookup_term():
+    assert chat_core.extract_lookup_term("איך אומרים תודה בערבית?") == "תודה"
+    assert chat_core.extract_lookup_term("מה זה شكرا") == "شكرا"
+    assert chat_core.extract_lookup_term("How do I say good morning in Arabic?") == "good morning"
+    assert chat_core.extract_lookup_term("translate thank you") == "thank you"
+    assert chat_core.extract_lookup_term("תכתוב לי דיאלוג במסעדה") is None
+    assert chat_core.extract_lookup_term("what is the difference between all of these words in the lesson") is None
+
+
+def test_classify_question():
+    assert chat_core.classify_question("תודה רבה!") == "short"
+    assert chat_core.classify_question("مرحبا") == "short"
+    assert chat_core.classify_question("מה זה شكرا") == "short"
+    assert chat_core.classify_question("תכתוב לי דיאלוג במסעדה") == "extended"
+    assert chat_core.classify_question("x" * chat_core.EXTENDED_QUESTION_MIN_CHARS) == "extended"
+    assert chat_core.classify_question("can you explain when to use the feminine form here") == "standard"
+
+
+def test_version_etag_changes_with_the_session_version():
+    etag = chat_core.version_etag(chat_core.session_version("s1", {"revision": 3, "updatedAt": "2025-06-01T10:00:00"}))
+    assert etag == chat_core.version_etag(["s1", 3, "2025-06-01T10:00:00"])
+    assert etag != chat_core.version_etag(chat_core.session_version("s1", {"revision": 4, "updatedAt": "2025-06-01T10:00:00"}))
+    assert chat_core.session_version("s1", {}) == ["s1", 0, None]
+    assert len(etag) == 20
+
+
+def test_export_cursor_round_trip():
+    for session_id in ("abc", "session_2025-06-01_ü", "a" * 41):
+        cursor = chat_core.encode_export_cursor(session_id)
+        assert "=" not in cursor
+        assert chat_core.decode_export_cursor(cursor) == session_id
+
+
+def test_export_cursor_rejects_malformed_cursors():
+    for cursor in ("", "!!!", "a"):
+        try:
+            chat_core.decode_export_cursor(cursor)
+        except ValueError:
+            continue
+        raise AssertionError(f"{cursor!r} was accepted")
+
+
+def test_usage_periods():
+    start, end = chat_core.parse_usage_date("2024-12-30"), chat_core.parse_usage_date("2025-01-02")
+    assert chat_core.usage_periods("day", start, end) == ["2024-12-30", "2024-12-31", "2025-01-01", "2025-01-02"]
+    start, end = chat_core.parse_usage_date("2024-11"), chat_core.parse_usage_date("2025-02")
+    assert chat_core.usage_periods("month", start, end) == ["2024-11", "2024-12", "2025-01", "2025-02"]
+    assert chat_core.usage_periods("day", end, start) == []
+
+
+def test_add_usage_counters():
+    total = {}
+    chat_core.add_usage_counters(total, {"messages": 2, "sources": {"llm": 1}, "period": "2025-06", "live": True})
+    chat_core.add_usage_counters(total, {"messages": 4, "sources": {"llm": 1, "dictionary": 2}})
+    assert total == {"messages": 6, "sources": {"llm": 2, "dictionary": 2}}
@@ -0,0 +1,101 @@
+"""
+Build the read-only materials snapshot shipped with the Cloud Functions.
+
+The artifact lets a cold instance serve lesson materials straight from a
+memory-mapped file, with Firestore still deciding which lessons are current
+(a lesson is used only while its hash matches materialsMeta/current).
+
+Layout (little-endian):
+    8 bytes   magic b"BLMSNAP1"
+    4 bytes   header length N
+    N bytes   UTF-8 JSON header: {"materialsVersion", "createdAt", "source",
+              "lessons": {lesson_key: {"offset", "length", "hash", "count"}}}
+    ...       lesson payloads, each a compact UTF-8 JSON array of items;
+              offsets are relative to the end of the header
+
+Usage:
+    python build_materials_snapshot.py                          # from data_files/materials_data_set.json
+    python build_materials_snapshot.py --file curriculum.jsonl
+    python build_materials_snapshot.py --from-firestore         # current published materials
+"""
+import os
+import json
+import struct
+import argparse
+from datetime import datetime, timezone
+
+from seed_data import (
+    MATERIALS_FILE, MATERIALS_COLLECTION, MATERIALS_META_COLLECTION, MATERIALS_META_DOC, HASH_FIELD,
+    iter_materials, lesson_key_for, bundle_hash, load_lessons, initialize_firebase
+)
+
+SNAPSHOT_MAGIC = b"BLMSNAP1"
+SNAPSHOT_PATH = os.path.join('functions', 'materials_snapshot.bin')
+
+def lessons_from_file(path):
+    """lesson_key -> items sorted by id, normalised the same way as published bundles"""
+    lessons = {}
+    for item in iter_materials(path):
+        item = {k: v for k, v in item.items() if k != HASH_FIELD}
+        lessons.setdefault(lesson_key_for(item['id']), {})[item['id']] = item
+    return {key: [items[i] for i in sorted(items)] for key, items in lessons.items()}
+
+def lessons_from_firestore(credentials_path):
+    """(materials version, lessons) read from the live materials collection"""
+    from firebase_admin import firestore
+    initialize_firebase(credentials_path)
+    db = firestore.client()
+    meta = db.collection(MATERIALS_META_COLLECTION).document(MATERIALS_META_DOC).get()
+    version = (meta.to_dict() or {}).get('version') if meta.exists else None
+    return version, load_lessons(db.collection(MATERIALS_COLLECTION))
+
+def write_snapshot(path, lessons, version=None, source=None):
+    """Serialise lessons into the snapshot layout; returns the file size in bytes"""
+    index, payloads, offset = {}, [], 0
+    for key in sorted(lessons):
+        items = lessons[key]
+        payload = json.dumps(items, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+        index[key] = {"offset": offset, "length": len(payload), "hash": bundle_hash(items), "count": len(items)}
+        payloads.append(payload)
+        offset += len(payload)
+
+    header = json.dumps({
+        "materialsVersion": version,
+        "createdAt": datetime.now(timezone.utc).isoformat(),
+        "source": source,
+        "lessons": index,
+    }, ensure_ascii=False, separators=(",", ":")).encode('utf-8')
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(SNAPSHOT_MAGIC)
+        file.write(struct.pack('<I', len(header)))
+        file.write(header)
+        for payload in payloads:
+            file.write(payload)
+    os.replace(temp_path, path)
+    return os.path.getsize(path)
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the memory-mapped materials snapshot for Cloud Functions")
+    parser.add_argument("--file", default=MATERIALS_FILE, help="materials JSON array or .jsonl file")
+    parser.add_argument("--from-firestore", action="store_true", help="read the materials collection instead of --file")
+    parser.add_argument("--credentials", default="serviceAccountKey.json")
+    parser.add_argument("--output", default=SNAPSHOT_PATH)
+    args = parser.parse_args()
+
+    if args.from_firestore:
+        version, lessons = lessons_from_firestore(args.credentials)
+        source = "firestore"
+    else:
+        version, lessons = None, lessons_from_file(args.file)
+        source = os.path.basename(args.file)
+
+    size = write_snapshot(args.output, lessons, version, source)
+    items = sum(len(items) for items in lessons.values())
+    print(f"📦 Wrote {args.output}: {len(lessons)} lessons, {items} materials, {size} bytes"
+          + (f", materials version {version}" if version is not None else ""))
+
+if __name__ == "__main__":
+    main()
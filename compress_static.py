@@ -0,0 +1,101 @@
+"""
+Precompress the built frontend for app.py's static file serving.
+
+Runs after `vite build` (the npm `postbuild` script). For every text-like
+file in build/ it writes `<file>.gz` and, when the `brotli` package is
+installed, `<file>.br`, keeping a variant only if it is meaningfully
+smaller. Already-compressed formats (JPEG, WebP, fonts, ...) are skipped.
+
+It also writes build/.static-manifest.json with a content-hash ETag and the
+available encodings per file, so servers answer conditional requests
+without hashing anything at startup:
+
+    {"files": {"assets/index-3f9a1c2b.js": {"etag": "...", "size": 123, "encodings": ["br", "gzip"]}}}
+
+Usage:
+    python compress_static.py
+    python compress_static.py --build-dir build --min-size 512
+"""
+import os
+import gzip
+import json
+import hashlib
+import argparse
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_DIR = 'build'
+MANIFEST_NAME = '.static-manifest.json'
+MIN_SIZE = 1024
+# A variant is kept only if it saves at least this fraction of the original
+MIN_SAVING = 0.05
+COMPRESSIBLE_EXTENSIONS = {
+    '.html', '.js', '.mjs', '.css', '.json', '.map', '.svg', '.txt', '.xml',
+    '.ico', '.png', '.bmp', '.wasm', '.webmanifest',
+}
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+def file_etag(data):
+    return hashlib.sha256(data).hexdigest()[:20]
+
+def compress(data, encoding):
+    if encoding == 'gzip':
+        # mtime=0 keeps the output identical across builds
+        return gzip.compress(data, compresslevel=9, mtime=0)
+    return brotli.compress(data, quality=11)
+
+def iter_build_files(build_dir):
+    for root, _, files in os.walk(build_dir):
+        for name in files:
+            if name == MANIFEST_NAME or name.endswith(tuple(ENCODING_SUFFIXES.values())):
+                continue
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, build_dir).replace(os.sep, '/'), path
+
+def compress_build(build_dir=BUILD_DIR, min_size=MIN_SIZE):
+    """Write the compressed variants and manifest; returns (files, original bytes, smallest-variant bytes)"""
+    encodings = ['br', 'gzip'] if brotli else ['gzip']
+    manifest, original_total, served_total = {}, 0, 0
+    for relative_path, path in sorted(iter_build_files(build_dir)):
+        with open(path, 'rb') as file:
+            data = file.read()
+        entry = {"etag": file_etag(data), "size": len(data), "encodings": []}
+        smallest = len(data)
+        extension = os.path.splitext(path)[1].lower()
+        for encoding in encodings:
+            variant_path = path + ENCODING_SUFFIXES[encoding]
+            compressed = compress(data, encoding) if extension in COMPRESSIBLE_EXTENSIONS and len(data) >= min_size else None
+            if compressed is not None and len(compressed) <= len(data) * (1 - MIN_SAVING):
+                with open(variant_path, 'wb') as file:
+                    file.write(compressed)
+                entry["encodings"].append(encoding)
+                smallest = min(smallest, len(compressed))
+            elif os.path.exists(variant_path):
+                os.remove(variant_path)
+        manifest[relative_path] = entry
+        original_total += len(data)
+        served_total += smallest
+
+    with open(os.path.join(build_dir, MANIFEST_NAME), 'w', encoding='utf-8') as file:
+        json.dump({"files": manifest}, file, separators=(",", ":"))
+    return len(manifest), original_total, served_total
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompress the built frontend and write its ETag manifest")
+    parser.add_argument("--build-dir", default=BUILD_DIR)
+    parser.add_argument("--min-size", type=int, default=MIN_SIZE, help="smallest file worth compressing, in bytes")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.build_dir):
+        raise SystemExit(f"❌ {args.build_dir}/ not found; run the frontend build first")
+    if brotli is None:
+        print("⚠️ brotli is not installed (pip install brotli); writing gzip variants only")
+    files, original, served = compress_build(args.build_dir, args.min_size)
+    saving = 1 - served / original if original else 0
+    print(f"🗜️ Compressed {args.build_dir}/: {files} files, {original} bytes -> {served} bytes at best ({saving:.0%} smaller)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Expire lapsed subscriptions in bulk, for deployments that run app.py
+without the functions backend's scheduled `expire_subscriptions` sweep.
+
+Requests only read the entitlement on the user document (isPremium and
+subscriptionEndDate). This job finds every active or trial subscription
+whose endDate has passed with one indexed range query. It marks each one
+expired and clears its user's isPremium flag, in batched writes. A
+subscription renewed between the query and the write is left alone.
+
+endDate is stored as a Firestore timestamp. Documents that still hold an
+ISO string are converted first, because strings sort after every
+timestamp and the range query would never see them.
+
+Usage:
+    python expire_subscriptions.py --dry-run
+    python expire_subscriptions.py
+    python expire_subscriptions.py --watch --interval 900
+"""
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timezone
+
+from firebase_admin import firestore
+from google.api_core.exceptions import FailedPrecondition
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "functions"))
+from chat_core import ACTIVE_SUBSCRIPTION_STATUSES, subscription_end
+from seed_data import initialize_firebase
+
+SUBSCRIPTIONS_COLLECTION = 'subscriptions'
+USERS_COLLECTION = 'users'
+PAGE_SIZE = 200    # two writes per subscription, under the 500-write batch limit
+
+def convert_legacy_end_dates(db, dry_run=False):
+    """Rewrite ISO-string endDates as timestamps; returns how many were (or would be) converted"""
+    docs = list(db.collection(SUBSCRIPTIONS_COLLECTION)
+                .where(filter=FieldFilter("endDate", ">=", "")).select(["endDate"]).stream())
+    converted = 0
+    for start in range(0, len(docs), PAGE_SIZE):
+        batch, pending = db.batch(), 0
+        for doc in docs[start:start + PAGE_SIZE]:
+            end_date = subscription_end(doc.get("endDate"))
+            if end_date is None:
+                print(f"⚠️ Subscription {doc.id} has an unreadable endDate: {doc.get('endDate')!r}")
+                continue
+            batch.update(doc.reference, {"endDate": end_date}, option=db.write_option(last_update_time=doc.update_time))
+            pending += 1
+        if dry_run or not pending:
+            converted += pending
+            continue
+        try:
+            batch.commit()
+            converted += pending
+        except FailedPrecondition:
+            print(f"⚠️ {pending} subscriptions changed while converting; the next run picks them up")
+    return converted
+
+def expire_batch(db, docs, now):
+    """Expire `docs` and clear their users' entitlement; returns how many were expired"""
+    def add(batch, doc):
+        batch.update(doc.reference, {
+            "status": "expired",
+            "expiredAt": now,
+            "updatedAt": now.isoformat(),
+        }, option=db.write_option(last_update_time=doc.update_time))
+        batch.set(db.collection(USERS_COLLECTION).document(doc.id), {
+            "isPremium": False,
+            "subscriptionStatus": "expired",
+            "updatedAt": now.isoformat(),
+        }, merge=True)
+
+    batch = db.batch()
+    for doc in docs:
+        add(batch, doc)
+    try:
+        batch.commit()
+        return len(docs)
+    except FailedPrecondition:
+        # Someone renewed meanwhile; retry the others one by one
+        expired = 0
+        for doc in docs:
+            single = db.batch()
+            add(single, doc)
+            try:
+                single.commit()
+                expired += 1
+            except FailedPrecondition:
+                print(f"↩️ Subscription {doc.id} was renewed during the sweep; left active")
+        return expired
+
+def sweep(db, dry_run=False, page_size=PAGE_SIZE):
+    """(expired, converted) for one pass over the lapsed subscriptions"""
+    now = datetime.now(timezone.utc)
+    converted = convert_legacy_end_dates(db, dry_run)
+    query = db.collection(SUBSCRIPTIONS_COLLECTION) \
+        .where(filter=FieldFilter("status", "in", ACTIVE_SUBSCRIPTION_STATUSES)) \
+        .where(filter=FieldFilter("endDate", "<=", now)) \
+        .order_by("endDate") \
+        .order_by(FieldPath.document_id()) \
+        .select(["endDate"]) \
+        .limit(page_size)
+    expired, last = 0, None
+    while True:
+        docs = list((query.start_after(last) if last else query).stream())
+        if not docs:
+            break
+        expired += len(docs) if dry_run else expire_batch(db, docs, now)
+        if len(docs) < page_size:
+            break
+        last = docs[-1]
+    return expired, converted
+
+def main():
+    parser = argparse.ArgumentParser(description="Expire lapsed subscriptions and clear their users' premium flag")
+    parser.add_argument("--credentials", default="serviceAccountKey.json")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--watch", action="store_true", help="keep running, sweeping every --interval seconds")
+    parser.add_argument("--interval", type=float, default=900, help="seconds between sweeps with --watch")
+    args = parser.parse_args()
+
+    initialize_firebase(args.credentials)
+    db = firestore.client()
+    while True:
+        expired, converted = sweep(db, args.dry_run, args.page_size)
+        prefix = "🔎 Dry run: would expire" if args.dry_run else "✅ Expired"
+        print(f"{prefix} {expired} subscriptions" + (f", converted {converted} string end dates" if converted else ""))
+        if not args.watch:
+            return
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1103 @@
+"""
+Code shared by app.py and functions/main.py: the OpenAI resilience layer,
+the canonical user alias index, the lesson materials store, the dictionary
+fast path, the teaching prompt and session summaries, pre-generated lesson
+content, question routing, the free-plan quota and premium entitlement, the
+chat-log ETag helpers, and the chat-log export and usage rollup helpers.
+
+It lives in functions/, which is deployed on its own; app.py and the
+scripts at the repository root add this directory to sys.path. Nothing here
+imports Flask or firebase_functions: each backend passes a BackendHooks
+subclass that maps Firestore reads/writes, cache lookups, OpenAI resilience
+events and log events onto its own metrics and logger.
+"""
+import base64
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime, timedelta, timezone
+
+from cachetools import TTLCache
+from google.cloud.firestore_v1.base_query import FieldFilter
+
+
+class BackendHooks:
+    """What the shared code reports; the defaults only log through the standard logging module"""
+    def firestore_read(self, collection, amount=1):
+        pass
+
+    def firestore_write(self, collection, amount=1):
+        pass
+
+    def cache(self, name, hit):
+        pass
+
+    def llm_event(self, event, **fields):
+        """retry, hedge, exhausted, rejected or circuit_opened"""
+        pass
+
+    def log(self, event, severity="INFO", **fields):
+        logging.getLogger(__name__).log(getattr(logging, severity, logging.INFO), "%s %s", event, fields)
+
+
+# ------------------------------
+# OpenAI resilience: per-attempt deadlines, jittered retries of transient
+# errors, optional hedging and a circuit breaker that fails fast
+# ------------------------------
+LLM_ATTEMPT_TIMEOUT = float(os.getenv("LLM_ATTEMPT_TIMEOUT", "25"))
+LLM_TOTAL_DEADLINE = float(os.getenv("LLM_TOTAL_DEADLINE", "45"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+LLM_RETRY_BASE_DELAY = 0.5
+LLM_RETRY_MAX_DELAY = 4.0
+# "off", "p95" (hedge once an attempt is slower than the recent p95 of its
+# model) or a fixed number of seconds
+LLM_HEDGE = os.getenv("LLM_HEDGE", "off")
+LLM_HEDGE_MIN_DELAY = 1.0
+LLM_HEDGE_MIN_SAMPLES = 20
+LLM_LATENCY_WINDOW = 200
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_COOLDOWN = float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+
+class LLMUnavailable(Exception):
+    """The OpenAI call was refused by the open circuit or ran out of attempts"""
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failed calls and rejects
+    calls for `cooldown` seconds; then lets one trial call through, which
+    closes it on success or reopens it on failure.
+    """
+    def __init__(self, failure_threshold, cooldown, on_open=None):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.on_open = on_open
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_in_flight or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None and self.on_open is not None:
+                    self.on_open(self._failures)
+                self._opened_at = time.monotonic()
+
+    def retry_after(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            return max(0.0, self.cooldown - (time.monotonic() - self._opened_at))
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if time.monotonic() - self._opened_at >= self.cooldown else "open"
+
+class LatencyWindow:
+    """Latencies of the most recent successful calls per model"""
+    def __init__(self, size):
+        self.size = size
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def observe(self, model, seconds):
+        with self._lock:
+            self._samples.setdefault(model, deque(maxlen=self.size)).append(seconds)
+
+    def percentile(self, model, fraction):
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if len(samples) < LLM_HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(fraction * len(samples)))]
+
+_hedge_executor = None
+_hedge_executor_lock = threading.Lock()
+
+def is_retryable_llm_error(error):
+    """Timeouts, connection errors, 429s and 5xx are worth another attempt"""
+    from openai import APIConnectionError, InternalServerError, RateLimitError
+    return isinstance(error, (APIConnectionError, InternalServerError, RateLimitError))
+
+def get_hedge_executor():
+    global _hedge_executor
+    with _hedge_executor_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix="llm-hedge")
+        return _hedge_executor
+
+def after_fork():
+    """Forget the parent's hedge executor; its threads do not survive a fork"""
+    global _hedge_executor, _hedge_executor_lock
+    _hedge_executor = None
+    _hedge_executor_lock = threading.Lock()
+
+class ResilientCompletions:
+    """
+    client.chat.completions.create with the resilience policy: each attempt
+    gets its own deadline (within total_deadline overall), transient errors
+    are retried with full-jitter backoff, slow attempts may be hedged, and
+    while the circuit is open calls fail at once with LLMUnavailable.
+    The policy defaults to the LLM_* environment variables.
+    """
+    def __init__(self, hooks, attempt_timeout=LLM_ATTEMPT_TIMEOUT, total_deadline=LLM_TOTAL_DEADLINE,
+                 max_attempts=LLM_MAX_ATTEMPTS, hedge=LLM_HEDGE, hedge_min_delay=LLM_HEDGE_MIN_DELAY,
+                 breaker_failures=LLM_BREAKER_FAILURES, breaker_cooldown=LLM_BREAKER_COOLDOWN):
+        self.hooks = hooks
+        self.attempt_timeout = attempt_timeout
+        self.total_deadline = total_deadline
+        self.max_attempts = max_attempts
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.breaker = CircuitBreaker(breaker_failures, breaker_cooldown,
+                                      on_open=lambda failures: hooks.llm_event("circuit_opened", failures=failures))
+        self.latencies = LatencyWindow(LLM_LATENCY_WINDOW)
+
+    def hedge_delay(self, model):
+        """Seconds to wait before sending a hedged duplicate request, or None"""
+        if self.hedge == "off":
+            return None
+        if self.hedge == "p95":
+            p95 = self.latencies.percentile(model, 0.95)
+            return max(p95, self.hedge_min_delay) if p95 is not None else None
+        return float(self.hedge)
+
+    def run_attempt(self, attempt_client, params, hedge_after):
+        """One attempt; with `hedge_after`, a duplicate is sent if the first is still running by then and the first success wins"""
+        started = time.monotonic()
+        if hedge_after is None:
+            response = attempt_client.chat.completions.create(**params)
+        else:
+            executor = get_hedge_executor()
+            pending = {executor.submit(attempt_client.chat.completions.create, **params)}
+            done, _ = wait(pending, timeout=hedge_after)
+            if not done:
+                self.hooks.llm_event("hedge")
+                pending.add(executor.submit(attempt_client.chat.completions.create, **params))
+            error = None
+            response = None
+            while pending and response is None:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        response = future.result()
+                        break
+                    error = future.exception()
+            if response is None:
+                raise error
+        self.latencies.observe(params["model"], time.monotonic() - started)
+        return response
+
+    def create(self, openai_client, hedge=True, **params):
+        if not self.breaker.allow():
+            self.hooks.llm_event("rejected")
+            raise LLMUnavailable("OpenAI circuit is open", retry_after=self.breaker.retry_after())
+        deadline = time.monotonic() + self.total_deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            timeout = min(self.attempt_timeout, deadline - time.monotonic())
+            try:
+                response = self.run_attempt(openai_client.with_options(timeout=timeout, max_retries=0), params,
+                                            self.hedge_delay(params["model"]) if hedge else None)
+            except Exception as e:
+                if not is_retryable_llm_error(e):
+                    # The upstream answered; the request itself was bad
+                    self.breaker.record_success()
+                    raise
+                delay = random.uniform(0, min(LLM_RETRY_MAX_DELAY, LLM_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+                if attempt >= self.max_attempts or time.monotonic() + delay + 1 >= deadline:
+                    self.breaker.record_failure()
+                    self.hooks.llm_event("exhausted")
+                    raise LLMUnavailable(f"OpenAI failed after {attempt} attempts: {e}") from e
+                self.hooks.llm_event("retry", attempt=attempt, error=type(e).__name__, delay_ms=round(delay * 1000))
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return response
+
+
+# ------------------------------
+# Canonical user identity: users were stored under the Firebase uid (the
+# functions backend, the webhook, the frontend), the base64 email (app.py) or
+# the raw email. userAliases/{kind}:{value} maps each of them to the one
+# canonical users/ ID. migrate_user_aliases.py merges existing duplicates.
+# ------------------------------
+USER_ALIASES_COLLECTION = "userAliases"
+USER_ALIAS_TTL_SECONDS = int(os.getenv("USER_ALIAS_TTL_SECONDS", "600"))
+
+def encode_email(email):
+    """app.py's email-based user ID"""
+    return base64.urlsafe_b64encode(email.encode()).decode()
+
+def user_alias_id(kind, value):
+    """Alias document ID; emails are case-insensitive and '/' is not allowed in IDs"""
+    value = value.strip().lower() if kind == "email" else value
+    return f"{kind}:{value}".replace("/", "%2F")
+
+def user_alias_keys(uid=None, email=None):
+    keys = []
+    if uid:
+        keys.append(user_alias_id("uid", uid))
+    if email:
+        keys += [user_alias_id("email", email), user_alias_id("encoded", encode_email(email))]
+    return keys
+
+class UserAliases:
+    """The userAliases index with a per-process TTL cache of resolved aliases"""
+    def __init__(self, hooks, ttl=USER_ALIAS_TTL_SECONDS):
+        self.hooks = hooks
+        self._cache = TTLCache(maxsize=10000, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def register(self, db, user_id, uid=None, email=None):
+        """Point every known alias of the user at `user_id`"""
+        now = datetime.now(timezone.utc).isoformat()
+        keys = user_alias_keys(uid, email)
+        batch = db.batch()
+        for key in keys:
+            batch.set(db.collection(USER_ALIASES_COLLECTION).document(key), {"userId": user_id, "updatedAt": now}, merge=True)
+        batch.commit()
+        self.hooks.firestore_write(USER_ALIASES_COLLECTION, amount=len(keys))
+        with self._lock:
+            for key in keys:
+                self._cache[key] = user_id
+
+    def resolve(self, db, uid=None, email=None):
+        """
+        Canonical users/ document ID for a user. Cached aliases cost no reads;
+        otherwise the uid and email aliases are read in one round trip (2
+        reads). A user without aliases yet is found among the legacy IDs (uid
+        first, so the webhook's document wins; up to 3 more reads) and
+        registered (3 alias writes); new users are keyed by uid. Falls back to
+        the uid when Firestore fails.
+        """
+        keys = user_alias_keys(uid, email)[:2]
+        with self._lock:
+            cached = next((self._cache[key] for key in keys if key in self._cache), None)
+        self.hooks.cache("user_alias", cached is not None)
+        if cached is not None:
+            return cached
+        fallback = uid or (encode_email(email) if email else None)
+        if db is None or not fallback:
+            return fallback
+
+        try:
+            aliases = db.get_all([db.collection(USER_ALIASES_COLLECTION).document(key) for key in keys])
+            self.hooks.firestore_read(USER_ALIASES_COLLECTION, amount=len(keys))
+            user_id = next(((alias.to_dict() or {}).get("userId") for alias in aliases if alias.exists), None)
+            if user_id is None:
+                candidates = list(dict.fromkeys(filter(None, (uid, email and encode_email(email), email))))
+                users = db.get_all([db.collection("users").document(candidate) for candidate in candidates])
+                self.hooks.firestore_read("users", amount=len(candidates))
+                existing = {snapshot.id for snapshot in users if snapshot.exists}
+                user_id = next((candidate for candidate in candidates if candidate in existing), fallback)
+                self.register(db, user_id, uid, email)
+                self.hooks.log("user_aliases_registered", user_id=user_id, uid=uid, email=email)
+                return user_id
+        except Exception as e:
+            self.hooks.log("user_alias_resolution_failed", severity="ERROR", uid=uid, error=str(e))
+            return fallback
+
+        with self._lock:
+            for key in keys:
+                self._cache[key] = user_id
+        return user_id
+
+
+# ------------------------------
+# Dictionary fast path: vocabulary lookups answered from the lesson materials without the LLM
+# ------------------------------
+HEBREW_NIQQUD = re.compile('[\u0591-\u05C7]')
+HEBREW_FINAL_LETTERS = str.maketrans("ךםןףץ", "כמנפצ")
+ARABIC_DIACRITICS = re.compile('[\u0610-\u061A\u064B-\u065F\u0670\u0640]')
+ARABIC_LETTER_VARIANTS = str.maketrans("أإآٱىةؤئ", "اااايهوي")
+LOOKUP_PUNCTUATION = re.compile(r'[?？؟!.,،:;"\'״׳“”‘’…\-]+')
+ARABIC_SCRIPT = re.compile(r'[؀-ۿ]')
+
+LOOKUP_PATTERNS = [
+    re.compile(r'^איך\s+(?:אומרים|אומר|אומרת|להגיד|לומר|כותבים)\s+(?:בערבית\s+)?(?P<term>.+?)(?:\s+בערבית)?$'),
+    re.compile(r'^מה\s+(?:זה|זאת|פירוש|הפירוש\s+של|התרגום\s+של|המשמעות\s+של)\s+(?P<term>.+?)(?:\s+בערבית|\s+בעברית)?$'),
+    re.compile(r'^(?:תרגם|תרגמי|תתרגם|תתרגמי)\s+(?:לי\s+)?(?:את\s+)?(?P<term>.+?)(?:\s+לערבית|\s+לעברית)?$'),
+    re.compile(r'^how\s+(?:do|would|can|to)\s+(?:i|you|we)?\s*say\s+(?P<term>.+?)(?:\s+in\s+arabic)?$', re.IGNORECASE),
+    re.compile(r'^what\s+(?:does|is)\s+(?P<term>.+?)(?:\s+mean|\s+in\s+arabic|\s+in\s+hebrew)?$', re.IGNORECASE),
+    re.compile(r'^translate\s+(?P<term>.+?)$', re.IGNORECASE),
+]
+
+def normalize_hebrew(text):
+    """Lookup key for Hebrew (or Latin) text: no niqqud, no final letter forms, no punctuation, lowercase"""
+    text = HEBREW_NIQQUD.sub('', text).translate(HEBREW_FINAL_LETTERS)
+    return ' '.join(LOOKUP_PUNCTUATION.sub(' ', text).split()).lower()
+
+def normalize_arabic(text):
+    """Lookup key for Arabic text: no harakat or tatweel, unified alef/ya/ta marbuta"""
+    text = ARABIC_DIACRITICS.sub('', text).translate(ARABIC_LETTER_VARIANTS)
+    return ' '.join(LOOKUP_PUNCTUATION.sub(' ', text).split())
+
+class MaterialsIndex:
+    """Bidirectional Hebrew <-> Arabic index over one lesson's materials"""
+    def __init__(self, materials):
+        self.by_hebrew = {}
+        self.by_arabic = {}
+        for mat in materials:
+            hebrew = mat.get('hebrew_input', '')
+            # "מה שלומך (זכר)" is also found as "מה שלומך"; "בבקשה (על לא דבר / אתה מוזמן)" under each alternative
+            base, _, note = hebrew.partition('(')
+            hebrew_keys = {normalize_hebrew(hebrew), normalize_hebrew(base)}
+            hebrew_keys.update(normalize_hebrew(alt) for alt in note.rstrip(')').split('/'))
+            hebrew_keys.add(normalize_hebrew(mat.get('pronunciation', '')))
+            for key in hebrew_keys:
+                if key:
+                    self.by_hebrew.setdefault(key, []).append(mat)
+            arabic_key = normalize_arabic(mat.get('arabic_response', ''))
+            if arabic_key:
+                self.by_arabic.setdefault(arabic_key, []).append(mat)
+
+    def lookup(self, term):
+        """Materials matching a term exactly (after normalisation), and the direction of the match"""
+        if ARABIC_SCRIPT.search(term):
+            return self.by_arabic.get(normalize_arabic(term), []), 'arabic'
+        return self.by_hebrew.get(normalize_hebrew(term), []), 'hebrew'
+
+    def find_mentions(self, text):
+        """Materials whose Hebrew or Arabic form appears anywhere in free text, longest first"""
+        hebrew_text = f" {normalize_hebrew(text)} "
+        arabic_text = f" {normalize_arabic(text)} "
+        found = []
+        for key in sorted(self.by_hebrew, key=len, reverse=True):
+            if f" {key} " in hebrew_text:
+                found.extend(m for m in self.by_hebrew[key] if m not in found)
+        for key in sorted(self.by_arabic, key=len, reverse=True):
+            if f" {key} " in arabic_text:
+                found.extend(m for m in self.by_arabic[key] if m not in found)
+        return found
+
+def extract_lookup_term(question):
+    """The term of a "how do I say X" / "what is X" question, or None for anything else"""
+    text = ' '.join(question.strip().rstrip('?？؟!. ').split())
+    for pattern in LOOKUP_PATTERNS:
+        match = pattern.match(text)
+        if match:
+            term = LOOKUP_PUNCTUATION.sub(' ', match.group('term')).strip()
+            if term and len(term.split()) <= 6:
+                return term
+    return None
+
+def format_dictionary_answer(matches, direction, language):
+    """Templated answer for dictionary matches in the student's preferred language mode"""
+    lines = []
+    if direction == 'arabic':
+        for mat in matches:
+            if language == "arabic":
+                lines.append(f"{mat['arabic_response']} = {mat['hebrew_input']}")
+            else:
+                lines.append(f"{mat['arabic_response']} ({mat['pronunciation']}) פירושו: {mat['hebrew_input']}")
+        return "\n".join(lines)
+
+    terms = {mat['hebrew_input'].partition('(')[0].strip() for mat in matches}
+    if len(matches) == 1:
+        heading = f"איך אומרים \"{matches[0]['hebrew_input']}\" בערבית מדוברת:"
+    elif len(terms) == 1:
+        heading = f"איך אומרים \"{terms.pop()}\" בערבית מדוברת:"
+    else:
+        heading = "מתוך החומרים של השיעור:"
+    for mat in matches:
+        note = f" - {mat['hebrew_input']}" if len(matches) > 1 else ""
+        if language == "arabic":
+            lines.append(f"• {mat['arabic_response']}{note}")
+        elif language == "transliteration-hebrew":
+            lines.append(f"• {mat['pronunciation']}{note}")
+        else:
+            lines.append(f"• {mat['arabic_response']} ({mat['pronunciation']}){note}")
+    return heading + "\n" + "\n".join(lines)
+
+def answer_from_dictionary(question, materials, language, fallback=False):
+    """
+    Answer a vocabulary lookup from the lesson materials, or return None.
+    Materials loaded by a MaterialsStore bring their prebuilt lookup_index.
+    With fallback=True (the LLM is unavailable) any material mentioned in the
+    question is used, not only explicit lookup questions.
+    """
+    if not materials:
+        return None
+    index = getattr(materials, "lookup_index", None) or MaterialsIndex(materials)
+    term = extract_lookup_term(question)
+    if term:
+        matches, direction = index.lookup(term)
+        if matches:
+            return format_dictionary_answer(matches, direction, language)
+    if fallback:
+        matches = index.find_mentions(question)
+        if matches:
+            direction = 'arabic' if ARABIC_SCRIPT.search(question) else 'hebrew'
+            return format_dictionary_answer(matches[:5], direction, language)
+    return None
+
+
+# ------------------------------
+# Lesson materials: lessons are kept in memory and reloaded only when the
+# version document (bumped by seed_data.py and the upload page) changes.
+# A published lesson is one read of its bundle; anything else is queried.
+# ------------------------------
+MATERIALS_META_COLLECTION = "materialsMeta"
+MATERIALS_META_DOC = "current"
+MATERIAL_BUNDLES_COLLECTION = "materialBundles"
+MATERIALS_POLL_SECONDS = float(os.getenv("MATERIALS_POLL_SECONDS", "30"))
+
+class LessonMaterials(list):
+    """One lesson's materials, tagged with the bundle hash they were loaded from"""
+    def __init__(self, items=(), lesson_key=None, content_hash=None):
+        super().__init__(items)
+        self.lesson_key = lesson_key
+        self.content_hash = content_hash
+        self._lookup_index = None
+
+    @property
+    def lookup_index(self):
+        """MaterialsIndex for the dictionary fast path, built once per lesson version"""
+        if self._lookup_index is None:
+            self._lookup_index = MaterialsIndex(self)
+        return self._lookup_index
+
+def load_lesson_materials(client, hooks, lesson_key, content_hash=None):
+    """Fetch a lesson from its published bundle (one read), or query the materials collection"""
+    if content_hash:
+        snapshot = client.collection(MATERIAL_BUNDLES_COLLECTION).document(lesson_key).get()
+        hooks.firestore_read(MATERIAL_BUNDLES_COLLECTION)
+        if snapshot.exists:
+            bundle = snapshot.to_dict()
+            return LessonMaterials(bundle.get("items") or [], lesson_key, bundle.get("contentHash"))
+
+    # Query for documents where the ID starts with the lesson key
+    docs = client.collection("materials") \
+        .where(filter=FieldFilter("id", ">=", lesson_key)) \
+        .where(filter=FieldFilter("id", "<", lesson_key + "_z")) \
+        .stream()
+    materials = [doc.to_dict() for doc in docs]
+    hooks.firestore_read("materials", amount=max(len(materials), 1))
+    return LessonMaterials(materials, lesson_key)
+
+class MaterialsStore:
+    """
+    In-memory lessons invalidated by materialsMeta/current. A version change
+    swaps in a new lessons dict keeping only lessons whose hash is unchanged,
+    so readers never see a partially updated cache. `mode` is "listen" (watch
+    the version document), "poll" (re-read it at most every poll_seconds) or
+    "off" (query the materials collection on every request).
+    """
+    def __init__(self, hooks, mode="listen", poll_seconds=MATERIALS_POLL_SECONDS):
+        self.hooks = hooks
+        self.mode = mode
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._version = None
+        self._hashes = {}
+        self._lessons = {}
+        self._watch = None
+        self._checked_at = None
+        self._seeded = False
+
+    @property
+    def version(self):
+        return self._version
+
+    def apply_meta(self, meta):
+        """Adopt a version document snapshot (None when nothing has been published)"""
+        meta = meta or {}
+        version = meta.get("version")
+        hashes = dict(meta.get("lessons") or {})
+        with self._lock:
+            if version == self._version and hashes == self._hashes:
+                return
+            self._lessons = {
+                key: lesson for key, lesson in self._lessons.items()
+                if lesson.content_hash is not None and hashes.get(key) == lesson.content_hash
+            }
+            self._hashes = hashes
+            self._version = version
+        self.hooks.log("materials_version", version=version, lessons=len(hashes))
+
+    def _on_snapshot(self, snapshots, changes, read_time):
+        for snapshot in snapshots:
+            self.apply_meta(snapshot.to_dict() if snapshot.exists else None)
+
+    def _refresh_due(self):
+        if self._watch is not None:
+            if self._watch.is_active:
+                return False
+            # The watch stream closed on a non-retryable error; poll from now on
+            self.hooks.log("materials_watch_closed", severity="WARNING")
+            self._watch = None
+            self.mode = "poll"
+        if self.mode == "off":
+            return False
+        if self.mode == "poll" and self._checked_at is not None:
+            return time.monotonic() - self._checked_at >= self.poll_seconds
+        return True
+
+    def refresh(self, client):
+        """Read the version document once, then keep it current by watching or polling"""
+        if not self._refresh_due():
+            return
+        with self._refresh_lock:
+            if not self._refresh_due():
+                return
+            self._read_meta(client)
+
+    def _read_meta(self, client):
+        meta_ref = client.collection(MATERIALS_META_COLLECTION).document(MATERIALS_META_DOC)
+        snapshot = meta_ref.get()
+        self.hooks.firestore_read(MATERIALS_META_COLLECTION)
+        self.apply_meta(snapshot.to_dict() if snapshot.exists else None)
+        self._checked_at = time.monotonic()
+        if self.mode == "listen" and self._watch is None:
+            try:
+                self._watch = meta_ref.on_snapshot(self._on_snapshot)
+            except Exception as e:
+                self.hooks.log("materials_watch_failed", severity="WARNING", error=str(e))
+                self.mode = "poll"
+
+    def seed(self, meta, client):
+        """
+        Start a cold instance from a known version (the deploy-time snapshot)
+        instead of blocking on Firestore; the version document is then read
+        in the background, dropping any lesson whose hash has moved on.
+        """
+        with self._refresh_lock:
+            if self._seeded:
+                return
+            self._seeded = True
+            if not meta or self._checked_at is not None or self.mode == "off":
+                return
+            self.apply_meta(meta)
+            self._checked_at = time.monotonic()
+        threading.Thread(target=self._confirm_seed, args=(client,), daemon=True).start()
+
+    def _confirm_seed(self, client):
+        try:
+            with self._refresh_lock:
+                self._read_meta(client)
+        except Exception as e:
+            self.hooks.log("materials_check_failed", severity="WARNING", error=str(e))
+
+    def after_fork(self):
+        """Forget the parent's watch (its thread does not survive a fork); loaded lessons are kept"""
+        with self._lock:
+            self._watch = None
+            self._checked_at = None
+
+    def get(self, client, lesson_key, load_lesson=None):
+        """
+        A lesson's materials from memory; on a miss load_lesson(lesson_key,
+        content_hash), by default load_lesson_materials
+        """
+        self.refresh(client)
+        lesson = self._lessons.get(lesson_key)
+        self.hooks.cache("materials", lesson is not None)
+        if lesson is not None:
+            return lesson
+        version = self._version
+        content_hash = self._hashes.get(lesson_key)
+        if load_lesson is None:
+            lesson = load_lesson_materials(client, self.hooks, lesson_key, content_hash)
+        else:
+            lesson = load_lesson(lesson_key, content_hash)
+        # Only published lessons are cached; anything else has no change signal
+        if self.mode != "off" and lesson.content_hash is not None:
+            with self._lock:
+                if self._version == version:
+                    self._lessons = {**self._lessons, lesson_key: lesson}
+        return lesson
+
+
+# ------------------------------
+# Teaching prompt: the compact materials block (a header line, then one
+# tab-separated row per material) is rendered once per lesson version.
+# ------------------------------
+MATERIAL_COLUMNS = (
+    ("hebrew", "hebrew_input"),
+    ("arabic", "arabic_response"),
+    ("pronunciation", "pronunciation"),
+)
+MATERIALS_PROMPT_HEADER = (
+    "\nYOU MUST EXCLUSIVELY USE THESE MATERIALS AS YOUR SOURCE "
+    "(tab-separated: Hebrew, Levantine Arabic, Hebrew transliteration):\n"
+)
+MATERIALS_BLOCK_TTL_SECONDS = int(os.getenv("MATERIALS_BLOCK_TTL_SECONDS", "600"))
+_materials_block_cache = TTLCache(maxsize=256, ttl=MATERIALS_BLOCK_TTL_SECONDS)
+_materials_block_lock = threading.Lock()
+LANGUAGE_GUIDANCE = {
+    "arabic": "\nRespond primarily in Arabic script with minimal explanations in Hebrew.\n",
+    "transliteration-hebrew": "\nProvide Arabic responses in Hebrew characters, plus short Hebrew explanations.\n",
+    "transliteration-english": "\nProvide Arabic responses with English transliteration, plus Hebrew explanations.\n",
+}
+DEFAULT_LANGUAGE_GUIDANCE = "\nProvide main responses in Hebrew, with Arabic phrases in both script and Hebrew transliteration.\n"
+
+def material_cell(value):
+    """Single-line cell text; tabs, newlines and repeated spaces collapse to one space"""
+    return " ".join(str(value or "").split())
+
+def render_materials_block(materials):
+    """Header plus one TSV row per material; keys, quotes and IDs are left out"""
+    lines = ["\t".join(name for name, _ in MATERIAL_COLUMNS)]
+    for mat in materials:
+        lines.append("\t".join(material_cell(mat.get(field)) for _, field in MATERIAL_COLUMNS))
+    return "\n".join(lines) + "\n"
+
+def get_materials_block(level, week, materials):
+    """Rendered materials block for a lesson, cached per lesson version (or set of material IDs)"""
+    content_hash = getattr(materials, 'content_hash', None)
+    key = (level, week, content_hash or tuple(mat.get('id') for mat in materials))
+    with _materials_block_lock:
+        block = _materials_block_cache.get(key)
+    if block is None:
+        block = render_materials_block(materials)
+        with _materials_block_lock:
+            _materials_block_cache[key] = block
+    return block
+
+def create_arabic_teaching_prompt(level, week, question, gender, language, materials, conversation_history=None, summary=None):
+    """
+    Dynamically generates an Arabic teaching prompt to feed into OpenAI
+    for specialized Levantine dialect tutoring. Includes context from
+    conversation history (a rolling summary plus the latest messages)
+    and user-provided learning materials.
+    """
+    base_prompt = f"""
+    You are 'Laith', an expert Levantine Arabic dialect tutor. Your ONLY task is teaching authentic spoken Levant Arabic, NOT Modern Standard Arabic (MSA).
+
+    STRICT RULES:
+    1. ONLY use information from the provided reference materials. Do not introduce vocabulary, phrases or concepts not included in these materials.
+    2. NEVER use MSA (فصحى) forms - use EXCLUSIVELY Levantine dialect (لهجة شامية) as spoken in daily conversation.
+    3. IGNORE any questions unrelated to Levantine Arabic learning.
+
+    Student profile:
+    - Level: {level}
+    - Week: {week}
+    - Gender: {gender}
+    - Language: {language}
+
+    TEACHING APPROACH:
+    - AUTHENTICITY: Teach how natives actually speak, not textbook forms
+    - PERSONALIZATION: For beginners (level {level}, week {week}), use more {language}. For advanced, use more Arabic
+    - EXAMPLES: Every vocabulary item must include realistic usage examples
+    - PRONUNCIATION: Include Hebrew transliteration (תעתיק עברי) for all Arabic words
+    - GENDER: Use appropriate forms for {gender} students
+    - DIALOGUES: Create practice conversations using ONLY vocabulary from materials
+    """
+    materials_prompt = MATERIALS_PROMPT_HEADER + get_materials_block(level, week, materials)
+
+    final_warning = "\nIMPORTANT: If asked about anything not covered in these materials, redirect to content you CAN teach from the materials. ALWAYS use Levantine dialect exclusively.\n"
+
+    # Adjust language usage
+    language_guidance = LANGUAGE_GUIDANCE.get(language, DEFAULT_LANGUAGE_GUIDANCE)
+
+    complete_prompt = base_prompt + materials_prompt + final_warning + language_guidance
+
+    if summary:
+        complete_prompt += f"\nSUMMARY OF THE EARLIER CONVERSATION:\n{summary}\n"
+
+    if conversation_history and len(conversation_history) > 0:
+        recent_messages = conversation_history[-RECENT_HISTORY_MESSAGES:]
+        history_prompt = "\nPREVIOUS CONVERSATION CONTEXT:\n"
+        for msg in recent_messages:
+            role = "Student" if msg.get("isUser", msg.get("sender") == "user") else "You (Laith)"
+            content = msg.get("text", msg.get("content", ""))
+            history_prompt += f"{role}: {content}\n"
+        complete_prompt += history_prompt
+
+    return complete_prompt
+
+
+# ------------------------------
+# Rolling session summaries: the prompt carries a summary of the older turns
+# plus the last RECENT_HISTORY_MESSAGES raw messages, so its size stays bounded
+# however long the session gets. The summary is refreshed (by app.py or the
+# summarize_chat_session function) once SUMMARY_INTERVAL_MESSAGES more
+# messages have left the raw window.
+# ------------------------------
+RECENT_HISTORY_MESSAGES = 5
+SUMMARY_INTERVAL_MESSAGES = int(os.getenv("SUMMARY_INTERVAL_MESSAGES", "10"))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "gpt-4o-mini")
+SUMMARY_MAX_TOKENS = 300
+SUMMARY_MESSAGE_MAX_CHARS = 1500
+SUMMARY_INSTRUCTIONS = """You maintain a running summary of a Levantine Arabic tutoring conversation between a student and their tutor, Laith.
+Update the current summary with the new messages. Keep: the student's goals and difficulties, vocabulary and phrases already taught (in Arabic script), mistakes to revisit and any preferences the student stated.
+Drop greetings and small talk. Write at most 150 words, in the language the student writes in."""
+
+def summary_target(chat_session):
+    """Number of leading messages the summary should cover now, or None while it is recent enough"""
+    target = len(chat_session.get("messages") or []) - RECENT_HISTORY_MESSAGES
+    if target - chat_session.get("summaryThrough", 0) >= SUMMARY_INTERVAL_MESSAGES:
+        return target
+    return None
+
+def build_summary_request(previous_summary, messages):
+    """Chat messages asking the model to fold `messages` into `previous_summary`"""
+    transcript = ""
+    for msg in messages:
+        role = "Student" if msg.get("isUser", msg.get("sender") == "user") else "Laith"
+        transcript += f"{role}: {msg.get('text', msg.get('content', ''))[:SUMMARY_MESSAGE_MAX_CHARS]}\n"
+    return [
+        {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+        {"role": "user", "content": f"CURRENT SUMMARY:\n{previous_summary or '(none yet)'}\n\nNEW MESSAGES:\n{transcript}"}
+    ]
+
+
+# ------------------------------
+# Pre-generated lesson content (pregenerate_lesson_content.py): a plain request
+# for a practice dialogue, drill or quiz on the current lesson is answered from
+# lessonContent while its contentHash matches the published lesson bundle
+# ------------------------------
+LESSON_CONTENT_COLLECTION = "lessonContent"
+LESSON_CONTENT_LANGUAGES = ("arabic", "transliteration-hebrew", "transliteration-english")
+LESSON_CONTENT_REQUEST_PREFIX = (
+    r'^(?:(?:בבקשה|אפשר|אפשר\s+לקבל|אני\s+רוצה|בואי?\s+נעשה|תן|תני|תנו|תביא|תביאי|תכין|תכיני|תכתוב|תכתבי|כתוב|כתבי|צור|'
+    r'please|can\s+you|could\s+you|i\s+want|i\s+would\s+like|let\'?s\s+do|give|make|write|create)\s+)*'
+    r'(?:לי\s+|לנו\s+|me\s+|us\s+)?(?:את\s+|a\s+|an\s+|another\s+|some\s+)?(?:(?:short|new|quick|practice)\s+)*'
+)
+LESSON_CONTENT_REQUEST_SUFFIX = (
+    r'(?:\s+(?:קצר|קצרה|חדש|חדשה|נוסף|נוספת|לתרגול))*'
+    r'(?:\s+(?:על|של|בנושא|from|for|on|about|of)?\s*(?:מ|מה)?(?:ה?שיעור|ה?חומר|ה?שבוע|ה?מילים(?:\s+של\s+ה?שבוע)?|'
+    r'(?:this|the|today\'?s)\s+(?:lesson|week|material)))?[\s?.!؟]*$'
+)
+LESSON_CONTENT_REQUESTS = {
+    kind: re.compile(LESSON_CONTENT_REQUEST_PREFIX + noun + LESSON_CONTENT_REQUEST_SUFFIX, re.IGNORECASE)
+    for kind, noun in {
+        "dialogue": r'(?:דיאלוג|שיחה|שיחת\s+תרגול|dialogue|dialog|conversation)',
+        "drill": r'(?:תרגיל|תרגול|תרגיל\s+מילים|תרגול\s+אוצר\s+מילים|drill|exercise|vocabulary\s+(?:drill|exercise|practice))',
+        "quiz": r'(?:חידון|בוחן|מבחן|quiz|test)',
+    }.items()
+}
+LESSON_CONTENT_TTL_SECONDS = int(os.getenv("LESSON_CONTENT_TTL_SECONDS", "600"))
+
+def match_lesson_content_request(question):
+    """'dialogue', 'drill' or 'quiz' for a plain request for one, else None"""
+    text = question.strip()
+    for kind, pattern in LESSON_CONTENT_REQUESTS.items():
+        if pattern.match(text):
+            return kind
+    return None
+
+class LessonContents:
+    """lessonContent documents with a per-process TTL cache keyed by the lesson's content hash"""
+    def __init__(self, hooks, ttl=LESSON_CONTENT_TTL_SECONDS):
+        self.hooks = hooks
+        self._cache = TTLCache(maxsize=1024, ttl=ttl)
+        self._lock = threading.Lock()
+
+    def load(self, client, lesson_key, gender, language, content_hash):
+        """Stored contents for the lesson variant, or None when missing or generated from other materials"""
+        language = language.lower() if language and language.lower() in LESSON_CONTENT_LANGUAGES else "hebrew"
+        doc_id = f"{lesson_key}_{gender}_{language}"
+        key = (doc_id, content_hash)
+        with self._lock:
+            cached = self._cache.get(key, False)
+        self.hooks.cache("lesson_content", cached is not False)
+        if cached is not False:
+            return cached
+        try:
+            doc = client.collection(LESSON_CONTENT_COLLECTION).document(doc_id).get()
+            self.hooks.firestore_read(LESSON_CONTENT_COLLECTION)
+        except Exception as e:
+            self.hooks.log("lesson_content_read_failed", severity="ERROR", doc_id=doc_id, error=str(e))
+            return None
+        data = doc.to_dict() if doc.exists else None
+        contents = data.get("contents") if data and data.get("contentHash") == content_hash else None
+        with self._lock:
+            self._cache[key] = contents
+        return contents
+
+    def answer(self, client, question, materials, gender, language):
+        """A pre-generated dialogue, drill or quiz for a plain request for one, or None"""
+        kind = match_lesson_content_request(question)
+        if client is None or kind is None or not isinstance(materials, LessonMaterials) or not materials.content_hash:
+            return None
+        contents = self.load(client, materials.lesson_key, gender, language, materials.content_hash)
+        variants = (contents or {}).get(kind)
+        return random.choice(variants) if variants else None
+
+
+# ------------------------------
+# Free-plan quota: one small counter document per user and month,
+# users/{userId}/monthlyUsage/{YYYY-MM} (UTC), removed by a Firestore TTL policy
+# on expiresAt. Months missing a document fall back to the legacy totalMessages
+# map on the user document until migrate_monthly_usage.py has folded it in.
+# ------------------------------
+MONTHLY_USAGE_COLLECTION = "monthlyUsage"
+MONTHLY_USAGE_RETENTION = timedelta(days=int(os.getenv("MONTHLY_USAGE_RETENTION_DAYS", "400")))
+MAX_MONTHLY_MESSAGES = 50
+
+def usage_month(moment=None):
+    """Canonical month key, e.g. 2025-06"""
+    return (moment or datetime.now(timezone.utc)).strftime("%Y-%m")
+
+def legacy_message_count(user_data, month):
+    """Messages counted for `month` in the legacy totalMessages map, under either backend's old key"""
+    year, month_number = int(month[:4]), int(month[5:])
+    legacy = user_data.get("totalMessages") or {}
+    return sum(int(legacy.get(key) or 0) for key in (f"{month_number:02d}_{year % 100:02d}", f"{year}-{month_number}"))
+
+
+# ------------------------------
+# Premium entitlement: the payment webhook sets users.isPremium and
+# subscriptionEndDate, and the scheduled sweeper (expire_subscriptions in
+# functions/main.py, or expire_subscriptions.py) clears isPremium once the end
+# date passes. Requests only read the flag; until the sweeper catches up, the
+# end date alone decides.
+# ------------------------------
+ACTIVE_SUBSCRIPTION_STATUSES = ["active", "trial"]
+
+def subscription_end(value):
+    """Aware datetime from a stored end date (a Firestore timestamp or a legacy ISO string), or None"""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def has_premium_entitlement(user_data, now=None):
+    """isPremium until subscriptionEndDate; the sweeper clears the flag in bulk, this covers the gap"""
+    end_date = subscription_end(user_data.get("subscriptionEndDate")) if user_data.get("subscriptionEndDate") else None
+    return bool(user_data.get("isPremium")) and (end_date is None or end_date > (now or datetime.now(timezone.utc)))
+
+
+# ------------------------------
+# Model routing: each question is classified by how much answer it needs and
+# sent to that route's model with its token cap. MODEL_ROUTES (JSON, e.g.
+# '{"short": {"model": "gpt-4o-mini", "max_tokens": 200}}') overrides entries.
+# ------------------------------
+DEFAULT_MODEL_ROUTES = {
+    "short": {"model": "gpt-4o-mini", "max_tokens": 300},
+    "standard": {"model": "gpt-4-turbo", "max_tokens": 700},
+    "extended": {"model": "gpt-4-turbo", "max_tokens": 1500},
+}
+SHORT_QUESTION_MAX_WORDS = 4
+EXTENDED_QUESTION_MIN_CHARS = 240
+SMALL_TALK = re.compile(
+    r'^(?:תודה(?:\s+רבה)?|סבבה|אוקיי?|בסדר|מעולה|יופי|הבנתי|שלום|היי|ביי|להתראות|'
+    r'thanks?(?:\s+you)?|thx|ok(?:ay)?|cool|great|got\s+it|hi|hello|hey|bye|'
+    r'شكرا|شكراً|مرحبا|تمام|يعطيك\s+العافية)[\s!.?؟]*$',
+    re.IGNORECASE
+)
+EXTENDED_REQUEST = re.compile(
+    r'דיאלוג|שיחה|תרגיל|תרגול|סיפור|מבחן|בוחן|חידון|פסקה|בפירוט|מפורט|רשימה|כל\s+המילים|'
+    r'dialog|conversation|exercise|practice|story|quiz|test\s+me|paragraph|in\s+detail|list\s+(?:all|of)',
+    re.IGNORECASE
+)
+
+def load_model_routes(hooks):
+    """DEFAULT_MODEL_ROUTES with the MODEL_ROUTES environment overrides applied"""
+    routes = {name: dict(route) for name, route in DEFAULT_MODEL_ROUTES.items()}
+    try:
+        overrides = json.loads(os.getenv("MODEL_ROUTES") or "{}")
+        for name, route in overrides.items():
+            if name not in routes:
+                raise ValueError(f"unknown route {name!r}")
+            routes[name].update({key: route[key] for key in ("model", "max_tokens") if key in route})
+            routes[name]["max_tokens"] = int(routes[name]["max_tokens"])
+    except (ValueError, TypeError, AttributeError) as e:
+        hooks.log("model_routes_invalid", severity="WARNING", error=str(e))
+        routes = {name: dict(route) for name, route in DEFAULT_MODEL_ROUTES.items()}
+    return routes
+
+def classify_question(question):
+    """Route name for a question: short (small talk, a few words), extended (dialogues, exercises, long asks) or standard"""
+    text = question.strip()
+    if SMALL_TALK.match(text):
+        return "short"
+    if len(text) >= EXTENDED_QUESTION_MIN_CHARS or EXTENDED_REQUEST.search(text):
+        return "extended"
+    if len(text.split()) <= SHORT_QUESTION_MAX_WORDS:
+        return "short"
+    return "standard"
+
+
+# ------------------------------
+# Conditional GETs: every write to a chat session bumps its `revision`, and the
+# materials carry the published version, so clients revalidate with
+# If-None-Match and an unchanged resource comes back as a bodiless 304.
+# Listings are filtered and paged on a projection of the session fields; only
+# the sessions on a changed page are read in full.
+# ------------------------------
+CHAT_LISTING_FIELDS = ["_id", "userId", "userEmail", "userName", "createdAt", "updatedAt", "revision"]
+CHAT_VERSION_FIELDS = ["revision", "updatedAt"]
+
+def version_etag(*parts):
+    """Validator for a resource identified by its version fields"""
+    return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()[:20]
+
+def session_version(session_id, data):
+    return [session_id, data.get("revision", 0), data.get("updatedAt")]
+
+
+# ------------------------------
+# Chat log export: sessions are read a page at a time in document ID order and
+# streamed out as NDJSON or CSV, so memory stays flat however large the collection.
+# The last row of each session carries a cursor; pass it back to resume after it.
+# ------------------------------
+EXPORT_CONTENT_TYPES = {
+    "ndjson": "application/x-ndjson; charset=utf-8",
+    "csv": "text/csv; charset=utf-8",
+}
+EXPORT_FIELDS = {
+    "sessions": ["sessionId", "userId", "userEmail", "userName", "level", "week", "language", "gender",
+                 "createdAt", "updatedAt", "messageCount", "cursor"],
+    "messages": ["sessionId", "userId", "userEmail", "level", "week", "language",
+                 "messageId", "sender", "source", "timestamp", "text", "cursor"],
+}
+EXPORT_FILTER_FIELDS = ("userId", "userEmail", "level", "week")
+
+def encode_export_cursor(session_id):
+    return base64.urlsafe_b64encode(session_id.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_export_cursor(cursor):
+    """Session ID a cursor points after; ValueError if it is malformed"""
+    try:
+        session_id = base64.b64decode(cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True).decode("utf-8")
+    except Exception:
+        session_id = None
+    if not session_id:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return session_id
+
+def parse_export_date(value):
+    """Aware datetime from an ISO date or timestamp (naive values are UTC), or None"""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def in_export_range(timestamp, date_from, date_to):
+    if date_from is None and date_to is None:
+        return True
+    try:
+        moment = parse_export_date(timestamp)
+    except (TypeError, ValueError):
+        return False
+    return moment is not None and (date_from is None or moment >= date_from) and (date_to is None or moment <= date_to)
+
+def export_session_rows(kind, session_id, session, date_from, date_to):
+    """Rows for one session (empty if nothing is in the date range); the last one carries the cursor"""
+    common = {
+        "sessionId": session_id,
+        "userId": session.get("userId"),
+        "userEmail": session.get("userEmail"),
+        "level": session.get("level"),
+        "week": session.get("week"),
+        "language": session.get("language"),
+    }
+    messages = session.get("messages") or []
+    if kind == "sessions":
+        if date_from is not None or date_to is not None:
+            if not any(in_export_range(m.get("timestamp"), date_from, date_to) for m in messages):
+                return []
+        rows = [dict(common, userName=session.get("userName"), gender=session.get("gender"),
+                     createdAt=session.get("createdAt"), updatedAt=session.get("updatedAt"),
+                     messageCount=len(messages))]
+    else:
+        rows = [
+            dict(common, messageId=m.get("id"), sender=m.get("sender"), source=m.get("source"),
+                 timestamp=m.get("timestamp"), text=m.get("text"))
+            for m in messages if in_export_range(m.get("timestamp"), date_from, date_to)
+        ]
+    if rows:
+        rows[-1]["cursor"] = encode_export_cursor(session_id)
+    return rows
+
+
+# ------------------------------
+# Usage rollups: per-day and per-month counters updated with every answered
+# question, so dashboards read a few small documents instead of every chat log.
+# Each period is spread over USAGE_SHARDS documents (one picked at random per
+# write) to stay under Firestore's sustained write rate for a single document;
+# backfill_usage_stats.py adds one more per period for history before liveSince.
+# liveSince is the start of the first process that maintained rollups. While a
+# rollout replaces older instances, those keep answering without rollups, and
+# the backfill stops at liveSince, so those messages are counted nowhere.
+# ------------------------------
+USAGE_COLLECTION = "usageStats"
+USAGE_META_DOC = "meta"
+USAGE_SHARDS = int(os.getenv("USAGE_SHARDS", "10"))
+USAGE_GRANULARITIES = {"day": "%Y-%m-%d", "month": "%Y-%m"}
+USAGE_MAX_PERIODS = {"day": 366, "month": 36}
+USAGE_COUNTER_FIELDS = ("messages", "questions", "sources", "lessons", "plans", "tokens")
+
+def usage_key(value):
+    """Map key safe for a Firestore field name"""
+    return re.sub(r'[^A-Za-z0-9_-]', '_', str(value)) if value else "unknown"
+
+def add_usage_counters(total, counters):
+    """Sum counter fields (numbers and maps of numbers) into `total`"""
+    for field, value in counters.items():
+        if isinstance(value, dict):
+            add_usage_counters(total.setdefault(field, {}), value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            total[field] = total.get(field, 0) + value
+    return total
+
+def parse_usage_date(value):
+    """Date from YYYY-MM-DD, or YYYY-MM for the first of the month"""
+    return datetime.fromisoformat(value + "-01" if len(value) == 7 else value).date()
+
+def usage_periods(granularity, start, end):
+    """Period labels from start to end inclusive"""
+    periods, current = [], start
+    while current <= end:
+        periods.append(current.strftime(USAGE_GRANULARITIES[granularity]))
+        if granularity == "day":
+            current += timedelta(days=1)
+        else:
+            current = (current.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return periods
+
+# Messages from this process onwards are counted live; the backfill covers what came before
+USAGE_LIVE_SINCE = datetime.now(timezone.utc).isoformat()
+_usage_live_marked = False
+
+def mark_usage_live(client, hooks):
+    """Record (once per process) the earliest time from which rollups are maintained live"""
+    global _usage_live_marked
+    if _usage_live_marked:
+        return
+    meta_ref = client.collection(USAGE_COLLECTION).document(USAGE_META_DOC)
+    meta = meta_ref.get()
+    hooks.firestore_read(USAGE_COLLECTION)
+    live_since = (meta.to_dict() or {}).get("liveSince") if meta.exists else None
+    if live_since is None or live_since > USAGE_LIVE_SINCE:
+        meta_ref.set({"liveSince": USAGE_LIVE_SINCE}, merge=True)
+        hooks.firestore_write(USAGE_COLLECTION)
+    _usage_live_marked = True
@@ -1,23 +1,58 @@
 # pylint: disable=line-too-long
-from firebase_functions import https_fn
-from firebase_admin import initialize_app, auth, firestore
+from firebase_functions import https_fn, firestore_fn, scheduler_fn
+from firebase_admin import initialize_app, firestore
 import json
 from firebase_functions import logger
 from datetime import datetime, timezone, timedelta
 from firebase_functions import logger, options
 from firebase_functions.params import SecretParam
 import uuid
-from openai import OpenAI
 from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from cachetools import TTLCache
+import hashlib
+import threading
+import contextvars
+import random
+import time
+import mmap
+import struct
+import gzip
+import csv
+import io
+from contextlib import contextmanager
 import os
 import traceback
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+from chat_core import (
+    BackendHooks, LLMUnavailable, LLM_RETRY_MAX_DELAY, ResilientCompletions, UserAliases,
+    answer_from_dictionary, load_model_routes, classify_question, CHAT_LISTING_FIELDS, CHAT_VERSION_FIELDS,
+    version_etag, session_version,
+    EXPORT_CONTENT_TYPES, EXPORT_FIELDS, EXPORT_FILTER_FIELDS, decode_export_cursor, parse_export_date,
+    export_session_rows, USAGE_COLLECTION, USAGE_SHARDS, USAGE_GRANULARITIES, USAGE_MAX_PERIODS,
+    USAGE_COUNTER_FIELDS, usage_key, add_usage_counters, parse_usage_date, usage_periods, mark_usage_live,
+    MATERIALS_META_COLLECTION, MATERIALS_META_DOC, LessonMaterials, MaterialsStore, load_lesson_materials,
+    LessonContents, get_materials_block, create_arabic_teaching_prompt, SUMMARY_MODEL, SUMMARY_MAX_TOKENS, summary_target, build_summary_request,
+    MONTHLY_USAGE_COLLECTION, MONTHLY_USAGE_RETENTION, MAX_MONTHLY_MESSAGES, usage_month, legacy_message_count,
+    ACTIVE_SUBSCRIPTION_STATUSES, subscription_end, has_premium_entitlement,
+)
+
 # Get the PORT environment variable, default to 8080
 PORT = int(os.environ.get('PORT', 8080))
 
 OPENAI_API_KEY = SecretParam("OPENAI_API_KEY")
 CORS_ORIGINS = ["https://chat\.blendarabic\.com", "http://localhost:8050"]
-MAX_MONTHLY_MESSAGES = 50
 
 DEFAULT_WEEK = "01"
 DEFAULT_LEVEL = "beginner"
@@ -31,11 +66,40 @@ HTTP_STATUS = {
     "UNAUTHORIZED": 401,
     "FORBIDDEN": 403,
     "NOT_FOUND": 404,
-    "SERVER_ERROR": 500
+    "CONFLICT": 409,
+    "SERVER_ERROR": 500,
+    "SERVICE_UNAVAILABLE": 503
+}
+
+# Idempotency for /ask retries
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+IDEMPOTENT_REPLAY_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_COLLECTION = "askIdempotency"
+IDEMPOTENCY_TTL = timedelta(hours=24)
+IDEMPOTENCY_PENDING_TIMEOUT = timedelta(minutes=2)
+
+# Structured logging
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FIELD_MAX_CHARS = int(os.environ.get('LOG_FIELD_MAX_CHARS', 256))
+LOG_FIELD_MAX_ITEMS = 20
+LOG_SEVERITY_ORDER = ["DEBUG", "INFO", "NOTICE", "WARNING", "ERROR", "CRITICAL"]
+
+# Fraction of occurrences logged per high-volume event; unlisted events are always logged
+LOG_SAMPLE_RATES = {
+    "auth_verified": float(os.environ.get('LOG_SAMPLE_AUTH', 0.1)),
+    "materials_loaded": float(os.environ.get('LOG_SAMPLE_MATERIALS', 0.1)),
+    "session_loaded": float(os.environ.get('LOG_SAMPLE_SESSION', 0.1)),
 }
 
 # Global variables
 _firestore_client = None
+_request_id = contextvars.ContextVar("request_id", default=None)
+_stage_durations = contextvars.ContextVar("stage_durations", default=None)
+_request_counters = contextvars.ContextVar("request_counters", default=None)
+_idempotency_cache = TTLCache(maxsize=2048, ttl=IDEMPOTENCY_TTL.total_seconds())
+_idempotency_lock = threading.Lock()
+_openai_clients = {}
+_openai_lock = threading.Lock()
 
 initialize_app()
 
@@ -111,9 +175,144 @@ def get_firestore_client():
         _firestore_client = firestore.client()
     return _firestore_client
 
-def get_current_month():
-    now = datetime.now()
-    return f"{now.year}-{now.month}"
+# Function-specific dependencies are imported on first use: the OpenAI SDK
+# is most of the module's import time and only ask_user needs it
+def get_openai_client(api_key: str):
+    """Shared OpenAI client for api_key (imports the SDK on first use)"""
+    client = _openai_clients.get(api_key)
+    if client is None:
+        with _openai_lock:
+            client = _openai_clients.get(api_key)
+            if client is None:
+                from openai import OpenAI
+                client = OpenAI(api_key=api_key)
+                _openai_clients[api_key] = client
+    return client
+
+def get_auth():
+    """firebase_admin.auth, imported on first use (not needed by api_chatlogs)"""
+    from firebase_admin import auth
+    return auth
+
+def start_request_context(req: https_fn.Request) -> str:
+    """Assign the request ID used to correlate this request's log entries"""
+    trace_header = req.headers.get('X-Cloud-Trace-Context', '')
+    request_id = req.headers.get('X-Request-ID') or trace_header.split('/')[0] or uuid.uuid4().hex
+    _request_id.set(request_id)
+    _stage_durations.set({})
+    _request_counters.set({})
+    return request_id
+
+def count_metric(name: str, amount: int = 1):
+    """Add to a per-request counter (Firestore reads/writes, cache hits, tokens) reported in log entries"""
+    counters = _request_counters.get()
+    if counters is not None:
+        counters[name] = counters.get(name, 0) + amount
+
+def record_token_usage(model: str, usage):
+    """Count prompt/completion tokens from an OpenAI response.usage object"""
+    if usage is None:
+        return
+    count_metric("openaiPromptTokens", usage.prompt_tokens or 0)
+    count_metric("openaiCompletionTokens", usage.completion_tokens or 0)
+    count_metric(f"openaiCalls.{model}")
+
+@contextmanager
+def timed_stage(name: str):
+    """Record how long a stage of the current request took, in milliseconds"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = _stage_durations.get()
+        if stages is not None:
+            stages[name] = (time.perf_counter() - started) * 1000
+
+def cap_field(value, max_chars: int = LOG_FIELD_MAX_CHARS):
+    """Render a log field with bounded size, however large the underlying value is"""
+    if callable(value):
+        value = value()
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, (list, tuple)):
+        capped = [cap_field(v, max_chars) for v in value[:LOG_FIELD_MAX_ITEMS]]
+        if len(value) > LOG_FIELD_MAX_ITEMS:
+            capped.append(f"... {len(value) - LOG_FIELD_MAX_ITEMS} more")
+        return capped
+    if isinstance(value, dict):
+        items = list(value.items())
+        capped = {str(k): cap_field(v, max_chars) for k, v in items[:LOG_FIELD_MAX_ITEMS]}
+        if len(items) > LOG_FIELD_MAX_ITEMS:
+            capped["..."] = f"{len(items) - LOG_FIELD_MAX_ITEMS} more"
+        return capped
+    text = str(value)
+    if len(text) > max_chars:
+        return f"{text[:max_chars]}... ({len(text)} chars)"
+    return text
+
+def log_event(event: str, severity: str = "INFO", **fields):
+    """
+    Write a structured log entry. Nothing is rendered unless the severity is
+    enabled and the event survives sampling; callable field values are
+    evaluated only at that point.
+    """
+    if LOG_SEVERITY_ORDER.index(severity) < LOG_SEVERITY_ORDER.index(LOG_LEVEL):
+        return
+    sample_rate = LOG_SAMPLE_RATES.get(event, 1.0)
+    if sample_rate < 1.0 and random.random() >= sample_rate:
+        return
+    entry = {"severity": severity, "message": event, "event": event}
+    request_id = _request_id.get()
+    if request_id:
+        entry["requestId"] = request_id
+    stages = _stage_durations.get()
+    if stages:
+        entry["stagesMs"] = {k: round(v, 1) for k, v in stages.items()}
+    counters = _request_counters.get()
+    if counters:
+        entry["counters"] = dict(counters)
+    for key, value in fields.items():
+        entry[key] = cap_field(value)
+    logger.write(entry)
+
+
+# Counters for the OpenAI resilience events; exhausted calls are logged by the caller
+LLM_EVENT_METRICS = {"retry": "llmRetries", "hedge": "llmHedges", "rejected": "llmCircuitRejections"}
+
+
+class FunctionHooks(BackendHooks):
+    """Reports the shared chat_core code to the per-request counters and the structured log"""
+    def firestore_read(self, collection, amount=1):
+        count_metric("firestoreReads", amount)
+
+    def firestore_write(self, collection, amount=1):
+        count_metric("firestoreWrites", amount)
+
+    def cache(self, name, hit):
+        # user_alias -> cacheHits.userAlias
+        head, *rest = name.split("_")
+        count_metric(f"{'cacheHits' if hit else 'cacheMisses'}.{head}{''.join(part.title() for part in rest)}")
+
+    def llm_event(self, event, **fields):
+        if event == "circuit_opened":
+            log_event("llm_circuit_opened", severity="WARNING", **fields)
+            return
+        if event in LLM_EVENT_METRICS:
+            count_metric(LLM_EVENT_METRICS[event])
+        if event == "retry":
+            log_event("llm_retry", severity="WARNING", **fields)
+
+    def log(self, event, severity="INFO", **fields):
+        log_event(event, severity=severity, **fields)
+
+
+backend_hooks = FunctionHooks()
+# OpenAI resilience: see chat_core.ResilientCompletions
+llm = ResilientCompletions(backend_hooks)
+
+
+def create_chat_completion(openai_client, hedge: bool = True, **params):
+    return llm.create(openai_client, hedge=hedge, **params)
 
 def get_text_direction(language: str) -> str:
     """Determine text direction based on language."""
@@ -149,13 +348,13 @@ def verify_auth(req: https_fn.Request) -> tuple[bool, str, str]:
         token = auth_header.split('Bearer ')[1]
         
         # Verify the token
-        decoded_token = auth.verify_id_token(token)
+        decoded_token = get_auth().verify_id_token(token)
         
         # Extract user information
         user_id = decoded_token['uid']
         user_email = decoded_token.get('email', '')
         
-        logger.info(f"Successfully verified token for user, user_id = {user_id}, user_email = {user_email}")
+        log_event("auth_verified", uid=user_id, email=user_email)
         return True, user_id, user_email
         
     except Exception as e:
@@ -163,39 +362,137 @@ def verify_auth(req: https_fn.Request) -> tuple[bool, str, str]:
         return False, '', ''
 
 
+# Admin-only endpoints accept an ID token with the `admin` custom claim
+# or one belonging to an address in ADMIN_EMAILS (comma-separated)
+ADMIN_EMAILS = {email.strip().lower() for email in os.environ.get('ADMIN_EMAILS', '').split(',') if email.strip()}
 
-def get_materials(level, week):
+
+def verify_admin(req: https_fn.Request) -> https_fn.Response | None:
+    """None for an admin caller, else the 401/403 response to return"""
+    auth_header = req.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return json_response({"error": "Unauthorized - Missing token"}, HTTP_STATUS["UNAUTHORIZED"], req)
     try:
-        # Remove the 'week' prefix if it exists
-        clean_week = week.replace('week', '').zfill(2)
-        logger.info(f"Clean week: {clean_week}")
-        lesson_key = f"{level}_week_{clean_week}"
-        logger.info(f"Lesson key: {lesson_key}")
-        logger.info(f"Searching for materials with lesson key: {lesson_key}")
+        claims = get_auth().verify_id_token(auth_header.split('Bearer ')[1])
+    except Exception as e:
+        logger.warning(f"Admin token rejected: {str(e)}")
+        return json_response({"error": "Invalid authentication token"}, HTTP_STATUS["UNAUTHORIZED"], req)
+    if claims.get('admin') is True or claims.get('email', '').lower() in ADMIN_EMAILS:
+        return None
+    log_event("admin_denied", severity="WARNING", uid=claims.get('uid'), path=req.path)
+    return json_response({"error": "Forbidden - admin access required"}, HTTP_STATUS["FORBIDDEN"], req)
 
-        # Query for documents where the ID starts with the lesson key
-        db = get_firestore_client()
-        docs = db.collection("materials").stream()
-        for doc in docs:
-            data = doc.to_dict()
-            logger.info(f"RAW ID FIELD: {data.get('id')} | DOC ID: {doc.id}")
 
-        docs = db.collection("materials") \
-            .where(filter=FieldFilter("id", ">=", lesson_key)) \
-            .where(filter=FieldFilter("id", "<", lesson_key + "_z")) \
-            .stream()
+# Canonical user identity: see chat_core.UserAliases
+user_aliases = UserAliases(backend_hooks)
+
+
+def resolve_user_id(uid: str = None, email: str = None) -> str:
+    """Canonical users/ document ID for a user"""
+    return user_aliases.resolve(get_firestore_client(), uid, email)
+
 
+# Lesson materials: see chat_core.MaterialsStore. "listen" watches the version
+# document, "poll" re-reads it at most every MATERIALS_POLL_SECONDS, "off"
+# queries the materials collection on every request
+MATERIALS_SYNC_MODE = os.environ.get('MATERIALS_SYNC_MODE', 'poll')
+# Deploy-time snapshot written by build_materials_snapshot.py (optional)
+MATERIALS_SNAPSHOT_MAGIC = b"BLMSNAP1"
+MATERIALS_SNAPSHOT_PATH = os.getenv(
+    "MATERIALS_SNAPSHOT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "materials_snapshot.bin")
+)
 
-        # Convert to list of dictionaries
-        materials = [doc.to_dict() for doc in docs]
-        for mat in materials:
-            logger.info(f"✅ Material found: {mat.get('id')}")
 
-        logger.info(f"Retrieved {len(materials)} relevant teaching materials.")
+class MaterialsSnapshot:
+    """
+    Read-only lesson bundles memory-mapped from the artifact written by
+    build_materials_snapshot.py. Only the header is parsed up front; a
+    lesson is decoded from the mapped pages when it is first requested.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.version = None
+        self.lessons = {}
+        self._mmap = None
+        self._body_offset = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+            try:
+                with open(self.path, 'rb') as file:
+                    mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                return
+            except (OSError, ValueError) as e:
+                logger.warn(f"Materials snapshot {self.path} unreadable: {e}")
+                return
+            magic_length = len(MATERIALS_SNAPSHOT_MAGIC)
+            if mapped[:magic_length] != MATERIALS_SNAPSHOT_MAGIC:
+                logger.warn(f"Materials snapshot {self.path} has an unknown format; ignoring it")
+                mapped.close()
+                return
+            (header_length,) = struct.unpack_from("<I", mapped, magic_length)
+            header_start = magic_length + 4
+            header = json.loads(mapped[header_start:header_start + header_length])
+            self.version = header.get("materialsVersion")
+            self.lessons = header.get("lessons") or {}
+            self._body_offset = header_start + header_length
+            self._mmap = mapped
+
+    def meta(self):
+        """The snapshot as a materialsMeta-shaped dict, or None without a snapshot"""
+        self._load()
+        if self._mmap is None:
+            return None
+        return {"version": self.version, "lessons": {key: entry["hash"] for key, entry in self.lessons.items()}}
+
+    def lesson(self, lesson_key, content_hash):
+        """The lesson's materials if the snapshot holds exactly the published content_hash"""
+        self._load()
+        entry = self.lessons.get(lesson_key)
+        if self._mmap is None or not entry or not content_hash or entry["hash"] != content_hash:
+            return None
+        start = self._body_offset + entry["offset"]
+        items = json.loads(self._mmap[start:start + entry["length"]])
+        return LessonMaterials(items, lesson_key, entry["hash"])
+
+
+_materials_store = MaterialsStore(backend_hooks, MATERIALS_SYNC_MODE)
+_materials_snapshot = MaterialsSnapshot(MATERIALS_SNAPSHOT_PATH)
+
+
+def load_snapshot_lesson(lesson_key, content_hash=None):
+    """A lesson from the deploy-time snapshot, else from its published bundle or a query"""
+    lesson = _materials_snapshot.lesson(lesson_key, content_hash)
+    if lesson is not None:
+        count_metric("materialsSnapshotHits")
+        return lesson
+    return load_lesson_materials(get_firestore_client(), backend_hooks, lesson_key, content_hash)
+
+
+def get_materials(level, week):
+    try:
+        # Remove the 'week' prefix if it exists
+        clean_week = week.replace('week', '').zfill(2)
+        lesson_key = f"{level}_week_{clean_week}"
 
-        # Log the retrieved materials for debugging
-        for mat in materials:
-            logger.info(f"Retrieved material: {mat['id']}")
+        db = get_firestore_client()
+        _materials_store.seed(_materials_snapshot.meta(), db)
+        materials = _materials_store.get(db, lesson_key, load_snapshot_lesson)
+        log_event(
+            "materials_loaded",
+            lesson_key=lesson_key,
+            count=len(materials),
+            version=_materials_store.version,
+            material_ids=lambda: [mat.get('id') for mat in materials]
+        )
 
         return materials
     except Exception as e:
@@ -203,89 +500,55 @@ def get_materials(level, week):
         return []
 
 
-def create_arabic_teaching_prompt(level, week, question, gender, language, materials, conversation_history=None):
-    """
-    Dynamically generates an Arabic teaching prompt for OpenAI
-    for specialized Levantine dialect tutoring.
-    """
-    base_prompt = f"""
-    You are 'Laith', an expert Levantine Arabic dialect tutor. Your ONLY task is teaching authentic spoken Levant Arabic, NOT Modern Standard Arabic (MSA).
-
-    STRICT RULES:
-    1. ONLY use information from the provided reference materials. Do not introduce vocabulary, phrases or concepts not included in these materials.
-    2. NEVER use MSA (فصحى) forms - use EXCLUSIVELY Levantine dialect (لهجة شامية) as spoken in daily conversation.
-    3. IGNORE any questions unrelated to Levantine Arabic learning.
-
-    Student profile:
-    - Level: {level}
-    - Week: {week}
-    - Gender: {gender}
-    - Language: {language}
-
-    TEACHING APPROACH:
-    - AUTHENTICITY: Teach how natives actually speak, not textbook forms
-    - PERSONALIZATION: For beginners (level {level}, week {week}), use more {language}. For advanced, use more Arabic
-    - EXAMPLES: Every vocabulary item must include realistic usage examples
-    - PRONUNCIATION: Include Hebrew transliteration (תעתיק עברי) for all Arabic words
-    - GENDER: Use appropriate forms for {gender} students
-    - DIALOGUES: Create practice conversations using ONLY vocabulary from materials
-    """
-    materials_prompt = "\nYOU MUST EXCLUSIVELY USE THESE MATERIALS AS YOUR SOURCE:\n"
-    for i, mat in enumerate(materials, 1):
-        materials_prompt += f"Material {i}: {mat}\n"
-
-    final_warning = "\nIMPORTANT: If asked about anything not covered in these materials, redirect to content you CAN teach from the materials. ALWAYS use Levantine dialect exclusively.\n"
+# Pre-generated lesson content: see chat_core.LessonContents
+lesson_contents = LessonContents(backend_hooks)
 
-    # Adjust language usage
-    language_guidance_map = {
-        "arabic": "\nRespond primarily in Arabic script with minimal explanations in Hebrew.\n",
-        "transliteration-hebrew": "\nProvide Arabic responses in Hebrew characters, plus short Hebrew explanations.\n",
-        "transliteration-english": "\nProvide Arabic responses with English transliteration, plus Hebrew explanations.\n"
-    }
-    language_guidance = language_guidance_map.get(
-        language, 
-        "\nProvide main responses in Hebrew, with Arabic phrases in both script and Hebrew transliteration.\n"
-    )
 
-    complete_prompt = base_prompt + materials_prompt + final_warning + language_guidance
+# Model routing: see chat_core.classify_question
+MODEL_ROUTES = load_model_routes(backend_hooks)
 
-    if conversation_history and len(conversation_history) > 0:
-        recent_messages = conversation_history[-5:]  # only the last 5
-        history_prompt = "\nPREVIOUS CONVERSATION CONTEXT:\n"
-        for msg in recent_messages:
-            role = "Student" if msg.get("isUser", msg.get("sender") == "user") else "You (Laith)"
-            content = msg.get("text", msg.get("content", ""))
-            history_prompt += f"{role}: {content}\n"
-        complete_prompt += history_prompt
 
-    return complete_prompt
+def create_bot_message(text: str, source: str) -> dict:
+    """Bot message for the chat log; source is llm, dictionary, dictionary_fallback or lesson_content"""
+    return {
+        "id": str(uuid.uuid4()),
+        "sender": "bot",
+        "text": text,
+        "timestamp": get_utc_timestamp(),
+        "isUser": False,
+        "source": source
+    }
 
 
-def call_bot(api_key, prompt, question):
-    """Call OpenAI API with improved error handling."""
+def call_bot(api_key, prompt, question, route="standard"):
+    """Call OpenAI API with improved error handling, using the model and token cap of `route`."""
     if not api_key:
         logger.error("Missing OpenAI API key")
         raise ValueError("OpenAI API key is required")
         
+    model = MODEL_ROUTES[route]["model"]
     try:
-        client = OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model="gpt-4-turbo",
+        client = get_openai_client(api_key)
+        started = time.perf_counter()
+        response = create_chat_completion(
+            client,
+            model=model,
             messages=[
                 {"role": "system", "content": prompt},
                 {"role": "user", "content": question}
             ],
             temperature=0.3,
-            max_tokens=1000
+            max_tokens=MODEL_ROUTES[route]["max_tokens"]
         )
+        latency_ms = (time.perf_counter() - started) * 1000
+        record_token_usage(model, response.usage)
+        count_metric(f"llmRoutes.{route}")
+        log_event("llm_routed", route=route, model=model, latency_ms=round(latency_ms, 1),
+                  completion_tokens=response.usage.completion_tokens if response.usage else None)
         bot_answer = response.choices[0].message.content
-        return {
-            "id": str(uuid.uuid4()),
-            "sender": "bot",
-            "text": bot_answer,
-            "timestamp": get_utc_timestamp(),
-            "isUser": False
-        }
+        return create_bot_message(bot_answer, source="llm")
+    except LLMUnavailable:
+        raise
     except Exception as e:
         logger.error(f"Error calling OpenAI: {str(e)}", exc_info=True)
         raise RuntimeError(f"Failed to generate bot response: {str(e)}")
@@ -295,6 +558,7 @@ def load_session(user_id: str, user_email: str, level: str, week: str, gender: s
     db = get_firestore_client()
     session_id = user_id
     user_doc = db.collection('chatLogs').document(session_id).get()
+    count_metric("firestoreReads")
     if user_doc.exists:
         return user_doc.to_dict()
     
@@ -313,38 +577,202 @@ def load_session(user_id: str, user_email: str, level: str, week: str, gender: s
         "gender": gender
     }
     db.collection('chatLogs').document(session_id).set(session)
+    count_metric("firestoreWrites")
     return session
 
 
 def add_messages_to_session(session, messages):
     session['messages'] = session.get("messages", []) + messages
     session['updatedAt'] = get_utc_timestamp()
+    session['revision'] = session.get('revision', 0) + 1
 
     db = get_firestore_client()
     session_id = session['_id']
     db.collection('chatLogs').document(session_id).update({
         'messages': firestore.ArrayUnion(messages),
-        'updatedAt': session['updatedAt']
+        'updatedAt': session['updatedAt'],
+        'revision': firestore.Increment(1)
     })
+    count_metric("firestoreWrites")
 
     return session
 
 
-def increase_user_message_count(user_id: str):
-    current_month = get_current_month()
-    db = get_firestore_client()
-    user_doc = db.collection('users').document(user_id).get()
-    if not user_doc.exists:
-        return
+# Free-plan quota: see chat_core.usage_month
+def monthly_usage_ref(user_id: str, month: str):
+    return get_firestore_client().collection('users').document(user_id) \
+        .collection(MONTHLY_USAGE_COLLECTION).document(month)
 
-    user_data = user_doc.to_dict()
-    total_messages = user_data.get('totalMessages', {}).get(current_month, 0)
-    db.collection('users').document(user_id).set({
-        'totalMessages': {
-            **user_data.get('totalMessages', {}),
-            current_month: total_messages + 1
-        }
-    }, merge=True)
+
+def increase_user_message_count(user_id: str, month: str, carried: int = 0):
+    """Count one message; `carried` legacy messages are added when the month's document is created"""
+    now = datetime.now(timezone.utc)
+    counter = {
+        'month': month,
+        'updatedAt': now.isoformat(),
+        'expiresAt': now + MONTHLY_USAGE_RETENTION
+    }
+    usage_ref = monthly_usage_ref(user_id, month)
+    if carried:
+        # create() so only one of two concurrent first requests carries the legacy count over
+        try:
+            usage_ref.create(dict(counter, messages=carried + 1))
+            count_metric("firestoreWrites")
+            return
+        except AlreadyExists:
+            pass
+    usage_ref.set(dict(counter, messages=firestore.Increment(1)), merge=True)
+    count_metric("firestoreWrites")
+
+
+def get_idempotency_ref(user_id: str, idempotency_key: str):
+    """Dedup record for an ask request, scoped to the user so keys cannot collide across users"""
+    doc_id = hashlib.sha256(f"{user_id}:{idempotency_key}".encode()).hexdigest()
+    return get_firestore_client().collection(IDEMPOTENCY_COLLECTION).document(doc_id)
+
+
+def claim_idempotency_key(user_id: str, idempotency_key: str) -> tuple[bool, dict | None]:
+    """
+    Claim an idempotency key before running the ask pipeline.
+
+    Returns (claimed, stored_response). A stored response means the request
+    was already answered and should be replayed; claimed=False without a
+    stored response means another attempt with the same key is still running.
+    """
+    cache_key = (user_id, idempotency_key)
+    with _idempotency_lock:
+        cached = _idempotency_cache.get(cache_key)
+    count_metric("cacheHits.idempotency" if cached is not None else "cacheMisses.idempotency")
+    if cached is not None:
+        return False, attach_current_session(cached)
+
+    now = datetime.now(timezone.utc)
+    doc_ref = get_idempotency_ref(user_id, idempotency_key)
+    pending = {
+        "userId": user_id,
+        "status": "pending",
+        "createdAt": now.isoformat(),
+        "expiresAt": now + IDEMPOTENCY_TTL
+    }
+    try:
+        doc_ref.create(pending)
+        return True, None
+    except AlreadyExists:
+        snapshot = doc_ref.get()
+        record = snapshot.to_dict() or {}
+    except Exception as e:
+        logger.error(f"Error claiming idempotency key: {str(e)}", exc_info=True)
+        return True, None
+
+    if record.get("expiresAt") and record["expiresAt"] <= now:
+        # Firestore TTL deletion is lazy, so treat expired records as absent
+        return take_over_idempotency_key(doc_ref, snapshot, pending), None
+
+    if record.get("status") == "completed":
+        stored = json.loads(record["response"])
+        with _idempotency_lock:
+            _idempotency_cache[cache_key] = stored
+        return False, attach_current_session(stored)
+
+    if record.get("status") == "pending" and datetime.fromisoformat(record["createdAt"]) + IDEMPOTENCY_PENDING_TIMEOUT <= now:
+        # The attempt holding the claim died without releasing it
+        return take_over_idempotency_key(doc_ref, snapshot, pending), None
+
+    return False, None
+
+
+def take_over_idempotency_key(doc_ref, snapshot, pending: dict) -> bool:
+    """Replace a stale claim, unless a concurrent retry replaced it first"""
+    try:
+        doc_ref.update(pending, option=get_firestore_client().write_option(last_update_time=snapshot.update_time))
+        count_metric("firestoreWrites")
+        return True
+    except (FailedPrecondition, NotFound):
+        return False
+
+
+def store_idempotent_response(user_id: str, idempotency_key: str, response_body: dict):
+    """Persist a successful answer so retries with the same key can replay it"""
+    # The chat session is re-read on replay rather than duplicated in the dedup store
+    stored = {k: v for k, v in response_body.items() if k != "chatSession"}
+    with _idempotency_lock:
+        _idempotency_cache[(user_id, idempotency_key)] = stored
+    try:
+        get_idempotency_ref(user_id, idempotency_key).set({
+            "status": "completed",
+            "response": json.dumps(stored),
+            "updatedAt": get_utc_timestamp()
+        }, merge=True)
+    except Exception as e:
+        logger.error(f"Error storing idempotent response: {str(e)}", exc_info=True)
+
+
+def release_idempotency_key(user_id: str, idempotency_key: str):
+    """Drop a claim after a failed attempt so the client's retry is processed normally"""
+    try:
+        get_idempotency_ref(user_id, idempotency_key).delete()
+    except Exception as e:
+        logger.error(f"Error releasing idempotency key: {str(e)}", exc_info=True)
+
+
+def attach_current_session(stored_response: dict) -> dict:
+    """Return a replayable response with the up-to-date chat session attached"""
+    response = dict(stored_response)
+    session_doc = get_firestore_client().collection('chatLogs').document(response["sessionId"]).get()
+    if session_doc.exists:
+        response["chatSession"] = session_doc.to_dict()
+    return response
+
+
+# JSON responses: UTF-8 without \uXXXX escapes (chat logs are mostly Hebrew and
+# Arabic), encoded with orjson when installed and compressed when large
+JSON_CONTENT_TYPE = "application/json; charset=utf-8"
+JSON_COMPRESS_MIN_BYTES = int(os.environ.get('JSON_COMPRESS_MIN_BYTES', 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+def encode_json(value) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def negotiate_encoding(req: https_fn.Request):
+    """'br' or 'gzip' if the client accepts it (br only when brotli is installed), else None"""
+    if brotli is not None and req.accept_encodings["br"]:
+        return "br"
+    if req.accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+def json_response(value, status: int = HTTP_STATUS["OK"], req: https_fn.Request = None, headers: dict = None) -> https_fn.Response:
+    """JSON response; with `req`, bodies over JSON_COMPRESS_MIN_BYTES are compressed as the client allows"""
+    payload = encode_json(value)
+    headers = dict(headers or {})
+    if req is not None and len(payload) >= JSON_COMPRESS_MIN_BYTES:
+        headers["Vary"] = "Accept-Encoding"
+        encoding = negotiate_encoding(req)
+        if encoding == "br":
+            payload = brotli.compress(payload, quality=BROTLI_QUALITY)
+        elif encoding == "gzip":
+            payload = gzip.compress(payload, compresslevel=GZIP_LEVEL)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+    return https_fn.Response(payload, status=status, headers=headers, content_type=JSON_CONTENT_TYPE)
+
+
+# Conditional GETs: ETags from chat_core.version_etag, bodiless 304s on a match
+# Last path segments that address the whole collection rather than one session
+CHAT_COLLECTION_PATHS = {"", "chatlogs", "getChatLogs", "api_chatlogs"}
+_materials_listing = None   # (version, etag, items) of the last materials collection read
+_materials_listing_lock = threading.Lock()
+
+
+def conditional_json(req: https_fn.Request, etag: str, build, cache_control: str = "private, no-cache") -> https_fn.Response:
+    """304 when the client holds `etag`, otherwise the JSON of build(); both carry the ETag"""
+    headers = {"ETag": f'W/"{etag}"', "Cache-Control": cache_control}
+    if req.if_none_match.contains_weak(etag):
+        return https_fn.Response(status=304, headers=headers)
+    return json_response(build(), req=req, headers=headers)
 
 
 # Chat logs handler functions
@@ -385,46 +813,254 @@ def handle_get_all_chatlogs(req: https_fn.Request) -> https_fn.Response:
     # Sort by creation date
     query = query.order_by("createdAt", direction=firestore.Query.DESCENDING)
     
-    # Only load all docs if text search is needed
+    # Count, search and page on the listing fields; messages are read for one page only
+    chat_logs = [(doc.id, doc.to_dict() or {}) for doc in query.select(CHAT_LISTING_FIELDS).stream()]
+    count_metric("firestoreReads", max(len(chat_logs), 1))
     if search_term:
         # Full text search requires in-memory filtering
-        chat_logs = [doc.to_dict() for doc in query.stream()]
-        # Filter in memory
         chat_logs = [
-            c for c in chat_logs
+            (doc_id, c) for doc_id, c in chat_logs
             if search_term in c.get("userName", "").lower()
             or search_term in c.get("userId", "").lower()
             or search_term in c.get("userEmail", "").lower()
             or search_term in c.get("_id", "").lower()
         ]
-        # Manual pagination
-        total = len(chat_logs)
-        start = (page - 1) * page_size
-        end = start + page_size
-        paginated_logs = chat_logs[start:end]
-    else:
-        # Get all documents for counting (could be optimized with a count function)
-        all_docs = [doc.id for doc in query.stream()]
-        total = len(all_docs)
-        # Get paginated results
-        paginated_logs = [doc.to_dict() for doc in query.limit(page_size).offset((page - 1) * page_size).stream()]
 
+    total = len(chat_logs)
     total_pages = (total + page_size - 1) // page_size
+    start = (page - 1) * page_size
+    page_logs = chat_logs[start:start + page_size]
+    etag = version_etag(total_pages, [session_version(doc_id, c) for doc_id, c in page_logs])
+
+    def load_page():
+        collection = db.collection("chatLogs")
+        sessions = {doc.id: doc.to_dict() for doc in db.get_all([collection.document(doc_id) for doc_id, _ in page_logs])
+                    if doc.exists}
+        count_metric("firestoreReads", len(page_logs))
+        return {
+            "chats": [sessions[doc_id] for doc_id, _ in page_logs if doc_id in sessions],
+            "totalPages": total_pages
+        }
 
-    return https_fn.Response(json.dumps({
-        "chats": paginated_logs,
-        "totalPages": total_pages
-    }), status=HTTP_STATUS["OK"])
+    return conditional_json(req, etag, load_page)
 
 
-def handle_get_single_chat(session_id: str) -> https_fn.Response:
-    """GET /api/chatlogs/<sessionId>"""
+def handle_get_single_chat(session_id: str, req: https_fn.Request) -> https_fn.Response:
+    """GET /api/chatlogs/<sessionId>; a revalidation reads only the version fields while nothing changed"""
     db = get_firestore_client()
     doc_ref = db.collection("chatLogs").document(session_id)
+    if req.if_none_match:
+        version = doc_ref.get(field_paths=CHAT_VERSION_FIELDS)
+        count_metric("firestoreReads")
+        if not version.exists:
+            return json_response({"error": "Chat session not found"}, HTTP_STATUS["NOT_FOUND"])
+        etag = version_etag(*session_version(session_id, version.to_dict() or {}))
+        if req.if_none_match.contains_weak(etag):
+            return conditional_json(req, etag, None)
     doc = doc_ref.get()
+    count_metric("firestoreReads")
     if not doc.exists:
-        return https_fn.Response(json.dumps({"error": "Chat session not found"}), status=HTTP_STATUS["NOT_FOUND"])
-    return https_fn.Response(json.dumps(doc.to_dict()), status=HTTP_STATUS["OK"])
+        return json_response({"error": "Chat session not found"}, HTTP_STATUS["NOT_FOUND"])
+    session = doc.to_dict()
+    return conditional_json(req, version_etag(*session_version(session_id, session)), lambda: session)
+
+
+def materials_listing(db) -> tuple:
+    """(version, etag, items) of the materials collection, read once per published version"""
+    global _materials_listing
+    _materials_store.seed(_materials_snapshot.meta(), db)
+    _materials_store.refresh(db)
+    version = _materials_store.version
+    listing = _materials_listing
+    if version is not None and listing is not None and listing[0] == version:
+        return listing
+    items = [{"id": doc.id, **(doc.to_dict() or {})} for doc in db.collection("materials").stream()]
+    count_metric("firestoreReads", max(len(items), 1))
+    items.sort(key=lambda item: str(item["id"]))
+    # Without a published version the content itself is the validator
+    listing = (version, version_etag("materials", version if version is not None else items), items)
+    if version is not None:
+        with _materials_listing_lock:
+            _materials_listing = listing
+    return listing
+
+
+def handle_get_materials(req: https_fn.Request) -> https_fn.Response:
+    """GET /api/materials for a signed-in user; while the version is unchanged they come from memory, or as a 304"""
+    is_authenticated, _, _ = verify_auth(req)
+    if not is_authenticated:
+        return json_response({'error': 'Authentication failed'}, HTTP_STATUS["UNAUTHORIZED"], req)
+    version, etag, items = materials_listing(get_firestore_client())
+    return conditional_json(req, etag, lambda: {"materials": items, "version": version}, cache_control="no-cache")
+
+
+# Chat log export: see chat_core.export_session_rows
+EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', 100))
+
+def iter_export_sessions(filters: dict, after_session_id: str = None, page_size: int = EXPORT_PAGE_SIZE):
+    """(session_id, session) for chat logs matching the equality filters, one page in memory at a time"""
+    query = get_firestore_client().collection("chatLogs")
+    for field, value in filters.items():
+        query = query.where(filter=FieldFilter(field, "==", value))
+    query = query.order_by(FieldPath.document_id()).limit(page_size)
+    while True:
+        page = query.start_after({FieldPath.document_id(): after_session_id}) if after_session_id else query
+        docs = list(page.stream())
+        count_metric("firestoreReads", max(len(docs), 1))
+        for doc in docs:
+            yield doc.id, doc.to_dict()
+        if len(docs) < page_size:
+            return
+        after_session_id = docs[-1].id
+
+def generate_export(kind: str, export_format: str, filters: dict, after_session_id, date_from, date_to, max_sessions: int):
+    """Yields the export one session at a time"""
+    fields = EXPORT_FIELDS[kind]
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction="ignore")
+    if export_format == "csv":
+        writer.writeheader()
+        yield buffer.getvalue().encode("utf-8")
+
+    sessions_exported = rows_exported = 0
+    for session_id, session in iter_export_sessions(filters, after_session_id):
+        if max_sessions and sessions_exported >= max_sessions:
+            break
+        rows = export_session_rows(kind, session_id, session, date_from, date_to)
+        if not rows:
+            continue
+        if export_format == "csv":
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue().encode("utf-8")
+        else:
+            yield b"".join(encode_json({field: row.get(field) for field in fields}) + b"\n" for row in rows)
+        sessions_exported += 1
+        rows_exported += len(rows)
+    log_event("chatlogs_exported", kind=kind, format=export_format, sessions=sessions_exported, rows=rows_exported)
+
+def handle_export_chatlogs(req: https_fn.Request) -> https_fn.Response:
+    """
+    GET /api/chatlogs/export: stream chat logs as NDJSON or CSV.
+    Query: format=ndjson|csv, rows=messages|sessions, userId, userEmail, level, week,
+    dateFrom/dateTo (ISO, applied to message timestamps), cursor, limit (sessions).
+    Admins only: the rows carry every user's messages and email.
+    """
+    denied = verify_admin(req)
+    if denied:
+        return denied
+    export_format = req.args.get("format", "ndjson").lower()
+    kind = req.args.get("rows", "messages").lower()
+    if export_format not in EXPORT_CONTENT_TYPES or kind not in EXPORT_FIELDS:
+        return json_response({"error": "format must be ndjson or csv and rows must be messages or sessions"}, HTTP_STATUS["BAD_REQUEST"])
+    try:
+        cursor = req.args.get("cursor")
+        after_session_id = decode_export_cursor(cursor) if cursor else None
+        date_from = parse_export_date(req.args.get("dateFrom"))
+        date_to = parse_export_date(req.args.get("dateTo"))
+        max_sessions = int(req.args.get("limit", 0))
+    except ValueError as e:
+        return json_response({"error": str(e)}, HTTP_STATUS["BAD_REQUEST"])
+    filters = {field: req.args[field] for field in EXPORT_FILTER_FIELDS if req.args.get(field)}
+
+    log_event("chatlogs_export_started", kind=kind, format=export_format, filters=filters, resumed=bool(after_session_id))
+    generator = generate_export(kind, export_format, filters, after_session_id, date_from, date_to, max_sessions)
+    return https_fn.Response(generator, status=HTTP_STATUS["OK"], content_type=EXPORT_CONTENT_TYPES[export_format], headers={
+        "Content-Disposition": f'attachment; filename="chatlogs-{kind}.{export_format}"',
+        "Cache-Control": "no-store",
+    })
+
+
+# Usage rollups: see chat_core.usage_periods
+USAGE_STATS_CACHE_TTL_SECONDS = int(os.environ.get('USAGE_STATS_CACHE_TTL_SECONDS', 60))
+_usage_stats_cache = TTLCache(maxsize=64, ttl=USAGE_STATS_CACHE_TTL_SECONDS)
+_usage_stats_lock = threading.Lock()
+
+
+def record_usage(level: str, week: str, is_premium: bool, answer_source: str, prompt_tokens: int = 0, completion_tokens: int = 0):
+    """Add one answered question (a user and a bot message) to today's and this month's rollups"""
+    db = get_firestore_client()
+    now = datetime.now(timezone.utc)
+    shard = random.randrange(USAGE_SHARDS)
+    counters = {
+        "messages": firestore.Increment(2),
+        "questions": firestore.Increment(1),
+        "sources": {usage_key(answer_source): firestore.Increment(1)},
+        "lessons": {usage_key(f"{level}_{week}"): firestore.Increment(1)},
+        "plans": {"premium" if is_premium else "free": firestore.Increment(1)},
+    }
+    if prompt_tokens or completion_tokens:
+        counters["tokens"] = {
+            "prompt": firestore.Increment(prompt_tokens),
+            "completion": firestore.Increment(completion_tokens),
+        }
+    try:
+        mark_usage_live(db, backend_hooks)
+        batch = db.batch()
+        for granularity, period_format in USAGE_GRANULARITIES.items():
+            period = now.strftime(period_format)
+            doc_ref = db.collection(USAGE_COLLECTION).document(f"{granularity}_{period}_{shard}")
+            batch.set(doc_ref, dict(counters, granularity=granularity, period=period, updatedAt=now.isoformat()), merge=True)
+        batch.commit()
+        count_metric("firestoreWrites", len(USAGE_GRANULARITIES))
+    except Exception as e:
+        logger.warn(f"Usage rollup update failed: {e}")
+
+def load_usage_stats(granularity: str, periods: list) -> list:
+    """Counters per period, summed over shards; one query however many messages there were"""
+    docs = get_firestore_client().collection(USAGE_COLLECTION) \
+        .where(filter=FieldFilter("granularity", "==", granularity)) \
+        .where(filter=FieldFilter("period", ">=", periods[0])) \
+        .where(filter=FieldFilter("period", "<=", periods[-1])) \
+        .stream()
+    by_period = {period: {"messages": 0, "questions": 0} for period in periods}
+    read_count = 0
+    for doc in docs:
+        read_count += 1
+        data = doc.to_dict()
+        if data.get("period") in by_period:
+            add_usage_counters(by_period[data["period"]], {field: data[field] for field in USAGE_COUNTER_FIELDS if field in data})
+    count_metric("firestoreReads", max(read_count, 1))
+    return [dict(counters, period=period) for period, counters in by_period.items()]
+
+def handle_usage_stats(req: https_fn.Request) -> https_fn.Response:
+    """
+    GET /api/usage/stats: usage rollups for dashboards.
+    Query: granularity=day|month (default day), from/to (YYYY-MM-DD or YYYY-MM;
+    default the last 30 days or 12 months). Admins only.
+    """
+    denied = verify_admin(req)
+    if denied:
+        return denied
+    granularity = req.args.get("granularity", "day")
+    if granularity not in USAGE_GRANULARITIES:
+        return json_response({"error": "granularity must be day or month"}, HTTP_STATUS["BAD_REQUEST"])
+    try:
+        end = parse_usage_date(req.args["to"]) if req.args.get("to") else datetime.now(timezone.utc).date()
+        default_span = timedelta(days=29) if granularity == "day" else timedelta(days=334)
+        start = parse_usage_date(req.args["from"]) if req.args.get("from") else end - default_span
+    except ValueError as e:
+        return json_response({"error": f"Invalid date: {e}"}, HTTP_STATUS["BAD_REQUEST"])
+    if granularity == "month":
+        start, end = start.replace(day=1), end.replace(day=1)
+    periods = usage_periods(granularity, start, end)
+    if not periods or len(periods) > USAGE_MAX_PERIODS[granularity]:
+        return json_response({"error": f"from/to must span 1 to {USAGE_MAX_PERIODS[granularity]} {granularity}s"}, HTTP_STATUS["BAD_REQUEST"])
+
+    cache_key = (granularity, periods[0], periods[-1])
+    with _usage_stats_lock:
+        cached = _usage_stats_cache.get(cache_key)
+    count_metric("cacheHits.usageStats" if cached is not None else "cacheMisses.usageStats")
+    if cached is None:
+        stats = load_usage_stats(granularity, periods)
+        totals = {}
+        for counters in stats:
+            add_usage_counters(totals, {field: counters[field] for field in USAGE_COUNTER_FIELDS if field in counters})
+        cached = {"granularity": granularity, "from": periods[0], "to": periods[-1], "periods": stats, "totals": totals}
+        with _usage_stats_lock:
+            _usage_stats_cache[cache_key] = cached
+    return json_response(cached, req=req)
 
 
 def handle_delete_all_chatlogs() -> https_fn.Response:
@@ -467,10 +1103,187 @@ def handle_delete_single_chat(session_id: str) -> https_fn.Response:
     return https_fn.Response(json.dumps({"success": True}), status=HTTP_STATUS["OK"])
 
 
+# Warm-up: prepare clients and caches before the first real request.
+# GET /__/warmup on any function runs it (once per instance) and answers
+# 200 only when every step succeeded; serving instances also start it in
+# the background on boot.
+WARMUP_PATH = "/__/warmup"
+WARMUP_ON_START = os.environ.get('WARMUP_ON_START', 'true').lower() == 'true'
+# Lessons preloaded by ask_user instances, as level:week pairs
+WARMUP_LESSONS = [
+    tuple(lesson.split(":", 1))
+    for lesson in os.environ.get('WARMUP_LESSONS', 'beginner:01,beginner:02,intermediate:01').split(",")
+    if ":" in lesson
+]
+# Public keys Firebase ID tokens are signed with
+ID_TOKEN_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+_warmup_lock = threading.Lock()
+_warmup_report = None
+
+
+def warm_firestore():
+    """Create the client and open its channel with a single document read"""
+    db = get_firestore_client()
+    _materials_store.refresh(db)
+    if _materials_store.mode == "off":
+        db.collection(MATERIALS_META_COLLECTION).document(MATERIALS_META_DOC).get()
+        count_metric("firestoreReads")
+
+
+def warm_openai():
+    """Import the SDK and create the shared client (ask_user and the summarizer)"""
+    if not OPENAI_API_KEY.value:
+        return "skipped"
+    get_openai_client(OPENAI_API_KEY.value)
+
+
+def warm_auth_certs():
+    """
+    Import firebase_admin.auth and fetch Google's ID-token signing certs over
+    the public google-auth transport, so DNS, TLS and the transport modules
+    are ready. firebase_admin keeps its cert cache private; the first
+    verify_id_token() still fills it, from a warm connection path.
+    """
+    get_auth()
+    from google.auth.transport.requests import Request
+    response = Request()(ID_TOKEN_CERTS_URL, method="GET")
+    if response.status != 200:
+        raise RuntimeError(f"Certificate fetch returned HTTP {response.status}")
+
+
+def warm_materials():
+    """Load the popular lessons and build their prompt blocks and lookup indexes"""
+    for level, week in WARMUP_LESSONS:
+        materials = get_materials(level, week)
+        if isinstance(materials, LessonMaterials):
+            materials.lookup_index
+        get_materials_block(level, week, materials)
+
+
+# Steps each function needs; unknown targets (local runs) warm everything
+WARMUP_STEPS = {
+    "ask_user": [("firestore", warm_firestore), ("openai", warm_openai),
+                 ("auth_certs", warm_auth_certs), ("materials", warm_materials)],
+    "on_user_purchase": [("firestore", warm_firestore), ("auth", get_auth)],
+    "api_chatlogs": [("firestore", warm_firestore)],
+    "expire_subscriptions": [("firestore", warm_firestore)],
+    "summarize_chat_session": [("firestore", warm_firestore), ("openai", warm_openai)],
+}
+
+
+def warm_up() -> dict:
+    """
+    Run the warm-up steps for this instance's function once; concurrent
+    callers wait for the same run. Failed steps are retried on the next call.
+    """
+    global _warmup_report
+    if _warmup_report is not None and _warmup_report["ready"]:
+        return _warmup_report
+    with _warmup_lock:
+        if _warmup_report is not None and _warmup_report["ready"]:
+            return _warmup_report
+        target = os.environ.get('FUNCTION_TARGET', '')
+        steps = WARMUP_STEPS.get(target) or WARMUP_STEPS["ask_user"] + [("auth", get_auth)]
+        previous = (_warmup_report or {}).get("steps", {})
+        started = time.perf_counter()
+        results = {}
+        for name, step in steps:
+            if previous.get(name, {}).get("status") in ("ok", "skipped"):
+                results[name] = previous[name]
+                continue
+            step_started = time.perf_counter()
+            try:
+                outcome = step()
+                results[name] = {"status": outcome if outcome == "skipped" else "ok"}
+            except Exception as e:
+                results[name] = {"status": "error", "error": cap_field(str(e))}
+            results[name]["ms"] = round((time.perf_counter() - step_started) * 1000, 1)
+        _warmup_report = {
+            "ready": all(result["status"] != "error" for result in results.values()),
+            "function": target or None,
+            "steps": results,
+            "durationMs": round((time.perf_counter() - started) * 1000, 1),
+        }
+        log_event("warmup_completed", severity="INFO" if _warmup_report["ready"] else "WARNING", **_warmup_report)
+        return _warmup_report
+
+
+def warmup_response() -> https_fn.Response:
+    report = warm_up()
+    status = HTTP_STATUS["OK"] if report["ready"] else 503
+    return https_fn.Response(json.dumps(report), status=status, content_type="application/json")
+
+
+def find_completed_payment(db, transaction_code: str):
+    """Return the stored payment record if this transaction was already processed"""
+    payment_doc = db.collection("payments").document(transaction_code).get()
+    if payment_doc.exists:
+        payment_data = payment_doc.to_dict()
+        if payment_data.get("status") == "completed":
+            return payment_data
+    return None
+
+
+@firestore.transactional
+def record_purchase(transaction, db, user_id: str, payer_email: str, transaction_code: str, payment_sum, is_yearly: bool) -> bool:
+    """
+    Write the payment, user and subscription documents for a purchase in one
+    atomic transaction. Returns False without writing anything if the
+    transaction code was already recorded, so webhook retries are no-ops.
+    """
+    payment_ref = db.collection("payments").document(transaction_code)
+    payment_doc = payment_ref.get(transaction=transaction)
+    if payment_doc.exists and payment_doc.to_dict().get("status") == "completed":
+        return False
+
+    now = get_utc_timestamp()
+    end_date = datetime.now(timezone.utc) + timedelta(days=365 if is_yearly else 30)
+
+    transaction.set(payment_ref, {
+        "userId": user_id,
+        "userEmail": payer_email,
+        "transactionId": transaction_code,
+        "status": "completed",
+        "amount": payment_sum,
+        "plan": "premium",
+        "createdAt": now,
+        "updatedAt": now
+    })
+
+    transaction.set(db.collection('users').document(user_id), {
+        'isPremium': True,
+        'userId': user_id,
+        'email': payer_email,
+        'subscriptionStatus': 'active',
+        'subscriptionEndDate': end_date,
+        'updatedAt': now
+    }, merge=True)
+
+    transaction.set(db.collection("subscriptions").document(user_id), {
+        "userId": user_id,
+        "userEmail": payer_email,
+        "plan": "premium",
+        "billingCycle": "yearly" if is_yearly else "monthly",
+        "status": "active",
+        "startDate": now,
+        "endDate": end_date,
+        "autoRenew": True,
+        "transactionId": transaction_code,
+        "paymentMethod": "external",
+        "createdAt": now,
+        "updatedAt": now
+    }, merge=True)
+
+    return True
+
+
 # Main endpoint functions
 @https_fn.on_request()
 def on_user_purchase(req: https_fn.Request) -> https_fn.Response:
     try:
+        start_request_context(req)
+        if req.path == WARMUP_PATH and req.method == "GET":
+            return warmup_response()
         logger.info("Payment webhook received")
         
         # Parse the request body
@@ -501,87 +1314,55 @@ def on_user_purchase(req: https_fn.Request) -> https_fn.Response:
         
         # Get Firestore client
         db = get_firestore_client()
+
+        # Provider retries of an already processed transaction are answered
+        # from the stored payment record, before any Auth lookups
+        with timed_stage("idempotency_check"):
+            existing_payment = find_completed_payment(db, transaction_code)
+        count_metric("firestoreReads")
+        if existing_payment:
+            log_event("purchase_completed", transaction_code=transaction_code, duplicate=True)
+            return https_fn.Response(json.dumps({
+                'success': True,
+                'userId': existing_payment.get('userId'),
+                'duplicate': True
+            }), status=HTTP_STATUS["OK"])
         
         # Try to find user by email
         user_id = None
-        try:
-            logger.info(f"Looking up user by email: {payer_email}")
-            user = auth.get_user_by_email(payer_email)
-            user_id = user.uid
-            logger.info(f"Existing user found with ID: {user_id}")
-        except auth.UserNotFoundError:
-            # Create a new user if not found
-            logger.info(f"User not found for email: {payer_email}, creating new user")
-            username = payer_email.split('@')[0]  # Username is email without the @
-            user_record = auth.create_user(
-                email=payer_email,
-                display_name=username
-            )
-            user_id = user_record.uid
-            logger.info(f"New user created with ID: {user_id}")
-        
-        # Update user's subscription in Firestore
-        if user_id:
-            current_month = get_current_month()
-            logger.info(f"Updating subscription for user: {user_id} for month: {current_month}")
-            db.collection('users').document(user_id).set({
-                'premium': { 
-                    current_month: True,
-                 },
-                'userId': user_id
-            }, merge=True)
-            
-        # Calculate subscription end date
-        now = datetime.now(timezone.utc)
-        end_date = now + timedelta(days=365 if is_yearly else 30)
-        
-        # Store transaction details
-        transaction_data = {
-            "userId": user_id,
-            "userEmail": payer_email,
-            "transactionId": transaction_code,
-            "status": "completed",
-            "amount": payment_sum,
-            "plan": "premium",
-            "createdAt": get_utc_timestamp(),
-            "updatedAt": get_utc_timestamp()
-        }
-        
-        db.collection("payments").document(transaction_code).set(transaction_data)
-        logger.info(f"Payment record created for transaction: {transaction_code}")
-        
-        # Update user document
-        db.collection('users').document(user_id).set({
-            'isPremium': True,
-            'userId': user_id,
-            'email': payer_email,
-            'subscriptionStatus': 'active',
-            'subscriptionEndDate': end_date.isoformat(),
-            'updatedAt': get_utc_timestamp()
-        }, merge=True)
-        
-        # Create or update subscription record
-        subscription_data = {
-            "userId": user_id,
-            "userEmail": payer_email,
-            "plan": "premium",
-            "billingCycle": "yearly" if is_yearly else "monthly",
-            "status": "active",
-            "startDate": get_utc_timestamp(),
-            "endDate": end_date.isoformat(),
-            "autoRenew": True,
-            "transactionId": transaction_code,
-            "paymentMethod": "external",
-            "createdAt": get_utc_timestamp(),
-            "updatedAt": get_utc_timestamp()
-        }
-        
-        db.collection("subscriptions").document(user_id).set(subscription_data, merge=True)
-        logger.info(f"Subscription updated successfully for user: {user_id}")
+        with timed_stage("auth_lookup"):
+            auth = get_auth()
+            try:
+                logger.info(f"Looking up user by email: {payer_email}")
+                user = auth.get_user_by_email(payer_email)
+                user_id = user.uid
+                logger.info(f"Existing user found with ID: {user_id}")
+            except auth.UserNotFoundError:
+                # Create a new user if not found
+                logger.info(f"User not found for email: {payer_email}, creating new user")
+                username = payer_email.split('@')[0]  # Username is email without the @
+                user_record = auth.create_user(
+                    email=payer_email,
+                    display_name=username
+                )
+                user_id = user_record.uid
+                logger.info(f"New user created with ID: {user_id}")
+
+        # Entitlement goes on the canonical user document, wherever the user was first stored
+        with timed_stage("identity"):
+            user_id = resolve_user_id(user_id, payer_email)
+
+        # Commit payment, user and subscription documents atomically
+        with timed_stage("firestore_commit"):
+            recorded = record_purchase(db.transaction(), db, user_id, payer_email, transaction_code, payment_sum, is_yearly)
+        count_metric("firestoreReads")
+        count_metric("firestoreWrites", 3 if recorded else 0)
+        log_event("purchase_completed", transaction_code=transaction_code, user_id=user_id, duplicate=not recorded)
         
         return https_fn.Response(json.dumps({
             'success': True,
-            'userId': user_id
+            'userId': user_id,
+            'duplicate': not recorded
         }), status=HTTP_STATUS["OK"])
             
     except Exception as e:
@@ -589,13 +1370,165 @@ def on_user_purchase(req: https_fn.Request) -> https_fn.Response:
         return https_fn.Response(json.dumps({'error': str(e)}), status=HTTP_STATUS["SERVER_ERROR"])
 
 
+def answer_question(user_id: str, user_email: str, question: str, week: str, level: str, gender: str, language: str) -> tuple[dict, int]:
+    """
+    Run the ask pipeline for an authenticated user: enforce the monthly limit,
+    call the bot and persist both messages. Returns (response body, status).
+    """
+    # Check if user can ask questions
+    month = usage_month()
+    db = get_firestore_client()
+    # Quota and premium live on the canonical user document; chat sessions stay keyed by uid
+    with timed_stage("identity"):
+        account_id = resolve_user_id(user_id, user_email)
+    user_ref = db.collection('users').document(account_id)
+    usage_ref = monthly_usage_ref(account_id, month)
+    with timed_stage("user_doc"):
+        # The user and this month's counter in one round trip
+        snapshots = {snapshot.reference.path: snapshot for snapshot in db.get_all([user_ref, usage_ref])}
+    count_metric("firestoreReads", 2)
+    user_doc, usage_doc = snapshots[user_ref.path], snapshots[usage_ref.path]
+    carried = 0
+    
+    if user_doc.exists:
+        user_data = user_doc.to_dict()
+        isPremium = has_premium_entitlement(user_data)
+        
+        # If not premium, check message count
+        if not isPremium:
+            if usage_doc.exists:
+                totalMessages = (usage_doc.to_dict() or {}).get('messages', 0)
+            else:
+                carried = totalMessages = legacy_message_count(user_data, month)
+            
+            # If at exact limit, send a warning with the response
+            if totalMessages == MAX_MONTHLY_MESSAGES - 1:
+                # This is their last message, warn them
+                limitWarning = True
+                remainingMessages = 1
+            # If over limit, return limit reached response
+            elif totalMessages >= MAX_MONTHLY_MESSAGES:
+                logger.info(f"User {user_id} has reached message limit: {totalMessages}/{MAX_MONTHLY_MESSAGES}")
+                return {
+                    'error': 'Message limit reached',
+                    'maxLimitReached': True,
+                    'subscriptionUrl': '/subscription',
+                    'currentCount': totalMessages,
+                    'maxLimit': MAX_MONTHLY_MESSAGES
+                }, HTTP_STATUS["FORBIDDEN"]
+            # If approaching limit (80% or more), add warning flag
+            elif totalMessages >= int(MAX_MONTHLY_MESSAGES * 0.8):
+                limitWarning = True
+                remainingMessages = MAX_MONTHLY_MESSAGES - totalMessages
+            else:
+                limitWarning = False
+                remainingMessages = MAX_MONTHLY_MESSAGES - totalMessages
+        else:
+            # Premium users don't have limits
+            limitWarning = False
+            remainingMessages = -1  # -1 indicates unlimited
+    else:
+        # New user, no warning needed
+        limitWarning = False
+        remainingMessages = MAX_MONTHLY_MESSAGES
+
+    # Load conversation history and create a new message
+    with timed_stage("session_load"):
+        session = load_session(user_id, user_email, level, week, gender, language)
+    conversation_history = session.get("messages", [])
+    log_event("session_loaded", session_id=session['_id'], message_count=len(conversation_history))
+    
+    # Get materials and validate
+    with timed_stage("materials"):
+        materials = get_materials(level, week)
+    if not materials:
+        log_event("materials_missing", severity="WARNING", level=level, week=week)
+    
+    # Vocabulary lookups are answered straight from the materials, without the LLM
+    with timed_stage("dictionary"):
+        dictionary_answer = answer_from_dictionary(question, materials, language)
+
+    # So are plain requests for the lesson's practice dialogues, drills and quizzes
+    lesson_content_answer = None
+    if not dictionary_answer:
+        with timed_stage("lesson_content"):
+            lesson_content_answer = lesson_contents.answer(get_firestore_client(), question, materials, gender, language)
+
+    if dictionary_answer:
+        bot_message = create_bot_message(dictionary_answer, source="dictionary")
+    elif lesson_content_answer:
+        bot_message = create_bot_message(lesson_content_answer, source="lesson_content")
+    else:
+        # Generate prompt and get bot response
+        with timed_stage("prompt_build"):
+            prompt = create_arabic_teaching_prompt(level, week, question, gender, language, materials, conversation_history,
+                                                   session.get("summary"))
+
+        try:
+            with timed_stage("llm"):
+                bot_message = call_bot(OPENAI_API_KEY.value, prompt, question, classify_question(question))
+        except Exception as e:
+            logger.error(f"Error calling bot: {str(e)}")
+            # With OpenAI unavailable, still answer whatever the materials cover
+            fallback_answer = answer_from_dictionary(question, materials, language, fallback=True)
+            if not fallback_answer and isinstance(e, LLMUnavailable):
+                return {
+                    'error': 'The tutor is temporarily unavailable',
+                    'degraded': True,
+                    'retryAfter': round(e.retry_after or LLM_RETRY_MAX_DELAY)
+                }, HTTP_STATUS["SERVICE_UNAVAILABLE"]
+            if not fallback_answer:
+                if not OPENAI_API_KEY.value:
+                    return {'error': 'Service configuration error'}, HTTP_STATUS["SERVER_ERROR"]
+                return {'error': 'Failed to generate response'}, HTTP_STATUS["SERVER_ERROR"]
+            bot_message = create_bot_message(fallback_answer, source="dictionary_fallback")
+
+    # Create user message
+    user_message = {
+        "id": f"{user_id}_{str(uuid.uuid4())}",
+        "sender": "user",
+        "text": question,
+        "timestamp": get_utc_timestamp(),
+        "isUser": True
+    }
+    
+    # Add both messages to session
+    new_messages = [user_message, bot_message]
+    with timed_stage("persistence"):
+        session = add_messages_to_session(session, new_messages)
+        
+        # Increase message count
+        increase_user_message_count(account_id, month, carried)
+
+        counters = _request_counters.get() or {}
+        record_usage(level, week, user_doc.exists and isPremium, bot_message['source'],
+                     counters.get("openaiPromptTokens", 0), counters.get("openaiCompletionTokens", 0))
+
+    log_event("ask_completed", session_id=session['_id'], message_count=len(session['messages']))
+
+    return {
+        "answer": bot_message['text'],
+        "language": language,
+        "direction": get_text_direction(language),
+        "_id": session['_id'],
+        "sessionId": session['_id'],
+        "chatSession": session,
+        "answerSource": bot_message['source'],
+        "limitWarning": limitWarning,
+        "remainingMessages": remainingMessages
+    }, HTTP_STATUS["OK"]
+
+
 @https_fn.on_request(secrets=[OPENAI_API_KEY], cors=options.CorsOptions(cors_origins=CORS_ORIGINS, cors_methods=["get", "post"]))
 def ask_user(req: https_fn.Request) -> https_fn.Response:
     try:
-        logger.info("Ask user request received")
-        # Handle health check request separately
+        start_request_context(req)
+        # Handle health check and warm-up requests separately
         if req.path == "/__/health" and req.method == "GET":
-            return https_fn.Response(json.dumps({"status": "ok"}), status=HTTP_STATUS["OK"])
+            ready = _warmup_report is not None and _warmup_report["ready"]
+            return https_fn.Response(json.dumps({"status": "ok", "ready": ready}), status=HTTP_STATUS["OK"])
+        if req.path == WARMUP_PATH and req.method == "GET":
+            return warmup_response()
 
         # Only try to parse JSON for non-health check requests
         if req.is_json:
@@ -615,109 +1548,202 @@ def ask_user(req: https_fn.Request) -> https_fn.Response:
             return https_fn.Response(json.dumps({'error': 'Question is required'}), status=HTTP_STATUS["BAD_REQUEST"])
 
         # Verify authentication
-        is_authenticated, user_id, user_email = verify_auth(req)
+        with timed_stage("auth"):
+            is_authenticated, user_id, user_email = verify_auth(req)
         if not is_authenticated:
             logger.error("Authentication failed")
             return https_fn.Response(json.dumps({'error': 'Authentication failed'}), status=HTTP_STATUS["UNAUTHORIZED"])
-        
-        # Check if user can ask questions
-        current_month = get_current_month()
-        db = get_firestore_client()
-        user_doc = db.collection('users').document(user_id).get()
-        
-        if user_doc.exists:
-            user_data = user_doc.to_dict()
-            isPremium = user_data.get('premium', {}).get(current_month, False)
-            
-            # If not premium, check message count
-            if not isPremium:
-                totalMessages = user_data.get('totalMessages', {}).get(current_month, 0)
-                
-                # If at exact limit, send a warning with the response
-                if totalMessages == MAX_MONTHLY_MESSAGES - 1:
-                    # This is their last message, warn them
-                    limitWarning = True
-                    remainingMessages = 1
-                # If over limit, return limit reached response
-                elif totalMessages >= MAX_MONTHLY_MESSAGES:
-                    logger.info(f"User {user_id} has reached message limit: {totalMessages}/{MAX_MONTHLY_MESSAGES}")
-                    return https_fn.Response(json.dumps({
-                        'error': 'Message limit reached',
-                        'maxLimitReached': True,
-                        'subscriptionUrl': '/subscription',
-                        'currentCount': totalMessages,
-                        'maxLimit': MAX_MONTHLY_MESSAGES
-                    }), status=HTTP_STATUS["FORBIDDEN"])
-                # If approaching limit (80% or more), add warning flag
-                elif totalMessages >= int(MAX_MONTHLY_MESSAGES * 0.8):
-                    limitWarning = True
-                    remainingMessages = MAX_MONTHLY_MESSAGES - totalMessages
-                else:
-                    limitWarning = False
-                    remainingMessages = MAX_MONTHLY_MESSAGES - totalMessages
-            else:
-                # Premium users don't have limits
-                limitWarning = False
-                remainingMessages = -1  # -1 indicates unlimited
-        else:
-            # New user, no warning needed
-            limitWarning = False
-            remainingMessages = MAX_MONTHLY_MESSAGES
 
-        # Validate OpenAI API key
-        if not OPENAI_API_KEY.value:
-            logger.error("OpenAI API key not available")
-            return https_fn.Response(json.dumps({'error': 'Service configuration error'}), status=HTTP_STATUS["SERVER_ERROR"])
-            
-        # Load conversation history and create a new message
-        session = load_session(user_id, user_email, level, week, gender, language)
-        conversation_history = session.get("messages", [])
-        
-        # Get materials and validate
-        materials = get_materials(level, week)
-        if not materials:
-            logger.info(f"No materials found for level: {level}, week: {week}")
-        
-        # Generate prompt and get bot response
-        prompt = create_arabic_teaching_prompt(level, week, question, gender, language, materials, conversation_history)
-        
+        # Retries carrying the same Idempotency-Key get the stored answer
+        idempotency_key = req.headers.get(IDEMPOTENCY_HEADER, '').strip()
+        if idempotency_key:
+            claimed, stored_response = claim_idempotency_key(user_id, idempotency_key)
+            if stored_response is not None:
+                log_event("ask_replayed", user_id=user_id)
+                return json_response(stored_response, req=req, headers={IDEMPOTENT_REPLAY_HEADER: "true"})
+            if not claimed:
+                return https_fn.Response(json.dumps({'error': 'A request with this idempotency key is already in progress'}), status=HTTP_STATUS["CONFLICT"])
+
         try:
-            bot_message = call_bot(OPENAI_API_KEY.value, prompt, question)
-        except Exception as e:
-            logger.error(f"Error calling bot: {str(e)}")
-            return https_fn.Response(json.dumps({'error': 'Failed to generate response'}), status=HTTP_STATUS["SERVER_ERROR"])
-
-        # Create user message
-        user_message = {
-            "id": f"{user_id}_{str(uuid.uuid4())}",
-            "sender": "user",
-            "text": question,
-            "timestamp": get_utc_timestamp(),
-            "isUser": True
-        }
-        
-        # Add both messages to session
-        new_messages = [user_message, bot_message]
-        session = add_messages_to_session(session, new_messages)
-        
-        # Increase message count
-        increase_user_message_count(user_id)
+            response_body, status = answer_question(user_id, user_email, question, week, level, gender, language)
+        except Exception:
+            if idempotency_key:
+                release_idempotency_key(user_id, idempotency_key)
+            raise
+
+        if idempotency_key:
+            if status == HTTP_STATUS["OK"]:
+                store_idempotent_response(user_id, idempotency_key, response_body)
+            else:
+                release_idempotency_key(user_id, idempotency_key)
 
-        return https_fn.Response(json.dumps({
-            "answer": bot_message['text'],
-            "language": language,
-            "direction": get_text_direction(language),
-            "_id": session['_id'],
-            "sessionId": session['_id'],
-            "chatSession": session,
-            "limitWarning": limitWarning,
-            "remainingMessages": remainingMessages
-        }), status=HTTP_STATUS["OK"])
+        return json_response(response_body, status, req=req)
     except Exception as e:
         logger.error(f"Error processing ask user request: {str(e)}", exc_info=True)
         return https_fn.Response(json.dumps({'error': "An error occurred"}), status=HTTP_STATUS["SERVER_ERROR"])
 
 
+@firestore.transactional
+def store_session_summary(transaction, session_ref, summary: str, summary_through: int) -> bool:
+    """Save the summary unless the session is gone or a newer summary got there first"""
+    snapshot = session_ref.get(transaction=transaction)
+    if not snapshot.exists or (snapshot.to_dict() or {}).get("summaryThrough", 0) >= summary_through:
+        return False
+    transaction.update(session_ref, {
+        "summary": summary,
+        "summaryThrough": summary_through,
+        "summaryUpdatedAt": get_utc_timestamp(),
+        "revision": firestore.Increment(1)
+    })
+    return True
+
+
+@firestore_fn.on_document_updated(document="chatLogs/{sessionId}", secrets=[OPENAI_API_KEY])
+def summarize_chat_session(event: firestore_fn.Event[firestore_fn.Change[firestore_fn.DocumentSnapshot]]) -> None:
+    """
+    Keep the session's rolling summary current, off the ask_user request path.
+    Runs on every chat log write and returns at once unless enough messages
+    piled up since the last summary (its own update is one of those writes).
+    """
+    session = event.data.after.to_dict() if event.data.after is not None else None
+    if not session or session.get('summarizer') == "app":
+        # app.py summarizes the sessions it marks as its own
+        return
+    summary_through = summary_target(session)
+    if summary_through is None:
+        return
+
+    session_id = event.params["sessionId"]
+    messages = session["messages"][session.get("summaryThrough", 0):summary_through]
+    try:
+        response = create_chat_completion(
+            get_openai_client(OPENAI_API_KEY.value),
+            hedge=False,
+            model=SUMMARY_MODEL,
+            messages=build_summary_request(session.get("summary"), messages),
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS
+        )
+    except Exception as e:
+        # The next message written to the session retries
+        log_event("session_summary_failed", severity="WARNING", session_id=session_id, error=str(e))
+        return
+    summary = (response.choices[0].message.content or "").strip()
+    if not summary:
+        return
+
+    db = get_firestore_client()
+    stored = store_session_summary(db.transaction(), db.collection('chatLogs').document(session_id), summary, summary_through)
+    log_event("session_summarized", session_id=session_id, summary_through=summary_through,
+              summary_chars=len(summary), stored=stored,
+              prompt_tokens=response.usage.prompt_tokens if response.usage else None)
+
+
+# Subscription expiry: requests only read users.isPremium (and its
+# subscriptionEndDate); this sweeper expires lapsed subscriptions in bulk.
+# endDate is stored as a native timestamp so the range query can use the
+# (status, endDate) index; legacy ISO strings are converted on each run.
+SUBSCRIPTION_SWEEP_SCHEDULE = os.environ.get('SUBSCRIPTION_SWEEP_SCHEDULE', 'every 15 minutes')
+SUBSCRIPTION_SWEEP_PAGE_SIZE = 200   # two writes per subscription, under the 500-write batch limit
+
+
+def convert_legacy_end_dates(db) -> int:
+    """Rewrite ISO-string endDates as timestamps; strings sort after every timestamp, so the sweep would miss them"""
+    docs = list(db.collection("subscriptions").where(filter=FieldFilter("endDate", ">=", "")).select(["endDate"]).stream())
+    converted = 0
+    for start in range(0, len(docs), SUBSCRIPTION_SWEEP_PAGE_SIZE):
+        batch, pending = db.batch(), 0
+        for doc in docs[start:start + SUBSCRIPTION_SWEEP_PAGE_SIZE]:
+            end_date = subscription_end(doc.get("endDate"))
+            if end_date is None:
+                log_event("subscription_end_date_invalid", severity="WARNING", subscription_id=doc.id)
+                continue
+            batch.update(doc.reference, {"endDate": end_date}, option=db.write_option(last_update_time=doc.update_time))
+            pending += 1
+        try:
+            if pending:
+                batch.commit()
+                converted += pending
+        except FailedPrecondition:
+            # One of them was written meanwhile; the next run converts whatever is still a string
+            log_event("subscription_end_dates_deferred", severity="WARNING", count=pending)
+    count_metric("firestoreWrites", converted)
+    return converted
+
+
+def expire_subscription_batch(db, docs: list, now: datetime) -> int:
+    """
+    Expire `docs` and clear their users' entitlement in one batch. A
+    subscription written since it was read (a renewal) fails its
+    precondition; the rest are then retried one at a time without it.
+    """
+    def add(batch, doc):
+        batch.update(doc.reference, {
+            "status": "expired",
+            "expiredAt": now,
+            "updatedAt": now.isoformat()
+        }, option=db.write_option(last_update_time=doc.update_time))
+        batch.set(db.collection("users").document(doc.id), {
+            "isPremium": False,
+            "subscriptionStatus": "expired",
+            "updatedAt": now.isoformat()
+        }, merge=True)
+
+    batch = db.batch()
+    for doc in docs:
+        add(batch, doc)
+    try:
+        batch.commit()
+        count_metric("firestoreWrites", 2 * len(docs))
+        return len(docs)
+    except FailedPrecondition:
+        expired = 0
+        for doc in docs:
+            single = db.batch()
+            add(single, doc)
+            try:
+                single.commit()
+                expired += 1
+            except FailedPrecondition:
+                log_event("subscription_renewed_during_sweep", subscription_id=doc.id)
+        count_metric("firestoreWrites", 2 * expired)
+        return expired
+
+
+def sweep_expired_subscriptions(db, now: datetime = None, page_size: int = SUBSCRIPTION_SWEEP_PAGE_SIZE) -> dict:
+    """Expire every active or trial subscription whose endDate has passed"""
+    now = now or datetime.now(timezone.utc)
+    converted = convert_legacy_end_dates(db)
+    query = db.collection("subscriptions") \
+        .where(filter=FieldFilter("status", "in", ACTIVE_SUBSCRIPTION_STATUSES)) \
+        .where(filter=FieldFilter("endDate", "<=", now)) \
+        .order_by("endDate") \
+        .order_by(FieldPath.document_id()) \
+        .select(["endDate"]) \
+        .limit(page_size)
+    expired = scanned = 0
+    last = None
+    while True:
+        docs = list((query.start_after(last) if last else query).stream())
+        count_metric("firestoreReads", max(len(docs), 1))
+        if not docs:
+            break
+        scanned += len(docs)
+        expired += expire_subscription_batch(db, docs, now)
+        if len(docs) < page_size:
+            break
+        last = docs[-1]
+    return {"expired": expired, "scanned": scanned, "converted": converted}
+
+
+@scheduler_fn.on_schedule(schedule=SUBSCRIPTION_SWEEP_SCHEDULE)
+def expire_subscriptions(event: scheduler_fn.ScheduledEvent) -> None:
+    """Scheduled sweep of lapsed subscriptions, off every request path"""
+    started = time.perf_counter()
+    result = sweep_expired_subscriptions(get_firestore_client())
+    log_event("subscriptions_swept", durationMs=round((time.perf_counter() - started) * 1000, 1), **result)
+
+
 @https_fn.on_request(cors=options.CorsOptions(
     cors_origins=CORS_ORIGINS,
     cors_methods=["get", "delete"]
@@ -729,10 +1755,14 @@ def api_chatlogs(req: https_fn.Request) -> https_fn.Response:
     - GET /api/chatlogs (list all chats with pagination/filtering)
     - GET /getChatLogs (legacy endpoint - redirects to /api/chatlogs)
     - GET /api/chatlogs/<sessionId> (get a single chat)
+    - GET /api/chatlogs/export (stream chats as NDJSON or CSV)
+    - GET /api/usage/stats (daily/monthly usage rollups)
+    - GET /api/materials (all teaching materials)
     - DELETE /api/chatlogs (delete all chats)
     - DELETE /api/chatlogs/<sessionId> (delete a single chat)
     """
     try:
+        start_request_context(req)
         path = req.path.strip("/")  # e.g. "api/chatlogs" or "api/chatlogs/abc123" or "getChatLogs"
         parts = path.split("/")  # e.g. ["api", "chatlogs"] or ["api", "chatlogs", "abc123"] or ["getChatLogs"]
 
@@ -742,11 +1772,21 @@ def api_chatlogs(req: https_fn.Request) -> https_fn.Response:
         # Handle preflight requests
         if method == "OPTIONS":
             return https_fn.Response("", status=204)
+        if req.path == WARMUP_PATH and method == "GET":
+            return warmup_response()
         
-        if req.method == "GET":
-            return handle_get_all_chatlogs(req)
+        if method == "GET" and parts[-1] == "export":
+            return handle_export_chatlogs(req)
+        if method == "GET" and parts[-2:] == ["usage", "stats"]:
+            return handle_usage_stats(req)
+        if method == "GET" and parts[-1] == "materials":
+            return handle_get_materials(req)
+        if parts[-1] not in CHAT_COLLECTION_PATHS:
+            session_id = parts[-1]
+        if method == "GET":
+            return handle_get_single_chat(session_id, req) if session_id else handle_get_all_chatlogs(req)
         if method == "DELETE":
-            return handle_delete_all_chatlogs()
+            return handle_delete_single_chat(session_id) if session_id else handle_delete_all_chatlogs()
 
         return https_fn.Response("Method Not Allowed", status=HTTP_STATUS["BAD_REQUEST"])
 
@@ -768,6 +1808,11 @@ def handle_error(e: Exception, status_code: int = HTTP_STATUS["SERVER_ERROR"]) -
         headers={"Content-Type": "application/json"}
     )
 
+# Serving instances (K_SERVICE is set by Cloud Run) warm up in the background on boot;
+# local imports and the deploy-time function discovery do not
+if WARMUP_ON_START and os.environ.get('K_SERVICE'):
+    threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+
 # Add this at the end of the file
 if __name__ == "__main__":
     from flask import Flask, jsonify
@@ -775,7 +1820,13 @@ if __name__ == "__main__":
     
     @app.route("/__/health")
     def health_check():
-        return jsonify({"status": "ok"}), 200
+        ready = _warmup_report is not None and _warmup_report["ready"]
+        return jsonify({"status": "ok", "ready": ready}), 200
+
+    @app.route(WARMUP_PATH)
+    def warmup():
+        report = warm_up()
+        return jsonify(report), 200 if report["ready"] else 503
         
     @app.route("/__/quitquitquit")
     def quitquitquit():
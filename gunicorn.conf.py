@@ -0,0 +1,77 @@
+"""
+Production serving for app.py:
+
+    gunicorn -c gunicorn.conf.py app:app
+
+/ask spends most of its time blocked on the OpenAI API, so each worker
+process runs many threads (gthread) or greenlets (gevent) rather than one
+request at a time. The app is imported once in the master and forked, so
+workers share the loaded modules copy-on-write; no Firestore RPCs happen
+before the fork and each worker opens its own connections (see
+app.init_worker).
+
+Tunables (environment):
+    PORT                          listen port (8888)
+    WEB_CONCURRENCY               worker processes (CPUs available)
+    GUNICORN_WORKER_CLASS         gthread (default) or gevent (needs `pip install gevent`)
+    GUNICORN_THREADS              threads per gthread worker (32)
+    GUNICORN_WORKER_CONNECTIONS   concurrent requests per gevent worker (256)
+    GUNICORN_TIMEOUT              seconds before a silent worker is restarted (120)
+    GUNICORN_GRACEFUL_TIMEOUT     seconds in-flight requests get on shutdown/reload (60)
+    GUNICORN_KEEPALIVE            idle keep-alive seconds (5; raise above the load balancer's)
+    GUNICORN_MAX_REQUESTS         recycle a worker after this many requests (0 = never)
+    GUNICORN_PRELOAD              "0" imports the app in each worker instead of the master
+"""
+import gc
+import os
+import sys
+
+def cpu_count():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8888')}"
+worker_class = os.getenv("GUNICORN_WORKER_CLASS", "gthread")
+workers = int(os.getenv("WEB_CONCURRENCY", str(cpu_count())))
+threads = int(os.getenv("GUNICORN_THREADS", "32"))
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", "256"))
+# gthread and gevent workers heartbeat independently of request handlers, so
+# this only catches a wedged process; slow LLM calls are not killed by it
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "60"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = max_requests // 10
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") != "0"
+
+# Heartbeat files on tmpfs; a disk-backed /tmp can stall workers in containers
+if os.path.isdir("/dev/shm"):
+    worker_tmp_dir = "/dev/shm"
+
+# app.py logs its own structured lines; gunicorn's go to stderr alongside them
+accesslog = os.getenv("GUNICORN_ACCESS_LOG") or None
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "INFO").lower()
+
+if worker_class == "gevent":
+    # Must happen before app.py (and grpc) are imported by the master
+    from gevent import monkey
+    monkey.patch_all()
+    import grpc.experimental.gevent
+    grpc.experimental.gevent.init_gevent()
+
+def when_ready(server):
+    # Objects created while preloading never change; keep the collector from
+    # touching them so their pages stay shared with the workers
+    if preload_app:
+        gc.freeze()
+    server.log.info(f"Serving with {workers} {worker_class} workers "
+                    f"({threads if worker_class == 'gthread' else worker_connections} concurrent requests each)")
+
+def post_fork(server, worker):
+    # Without preloading the app is imported later, in the worker itself
+    backend = sys.modules.get("app")
+    if backend is not None and hasattr(backend, "init_worker"):
+        backend.init_worker()
@@ -0,0 +1,133 @@
+"""
+Move the free-plan message counts out of the users' totalMessages maps and
+into per-month counter documents (users/{userId}/monthlyUsage/{YYYY-MM}).
+
+app.py keyed the map by "%m_%y" ("06_25") and the functions backend by
+"YYYY-M" ("2025-6"). Both are folded into the canonical "2025-06" and
+summed. A month that already has a counter document is left alone. The
+backends create that document carrying the legacy count, so it already
+includes the map.
+
+Each user is migrated in one transaction that also deletes the map. The
+job is idempotent and safe to run while the backends are serving.
+
+Usage:
+    python migrate_monthly_usage.py --dry-run
+    python migrate_monthly_usage.py
+"""
+import re
+import argparse
+from datetime import datetime, timezone, timedelta
+
+from firebase_admin import firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from seed_data import initialize_firebase
+
+USERS_COLLECTION = 'users'
+MONTHLY_USAGE_COLLECTION = 'monthlyUsage'
+RETENTION_DAYS = 400          # same default as MONTHLY_USAGE_RETENTION_DAYS in the backends
+PAGE_SIZE = 200
+
+def canonical_month(key):
+    """'06_25' (app.py) or '2025-6' (functions) -> '2025-06'; None for anything else"""
+    match = re.fullmatch(r'(\d{1,2})_(\d{2})', key)
+    if match:
+        year, month = 2000 + int(match.group(2)), int(match.group(1))
+    else:
+        match = re.fullmatch(r'(\d{4})-(\d{1,2})', key)
+        if not match:
+            return None
+        year, month = int(match.group(1)), int(match.group(2))
+    return f"{year}-{month:02d}" if 1 <= month <= 12 else None
+
+def merge_legacy(total_messages):
+    """({canonical month: messages}, unrecognised keys) from a legacy map"""
+    months, unknown = {}, []
+    for key, value in (total_messages or {}).items():
+        month = canonical_month(str(key))
+        if month is None:
+            unknown.append(key)
+            continue
+        months[month] = months.get(month, 0) + int(value or 0)
+    return months, unknown
+
+def month_expiry(month, retention):
+    """A past month expires `retention` after it ended"""
+    year, number = int(month[:4]), int(month[5:])
+    return datetime(year + number // 12, number % 12 + 1, 1, tzinfo=timezone.utc) + retention
+
+def iter_legacy_users(db, page_size=PAGE_SIZE):
+    """(user reference, totalMessages map) for users that still have a non-empty map"""
+    query = db.collection(USERS_COLLECTION) \
+        .select(["totalMessages"]) \
+        .order_by(FieldPath.document_id()) \
+        .limit(page_size)
+    last_id = None
+    while True:
+        page = query.start_after({FieldPath.document_id(): last_id}) if last_id else query
+        docs = list(page.stream())
+        for doc in docs:
+            total_messages = (doc.to_dict() or {}).get("totalMessages")
+            if total_messages:
+                yield doc.reference, total_messages
+        if len(docs) < page_size:
+            return
+        last_id = docs[-1].id
+
+@firestore.transactional
+def migrate_user(transaction, user_ref, retention):
+    """Create the user's missing month documents and drop the map; returns the months created"""
+    snapshot = user_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return []
+    months, _ = merge_legacy((snapshot.to_dict() or {}).get("totalMessages"))
+    usage = user_ref.collection(MONTHLY_USAGE_COLLECTION)
+    # Every read comes before the first write in a transaction
+    missing = sorted(month for month, count in months.items()
+                     if count and not usage.document(month).get(transaction=transaction).exists)
+    now = datetime.now(timezone.utc)
+    for month in missing:
+        transaction.set(usage.document(month), {
+            "month": month,
+            "messages": months[month],
+            "migratedAt": now.isoformat(),
+            "updatedAt": now.isoformat(),
+            "expiresAt": month_expiry(month, retention),
+        })
+    transaction.update(user_ref, {"totalMessages": firestore.DELETE_FIELD})
+    return missing
+
+def main():
+    parser = argparse.ArgumentParser(description="Move totalMessages maps into per-month usage documents")
+    parser.add_argument("--credentials", default="serviceAccountKey.json")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--retention-days", type=int, default=RETENTION_DAYS,
+                        help="keep a month's document this long after the month ends")
+    parser.add_argument("--dry-run", action="store_true", help="report what would be migrated without writing")
+    args = parser.parse_args()
+
+    initialize_firebase(args.credentials)
+    db = firestore.client()
+    retention = timedelta(days=args.retention_days)
+
+    users = months_created = 0
+    for user_ref, total_messages in iter_legacy_users(db, args.page_size):
+        users += 1
+        months, unknown = merge_legacy(total_messages)
+        if unknown:
+            print(f"⚠️ {user_ref.id}: dropping unrecognised month keys {unknown}")
+        if args.dry_run:
+            months_created += sum(1 for count in months.values() if count)
+            continue
+        months_created += len(migrate_user(db.transaction(), user_ref, retention))
+        if users % 100 == 0:
+            print(f"   ... {users} users")
+
+    if args.dry_run:
+        print(f"🔎 Dry run: {users} users with a totalMessages map, up to {months_created} month documents to create")
+        return
+    print(f"✅ Migrated {users} users, created {months_created} month documents")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+Give every user one canonical users/ document and index all of its IDs.
+
+Users were stored under up to three IDs: the Firebase uid (functions
+backend, payment webhook, frontend), the base64 email (app.py) and the raw
+email. This job groups the user documents by email. Each group is merged
+into the document keyed by the user's Firebase uid, which is looked up in
+Firebase Auth when no uid document exists yet. Without an Auth account the
+email-based document already in use is kept.
+
+Merging ORs the premium flags, keeps the latest subscription end date, sums
+the monthly usage counters and the legacy totalMessages map, and moves the
+subscription document with the latest endDate to the canonical ID. Then
+userAliases/{uid|email|encoded}:{value} is written for each ID. Merged
+documents are marked with mergedInto and skipped on later runs, so the job
+is idempotent. Run it before deploying backends that read userAliases; they
+register users first seen afterwards themselves.
+
+Usage:
+    python migrate_user_aliases.py --dry-run
+    python migrate_user_aliases.py
+"""
+import base64
+import os
+import sys
+import argparse
+from datetime import datetime, timezone
+
+from firebase_admin import auth, firestore
+from google.cloud.firestore_v1.field_path import FieldPath
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "functions"))
+from chat_core import encode_email, user_alias_id
+from seed_data import MAX_BATCH_SIZE, initialize_firebase
+
+USERS_COLLECTION = 'users'
+SUBSCRIPTIONS_COLLECTION = 'subscriptions'
+MONTHLY_USAGE_COLLECTION = 'monthlyUsage'
+USER_ALIASES_COLLECTION = 'userAliases'
+ENTITLEMENT_FIELDS = ("isPremium", "subscriptionStatus", "subscriptionEndDate")
+PAGE_SIZE = 200
+AUTH_LOOKUP_SIZE = 100        # get_users() limit
+
+def email_from_id(doc_id):
+    """The email behind a raw-email or base64-email document ID, or None for a uid"""
+    if '@' in doc_id:
+        return doc_id
+    try:
+        decoded = base64.urlsafe_b64decode(doc_id.encode()).decode()
+    except (ValueError, UnicodeDecodeError):
+        return None
+    return decoded if '@' in decoded and encode_email(decoded) == doc_id else None
+
+def end_date(value):
+    """Comparable aware datetime for a stored end date (timestamp or ISO string)"""
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    try:
+        parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return datetime.min.replace(tzinfo=timezone.utc)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def load_identities(db, page_size=PAGE_SIZE):
+    """{email or 'uid:<id>': [(doc_id, email, is_uid)]} for users not merged yet"""
+    query = db.collection(USERS_COLLECTION) \
+        .select(["email", "mergedInto"]) \
+        .order_by(FieldPath.document_id()) \
+        .limit(page_size)
+    groups, last_id = {}, None
+    while True:
+        page = query.start_after({FieldPath.document_id(): last_id}) if last_id else query
+        docs = list(page.stream())
+        for doc in docs:
+            data = doc.to_dict() or {}
+            if data.get("mergedInto"):
+                continue
+            id_email = email_from_id(doc.id)
+            email = (data.get("email") or id_email or "").strip().lower()
+            groups.setdefault(email or f"uid:{doc.id}", []).append((doc.id, email, id_email is None))
+        if len(docs) < page_size:
+            return groups
+        last_id = docs[-1].id
+
+def lookup_uids(emails):
+    """{email: Firebase uid} for the emails that have an Auth account"""
+    uids = {}
+    for start in range(0, len(emails), AUTH_LOOKUP_SIZE):
+        result = auth.get_users([auth.EmailIdentifier(email) for email in emails[start:start + AUTH_LOOKUP_SIZE]])
+        uids.update({user.email.lower(): user.uid for user in result.users if user.email})
+    return uids
+
+def choose_canonical(email, members, auth_uids):
+    """Canonical ID for a group: the Auth uid, its uid document, else the email-based ID in use"""
+    if auth_uids.get(email):
+        return auth_uids[email]
+    ids = [doc_id for doc_id, _, _ in members]
+    uid_members = [doc_id for doc_id, _, is_uid in members if is_uid]
+    if uid_members:
+        return uid_members[0]
+    return encode_email(email) if email and encode_email(email) in ids else ids[0]
+
+def merge_user_data(canonical_data, duplicates):
+    """The canonical user document with the duplicates' fields folded in"""
+    documents = [canonical_data] + duplicates
+    merged = dict(canonical_data)
+    for data in duplicates:
+        for key, value in data.items():
+            merged.setdefault(key, value)
+    premium = {month: True for data in documents for month, flag in (data.get("premium") or {}).items() if flag}
+    if premium:
+        merged["premium"] = premium
+    legacy = {}
+    for data in documents:
+        for key, value in (data.get("totalMessages") or {}).items():
+            legacy[key] = legacy.get(key, 0) + int(value or 0)
+    if legacy:
+        merged["totalMessages"] = legacy
+    entitled = [data for data in documents if data.get("isPremium")]
+    if entitled:
+        latest = max(entitled, key=lambda data: end_date(data.get("subscriptionEndDate")))
+        merged.update({field: latest[field] for field in ENTITLEMENT_FIELDS if field in latest})
+    return merged
+
+def merge_group(db, canonical, email, member_ids):
+    """Writes that fold the users in `member_ids` into users/{canonical}"""
+    users = db.collection(USERS_COLLECTION)
+    subscriptions = db.collection(SUBSCRIPTIONS_COLLECTION)
+    ids = [canonical] + [doc_id for doc_id in member_ids if doc_id != canonical]
+    user_docs = {snapshot.id: snapshot for snapshot in db.get_all([users.document(doc_id) for doc_id in ids])}
+    sub_docs = {snapshot.id: snapshot for snapshot in db.get_all([subscriptions.document(doc_id) for doc_id in ids])}
+    duplicate_ids = [doc_id for doc_id in ids[1:] if user_docs[doc_id].exists]
+    now = datetime.now(timezone.utc).isoformat()
+
+    canonical_data = (user_docs[canonical].to_dict() or {}) if user_docs[canonical].exists else {"createdAt": now}
+    merged = merge_user_data(canonical_data, [user_docs[doc_id].to_dict() or {} for doc_id in duplicate_ids])
+    merged.update({"userId": canonical, "email": merged.get("email") or email, "updatedAt": now})
+    writes = [("replace", users.document(canonical), merged)]
+    for doc_id in duplicate_ids:
+        for usage in users.document(doc_id).collection(MONTHLY_USAGE_COLLECTION).stream():
+            counts = usage.to_dict() or {}
+            writes.append(("set", users.document(canonical).collection(MONTHLY_USAGE_COLLECTION).document(usage.id), dict(
+                counts, messages=firestore.Increment(int(counts.get("messages") or 0)),
+            )))
+        writes.append(("set", users.document(doc_id), {"mergedInto": canonical, "updatedAt": now}))
+
+    # The subscription with the latest end date moves to the canonical ID
+    existing = [doc_id for doc_id in ids if sub_docs[doc_id].exists]
+    if existing:
+        latest = max(existing, key=lambda doc_id: end_date((sub_docs[doc_id].to_dict() or {}).get("endDate")))
+        if latest != canonical:
+            writes.append(("replace", subscriptions.document(canonical), dict(sub_docs[latest].to_dict(), userId=canonical)))
+        writes += [("delete", subscriptions.document(doc_id), None) for doc_id in existing if doc_id != canonical]
+    return writes
+
+def alias_writes(db, canonical, email, member_ids):
+    aliases = db.collection(USER_ALIASES_COLLECTION)
+    keys = {user_alias_id("uid", doc_id) for doc_id in [canonical] + member_ids if email_from_id(doc_id) is None}
+    if email:
+        keys |= {user_alias_id("email", email), user_alias_id("encoded", encode_email(email))}
+    now = datetime.now(timezone.utc).isoformat()
+    return [("replace", aliases.document(key), {"userId": canonical, "updatedAt": now}) for key in sorted(keys)]
+
+def commit(db, writes):
+    for start in range(0, len(writes), MAX_BATCH_SIZE):
+        batch = db.batch()
+        for operation, doc_ref, data in writes[start:start + MAX_BATCH_SIZE]:
+            if operation == "delete":
+                batch.delete(doc_ref)
+            else:
+                batch.set(doc_ref, data, merge=operation == "set")
+        batch.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge duplicate user documents and write the userAliases index")
+    parser.add_argument("--credentials", default="serviceAccountKey.json")
+    parser.add_argument("--page-size", type=int, default=PAGE_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="report what would be merged without writing")
+    args = parser.parse_args()
+
+    initialize_firebase(args.credentials)
+    db = firestore.client()
+
+    groups = load_identities(db, args.page_size)
+    auth_uids = lookup_uids(sorted(key for key in groups if not key.startswith("uid:")))
+    print(f"👥 {sum(len(members) for members in groups.values())} user documents, {len(groups)} users")
+
+    merged_users = duplicates = 0
+    pending = []
+    for key, members in groups.items():
+        email = "" if key.startswith("uid:") else key
+        canonical = choose_canonical(email, members, auth_uids)
+        member_ids = [doc_id for doc_id, _, _ in members]
+        writes = []
+        if len(member_ids) > 1 or canonical not in member_ids:
+            merged_users += 1
+            duplicates += len([doc_id for doc_id in member_ids if doc_id != canonical])
+            print(f"🔀 {email or canonical}: {', '.join(member_ids)} -> {canonical}")
+            if not args.dry_run:
+                writes = merge_group(db, canonical, email, member_ids)
+        if args.dry_run:
+            continue
+        writes += alias_writes(db, canonical, email, member_ids)
+        # A user's writes share a commit, so an interrupted run never merges a user twice
+        if len(pending) + len(writes) > MAX_BATCH_SIZE:
+            commit(db, pending)
+            pending = []
+        pending += writes
+    if pending:
+        commit(db, pending)
+
+    if args.dry_run:
+        print(f"🔎 Dry run: {merged_users} users to merge ({duplicates} duplicate documents), {len(groups)} to index")
+        return
+    print(f"✅ Merged {duplicates} duplicate documents into {merged_users} users, indexed {len(groups)} users")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Pre-generate the lesson content that the backends serve without calling OpenAI.
+
+For every published lesson (materialsMeta/current) and every gender and
+language variant, this asks OpenAI for a few practice dialogues, vocabulary
+drills and quizzes built only from the lesson's materials. Each result is
+stored in lessonContent/{lessonKey}_{gender}_{language}.
+
+Every document records the lesson bundle's contentHash. The backends serve
+a document only while that hash matches the published bundle. Re-running
+the job regenerates only lessons whose materials changed, and it removes
+content for lessons that are no longer published. Run it after publishing
+materials (seed_data.py), or leave it running with --watch.
+
+Usage:
+    python pregenerate_lesson_content.py --dry-run
+    python pregenerate_lesson_content.py
+    python pregenerate_lesson_content.py --lessons beginner_week_01 --force
+    python pregenerate_lesson_content.py --watch --interval 300
+"""
+import os
+import time
+import random
+import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+from firebase_admin import firestore
+
+from seed_data import (
+    MATERIALS_COLLECTION, MATERIALS_META_COLLECTION, MATERIALS_META_DOC, MATERIAL_BUNDLES_COLLECTION,
+    MAX_BATCH_SIZE, load_lessons, initialize_firebase
+)
+
+LESSON_CONTENT_COLLECTION = 'lessonContent'
+GENDERS = ("male", "female")
+# The language variants the tutor prompt distinguishes; anything else is "hebrew"
+LANGUAGE_GUIDANCE = {
+    "arabic": "Respond primarily in Arabic script with minimal explanations in Hebrew.",
+    "transliteration-hebrew": "Provide Arabic responses in Hebrew characters, plus short Hebrew explanations.",
+    "transliteration-english": "Provide Arabic responses with English transliteration, plus Hebrew explanations.",
+    "hebrew": "Provide main responses in Hebrew, with Arabic phrases in both script and Hebrew transliteration.",
+}
+KIND_TASKS = {
+    "dialogue": "Write a short practice dialogue (6 to 10 lines) between two speakers, followed by a Hebrew translation of each line and one follow-up question for the student.",
+    "drill": "Write a vocabulary drill of 8 to 10 items: each gives a Hebrew word or phrase and asks for the Levantine Arabic. List the answers, with Hebrew transliteration, after all the items.",
+    "quiz": "Write a 5-question multiple-choice quiz (4 options each) on the lesson's vocabulary and phrases. Put the answer key at the end.",
+}
+MATERIAL_COLUMNS = ("hebrew_input", "arabic_response", "pronunciation")
+DEFAULT_MODEL = 'gpt-4-turbo'
+DEFAULT_VARIANTS = 2
+
+def material_cell(value):
+    return " ".join(str(value or "").split())
+
+def build_messages(level, week, gender, language, items, kind):
+    rows = "\n".join("\t".join(material_cell(item.get(field)) for field in MATERIAL_COLUMNS) for item in items)
+    system = f"""You are 'Laith', an expert Levantine Arabic dialect tutor preparing material for a student.
+Student profile: level {level}, week {week}, {gender}.
+Use ONLY the vocabulary and phrases in these materials (tab-separated: Hebrew, Levantine Arabic, Hebrew transliteration):
+{rows}
+Use EXCLUSIVELY Levantine dialect, never MSA. Include Hebrew transliteration for every Arabic word. Use {gender} forms when addressing the student.
+{LANGUAGE_GUIDANCE[language]}"""
+    return [{"role": "system", "content": system}, {"role": "user", "content": KIND_TASKS[kind]}]
+
+def published_lessons(db):
+    """(materials version, lesson_key -> content hash) from materialsMeta/current"""
+    meta = db.collection(MATERIALS_META_COLLECTION).document(MATERIALS_META_DOC).get()
+    meta = (meta.to_dict() or {}) if meta.exists else {}
+    hashes = {key: value for key, value in (meta.get('lessons') or {}).items() if isinstance(value, str)}
+    return meta.get('version'), hashes
+
+def lesson_items(db, lesson_key):
+    """A lesson's materials from its bundle, or the materials collection if it has none"""
+    bundle = db.collection(MATERIAL_BUNDLES_COLLECTION).document(lesson_key).get()
+    if bundle.exists:
+        return (bundle.to_dict() or {}).get('items') or []
+    return load_lessons(db.collection(MATERIALS_COLLECTION), {lesson_key}).get(lesson_key, [])
+
+def stored_hashes(db):
+    """doc_id -> (lessonKey, contentHash) of the stored lesson content, via a projection query"""
+    return {
+        snapshot.id: ((snapshot.to_dict() or {}).get('lessonKey'), (snapshot.to_dict() or {}).get('contentHash'))
+        for snapshot in db.collection(LESSON_CONTENT_COLLECTION).select(['lessonKey', 'contentHash']).stream()
+    }
+
+def content_doc_id(lesson_key, gender, language):
+    return f"{lesson_key}_{gender}_{language}"
+
+def generate_variant(client, model, level, week, gender, language, items, kind):
+    """One piece of content, retried a few times on transient errors"""
+    for attempt in range(4):
+        try:
+            response = client.chat.completions.create(
+                model=model,
+                messages=build_messages(level, week, gender, language, items, kind),
+                temperature=0.8,
+                max_tokens=1200
+            )
+            return (response.choices[0].message.content or "").strip()
+        except Exception as e:
+            if attempt == 3:
+                raise
+            delay = random.uniform(0, 2 ** attempt)
+            print(f"⚠️ {kind} for {level} week {week} failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+def generate_document(client, model, variants, version, lesson_key, content_hash, items, gender, language):
+    level, week = lesson_key.split('_week_', 1)
+    contents = {
+        kind: [text for text in (generate_variant(client, model, level, week, gender, language, items, kind)
+                                 for _ in range(variants)) if text]
+        for kind in KIND_TASKS
+    }
+    return content_doc_id(lesson_key, gender, language), {
+        "lessonKey": lesson_key,
+        "level": level,
+        "week": week,
+        "gender": gender,
+        "language": language,
+        "contentHash": content_hash,
+        "materialsVersion": version,
+        "model": model,
+        "contents": contents,
+        "generatedAt": datetime.now(timezone.utc).isoformat(),
+    }
+
+def pregenerate(db, client, model=DEFAULT_MODEL, variants=DEFAULT_VARIANTS, lesson_keys=None, force=False,
+                dry_run=False, workers=4):
+    """Regenerate stale lesson content; returns (documents written, documents removed)"""
+    version, hashes = published_lessons(db)
+    stored = stored_hashes(db)
+    wanted = {
+        content_doc_id(key, gender, language): (key, content_hash, gender, language)
+        for key, content_hash in hashes.items()
+        if lesson_keys is None or key in lesson_keys
+        for gender in GENDERS
+        for language in LANGUAGE_GUIDANCE
+    }
+    stale = {doc_id: spec for doc_id, spec in wanted.items() if force or stored.get(doc_id, (None, None))[1] != spec[1]}
+    retired = sorted(doc_id for doc_id, (key, _) in stored.items() if key not in hashes) if lesson_keys is None else []
+    stale_lessons = sorted({key for key, _, _, _ in stale.values()})
+    print(f"📚 Materials version {version}: {len(hashes)} published lessons, {len(stale)} of {len(wanted)} "
+          f"content documents to generate ({len(stale_lessons)} lessons), {len(retired)} to remove")
+    if dry_run or (not stale and not retired):
+        return 0, 0
+
+    items_by_lesson = {key: lesson_items(db, key) for key in stale_lessons}
+    collection = db.collection(LESSON_CONTENT_COLLECTION)
+    written = 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [
+            pool.submit(generate_document, client, model, variants, version, key, content_hash,
+                        items_by_lesson[key], gender, language)
+            for key, content_hash, gender, language in stale.values()
+            if items_by_lesson[key]
+        ]
+        for future in futures:
+            doc_id, data = future.result()
+            collection.document(doc_id).set(data)
+            written += 1
+            if written % 10 == 0:
+                print(f"   ... {written}/{len(futures)} documents")
+
+    for start in range(0, len(retired), MAX_BATCH_SIZE):
+        batch = db.batch()
+        for doc_id in retired[start:start + MAX_BATCH_SIZE]:
+            batch.delete(collection.document(doc_id))
+        batch.commit()
+    return written, len(retired)
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate dialogues, drills and quizzes for every published lesson")
+    parser.add_argument("--credentials", default="serviceAccountKey.json")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--variants", type=int, default=DEFAULT_VARIANTS, help="pieces of content per kind and variant")
+    parser.add_argument("--lessons", help="comma-separated lesson keys (default: every published lesson)")
+    parser.add_argument("--force", action="store_true", help="regenerate even if the materials did not change")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--dry-run", action="store_true", help="report what would be generated")
+    parser.add_argument("--watch", action="store_true", help="keep running and regenerate when the materials version changes")
+    parser.add_argument("--interval", type=float, default=300, help="seconds between version checks with --watch")
+    args = parser.parse_args()
+
+    initialize_firebase(args.credentials)
+    db = firestore.client()
+    client = None
+    if not args.dry_run:
+        from openai import OpenAI
+        api_key = os.getenv("OPENAI_KEY") or os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise SystemExit("❌ Set OPENAI_KEY (or OPENAI_API_KEY) to generate content")
+        client = OpenAI(api_key=api_key)
+    lesson_keys = set(args.lessons.split(",")) if args.lessons else None
+
+    last_version = object()
+    while True:
+        version, _ = published_lessons(db)
+        if version != last_version:
+            written, removed = pregenerate(db, client, args.model, args.variants, lesson_keys, args.force,
+                                           args.dry_run, args.workers)
+            if written or removed:
+                print(f"✅ Wrote {written} lesson content documents, removed {removed}")
+            last_version = version
+        if not args.watch:
+            return
+        time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
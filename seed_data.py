@@ -1,5 +1,10 @@
 import os
 import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import firebase_admin
 from firebase_admin import credentials, firestore
 from dotenv import load_dotenv
@@ -7,34 +12,358 @@ from dotenv import load_dotenv
 # Load environment variables (if any)
 load_dotenv()
 
-def initialize_firebase():
+MATERIALS_FILE = 'data_files/materials_data_set.json'
+MATERIALS_COLLECTION = 'materials'
+MATERIALS_META_COLLECTION = 'materialsMeta'
+MATERIALS_META_DOC = 'current'
+MATERIAL_BUNDLES_COLLECTION = 'materialBundles'
+MAX_BUNDLE_BYTES = 900_000    # stay under Firestore's 1 MiB document limit
+HASH_FIELD = 'content_hash'
+MAX_BATCH_SIZE = 500          # Firestore limit on writes per commit
+STREAM_CHUNK_SIZE = 1 << 16   # characters read per chunk while parsing
+MAX_WRITE_ATTEMPTS = 5
+
+def initialize_firebase(credentials_path="serviceAccountKey.json"):
     if not firebase_admin._apps:
-        cred = credentials.Certificate("serviceAccountKey.json")
-        firebase_admin.initialize_app(cred)
+        if os.getenv("FIRESTORE_EMULATOR_HOST"):
+            # The emulator accepts any project and needs no credentials
+            project_id = os.getenv("GOOGLE_CLOUD_PROJECT", "demo-arabicchatbot")
+            firebase_admin.initialize_app(options={"projectId": project_id})
+        else:
+            cred = credentials.Certificate(credentials_path)
+            firebase_admin.initialize_app(cred)
         print("✅ Firebase initialized.")
 
-def seed_database():
+# -------------------------
+# Streaming input
+# -------------------------
+def iter_materials(path, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Yield material objects from a JSON array file (or JSON Lines for *.jsonl)
+    without loading the whole file, so large curricula stay within memory.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        if path.endswith('.jsonl'):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer, pos, started = "", 0, False
+        while True:
+            chunk = file.read(chunk_size)
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos >= len(buffer):
+                    break
+                if not started:
+                    if buffer[pos] != '[':
+                        raise ValueError(f"{path}: expected a JSON array of materials")
+                    started = True
+                    pos += 1
+                    continue
+                if buffer[pos] == ']':
+                    return
+                try:
+                    item, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if not chunk:
+                        raise
+                    break  # item continues in the next chunk
+                yield item
+            if not chunk:
+                raise ValueError(f"{path}: unexpected end of file (missing ']')")
+
+# -------------------------
+# Diffing
+# -------------------------
+def content_hash(item):
+    """Stable hash of a material's fields (excluding the stored hash itself)"""
+    payload = {key: value for key, value in item.items() if key != HASH_FIELD}
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def load_existing_hashes(collection):
+    """doc_id -> stored content hash, via a projection query that skips document bodies"""
+    return {
+        snapshot.id: (snapshot.to_dict() or {}).get(HASH_FIELD)
+        for snapshot in collection.select([HASH_FIELD]).stream()
+    }
+
+# -------------------------
+# Publishing (per-lesson bundles + version document read by the backends)
+# -------------------------
+def lesson_key_for(doc_id):
+    """'beginner_week_01_003' -> 'beginner_week_01'"""
+    return doc_id.rsplit('_', 1)[0]
+
+def bundle_hash(items):
+    """Hash of a lesson bundle; matches the one computed by the upload page"""
+    canonical = json.dumps(items, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+def load_lessons(collection, lesson_keys=None):
+    """lesson_key -> materials sorted by id (without stored hashes), for lesson_keys or every lesson"""
+    if lesson_keys is None:
+        snapshots = collection.stream()
+    else:
+        snapshots = (
+            snapshot
+            for key in sorted(lesson_keys)
+            for snapshot in collection
+                .where(filter=firestore.FieldFilter("id", ">=", key))
+                .where(filter=firestore.FieldFilter("id", "<", key + "_z"))
+                .stream()
+        )
+    lessons = {}
+    for snapshot in snapshots:
+        item = {k: v for k, v in (snapshot.to_dict() or {}).items() if k != HASH_FIELD}
+        key = lesson_key_for(item.get('id', snapshot.id))
+        if lesson_keys is None or key in lesson_keys:
+            lessons.setdefault(key, []).append(item)
+    for items in lessons.values():
+        items.sort(key=lambda item: item.get('id', ''))
+    return lessons
+
+def publish_materials(db, lesson_keys=None, collection_name=MATERIALS_COLLECTION):
+    """
+    Rebuild the bundles of lesson_keys (every lesson when None) and bump
+    materialsMeta/current so serving processes reload exactly those lessons.
+    """
+    meta_ref = db.collection(MATERIALS_META_COLLECTION).document(MATERIALS_META_DOC)
+    lessons = load_lessons(db.collection(collection_name), lesson_keys)
+    if lesson_keys is None:
+        # A full publish also retires bundles of lessons that no longer exist
+        published = ((meta_ref.get().to_dict() or {}).get('lessons') or {}).keys()
+        lesson_keys = set(lessons) | set(published)
+
+    bundles = db.collection(MATERIAL_BUNDLES_COLLECTION)
+    hashes = {}
+    batch, pending = db.batch(), 0
+    for key in sorted(lesson_keys):
+        items = lessons.get(key)
+        size = len(json.dumps(items, ensure_ascii=False).encode('utf-8')) if items else 0
+        if items and size <= MAX_BUNDLE_BYTES:
+            hashes[key] = bundle_hash(items)
+            batch.set(bundles.document(key), {
+                "lessonKey": key,
+                "contentHash": hashes[key],
+                "count": len(items),
+                "items": items,
+                "updatedAt": firestore.SERVER_TIMESTAMP,
+            })
+        else:
+            if items:
+                print(f"⚠️ Lesson {key} is too large for a bundle ({size} bytes); it will be queried directly")
+            hashes[key] = firestore.DELETE_FIELD
+            batch.delete(bundles.document(key))
+        pending += 1
+        if pending >= MAX_BATCH_SIZE:
+            batch.commit()
+            batch, pending = db.batch(), 0
+    if pending:
+        batch.commit()
+
+    # Bundles are written first, so a process seeing the new version always finds them
+    meta_ref.set({
+        "version": firestore.Increment(1),
+        "lessons": hashes,
+        "updatedAt": firestore.SERVER_TIMESTAMP,
+    }, merge=True)
+    version = (meta_ref.get().to_dict() or {}).get('version')
+    print(f"📦 Published {len(hashes)} lesson bundles; materials version is now {version}")
+    return version
+
+# -------------------------
+# Writers
+# -------------------------
+class BatchedWriter:
+    """Groups writes into commits of `batch_size`, with at most `workers` commits in flight"""
+    def __init__(self, db, batch_size=MAX_BATCH_SIZE, workers=4):
+        self._db = db
+        self._batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(workers * 2)
+        self._batch = db.batch()
+        self._pending = 0
+        self._futures = []
+
+    def set(self, reference, data):
+        self._batch.set(reference, data)
+        self._added()
+
+    def delete(self, reference):
+        self._batch.delete(reference)
+        self._added()
+
+    def _added(self):
+        self._pending += 1
+        if self._pending >= self._batch_size:
+            self._submit()
+
+    def _submit(self):
+        batch, self._batch, self._pending = self._batch, self._db.batch(), 0
+        # Blocks the reader when enough commits are queued, bounding memory
+        self._slots.acquire()
+        self._futures.append(self._pool.submit(self._commit, batch))
+
+    def _commit(self, batch):
+        try:
+            for attempt in range(1, MAX_WRITE_ATTEMPTS + 1):
+                try:
+                    batch.commit()
+                    return
+                except Exception as e:
+                    if attempt == MAX_WRITE_ATTEMPTS:
+                        raise
+                    print(f"⚠️ Batch commit failed ({e}); retrying ({attempt}/{MAX_WRITE_ATTEMPTS})")
+                    time.sleep(0.5 * 2 ** attempt)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        if self._pending:
+            self._submit()
+        self._pool.shutdown(wait=True)
+        for future in self._futures:
+            future.result()
+
+def create_bulk_writer(db, max_ops_per_second, failures):
+    """Firestore BulkWriter with rate limiting and bounded retries; failures are collected"""
+    from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions
+    writer = db.bulk_writer(options=BulkWriterOptions(
+        initial_ops_per_second=min(500, max_ops_per_second),
+        max_ops_per_second=max_ops_per_second,
+    ))
+
+    def on_write_error(failure, bulk_writer):
+        if failure.attempts < MAX_WRITE_ATTEMPTS:
+            return True
+        failures.append(f"{failure.operation.reference.id}: {failure.message}")
+        return False
+
+    writer.on_write_error(on_write_error)
+    return writer
+
+# -------------------------
+# Progress
+# -------------------------
+class Progress:
+    """Prints a status line every `every` items"""
+    def __init__(self, every=1000):
+        self.every = every
+        self.started = time.perf_counter()
+        self.counts = {"read": 0, "created": 0, "updated": 0, "unchanged": 0, "deleted": 0}
+
+    def add(self, key):
+        self.counts[key] += 1
+        if key == "read" and self.every and self.counts["read"] % self.every == 0:
+            self.print("⏳")
+
+    def print(self, prefix):
+        elapsed = time.perf_counter() - self.started
+        rate = self.counts["read"] / elapsed if elapsed else 0
+        print(f"{prefix} {self.counts['read']} read · {self.counts['created']} new · "
+              f"{self.counts['updated']} changed · {self.counts['unchanged']} unchanged · "
+              f"{self.counts['deleted']} deleted · {elapsed:.1f}s ({rate:,.0f} items/s)")
+
+# -------------------------
+# Materials sync
+# -------------------------
+def sync_materials(db, path=MATERIALS_FILE, collection_name=MATERIALS_COLLECTION, dry_run=False,
+                   prune=False, force=False, writer="bulk", batch_size=MAX_BATCH_SIZE, workers=4,
+                   max_ops_per_second=2000, progress_every=1000, publish=True):
+    """
+    Bring the materials collection in line with `path`, writing only
+    documents whose content hash changed (or every document with force).
+    With prune, documents missing from the file are deleted. Lessons that
+    changed are then republished (all of them if nothing was published yet).
+    Returns the counts per outcome.
+    """
+    collection = db.collection(collection_name)
+    existing = load_existing_hashes(collection)
+    print(f"📚 {len(existing)} existing documents in '{collection_name}'")
+
+    failures = []
+    sink = None
+    if not dry_run:
+        if writer == "bulk":
+            sink = create_bulk_writer(db, max_ops_per_second, failures)
+        else:
+            sink = BatchedWriter(db, batch_size=batch_size, workers=workers)
+
+    progress = Progress(progress_every)
+    seen = set()
+    changed_lessons = set()
+    for item in iter_materials(path):
+        doc_id = item.get('id')
+        if not doc_id:
+            raise ValueError(f"Material without an 'id': {item}")
+        if doc_id in seen:
+            print(f"⚠️ Duplicate material ID {doc_id}; the last occurrence wins")
+        seen.add(doc_id)
+        progress.add("read")
+
+        digest = content_hash(item)
+        stored = existing.get(doc_id, False)
+        if stored == digest and not force:
+            progress.add("unchanged")
+            continue
+        progress.add("created" if stored is False else "updated")
+        changed_lessons.add(lesson_key_for(doc_id))
+        if dry_run:
+            continue
+        sink.set(collection.document(doc_id), dict(item, **{HASH_FIELD: digest}))
+
+    if prune:
+        for doc_id in existing.keys() - seen:
+            progress.add("deleted")
+            changed_lessons.add(lesson_key_for(doc_id))
+            if not dry_run:
+                sink.delete(collection.document(doc_id))
+
+    if sink is not None:
+        sink.close()
+    progress.print("🧪 Dry run:" if dry_run else "🎉 Materials sync complete:")
+    if failures:
+        for failure in failures[:10]:
+            print(f"❌ {failure}")
+        raise RuntimeError(f"{len(failures)} material writes failed")
+
+    if publish:
+        meta = db.collection(MATERIALS_META_COLLECTION).document(MATERIALS_META_DOC).get()
+        lesson_keys = changed_lessons if meta.exists else None
+        if dry_run:
+            print(f"🧪 Would republish {'all' if lesson_keys is None else len(lesson_keys)} lessons")
+        elif lesson_keys is None or lesson_keys:
+            publish_materials(db, lesson_keys, collection_name)
+    return progress.counts
+
+def seed_database(args=None):
+    args = args or parse_args([])
     try:
-        initialize_firebase()
+        initialize_firebase(args.credentials)
         db = firestore.client()
 
         # -------------------------
         # 1) Insert Learning Materials
         # -------------------------
-        materials_coll = db.collection('materials')
+        sync_materials(
+            db, args.file, dry_run=args.dry_run, prune=args.prune, force=args.force,
+            writer=args.writer, batch_size=args.batch_size, workers=args.workers,
+            max_ops_per_second=args.max_ops_per_second, progress_every=args.progress_every,
+            publish=not args.no_publish
+        )
+        if args.publish_all and not args.dry_run:
+            publish_materials(db)
+        print()
 
-        # Make sure the file path is correct. 
-        # If your file is at "./data_files/materials_data_set.json", use that path below
-        with open('data_files/materials_data_set.json', 'r', encoding='utf-8') as file:
-            sample_data = json.load(file)
-        
-        for item in sample_data:
-            doc_id = item['id']    # Firestore doc name will match the "id" field
-            doc_ref = materials_coll.document(doc_id)
-            doc_ref.set(item)
-            print(f"✅ Inserted material with ID: {doc_id}")
-
-        print("🎉 'materials' collection seeding complete.\n")
+        if args.materials_only or args.dry_run:
+            return
 
         # -------------------------
         # 2) Insert Example User
@@ -43,16 +372,17 @@ def seed_database():
         example_user_id = "test_user_123"
         example_user_data = {
             "isPremium": False,
-            "totalMessages": {
-                "03_25": 5,
-                "04_25": 0
-            },
             "createdAt": "2025-01-01T00:00:00Z"
         }
 
         user_doc = users_coll.document(example_user_id).get()
         if not user_doc.exists:
             users_coll.document(example_user_id).set(example_user_data)
+            # Free-plan usage lives in one counter document per month
+            users_coll.document(example_user_id).collection('monthlyUsage').document('2025-03').set({
+                "month": "2025-03",
+                "messages": 5
+            })
             print(f"✅ Inserted example user: {example_user_id}")
         else:
             print(f"⚡ User {example_user_id} already exists. No changes made.")
@@ -75,5 +405,23 @@ def seed_database():
     except Exception as e:
         print(f"❌ Error seeding database: {e}")
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sync learning materials (and demo data) into Firestore")
+    parser.add_argument("--file", default=MATERIALS_FILE, help="materials JSON array or .jsonl file")
+    parser.add_argument("--credentials", default="serviceAccountKey.json")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without writing")
+    parser.add_argument("--prune", action="store_true", help="delete materials that are not in the file")
+    parser.add_argument("--force", action="store_true", help="rewrite every material even if unchanged")
+    parser.add_argument("--writer", choices=["bulk", "batch"], default="bulk",
+                        help="Firestore BulkWriter, or batched commits run in parallel")
+    parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE, help="writes per commit (batch writer)")
+    parser.add_argument("--workers", type=int, default=4, help="parallel commits (batch writer)")
+    parser.add_argument("--max-ops-per-second", type=int, default=2000, help="rate limit (bulk writer)")
+    parser.add_argument("--progress-every", type=int, default=1000, help="print progress every N items")
+    parser.add_argument("--no-publish", action="store_true", help="don't rebuild lesson bundles or bump the version")
+    parser.add_argument("--publish-all", action="store_true", help="rebuild every lesson bundle")
+    parser.add_argument("--materials-only", action="store_true", help="skip the example user and chatLogs placeholder")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
-    seed_database()
+    seed_database(parse_args())
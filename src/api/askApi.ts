@@ -35,6 +35,44 @@ const CHATLOG_API_URL = import.meta.env.MODE === 'production'
   ? "https://api-chatlogs-jfys4ba3ka-uc.a.run.app"
   : "http://127.0.0.1:5001/arabicchatbot-24bb2/us-central1/api_chatlogs";
 
+// Retries on network errors reuse the same Idempotency-Key, so the server
+// answers each question at most once and replays the stored answer
+const ASK_MAX_ATTEMPTS = 3;
+const ASK_RETRY_DELAY_MS = 1000;
+// A 409 means an earlier attempt with this key is still being answered. It can
+// run for the server's whole LLM deadline (LLM_TOTAL_DEADLINE, 45s), so keep
+// polling a little longer than that until the stored answer is replayed
+const ASK_PENDING_WAIT_MS = 60000;
+const ASK_PENDING_POLL_MS = 2000;
+
+const sleep = (ms: number) => new Promise(resolve => setTimeout(resolve, ms));
+
+async function postAskWithRetry(body: string, headers: Record<string, string>): Promise<Response> {
+  const pendingDeadline = Date.now() + ASK_PENDING_WAIT_MS;
+  for (let attempt = 1; ; ) {
+    try {
+      const res = await fetch(ASK_API_URL, { method: "POST", headers, body });
+      if (res.status === 409 && Date.now() + ASK_PENDING_POLL_MS < pendingDeadline) {
+        await sleep(ASK_PENDING_POLL_MS);
+        continue;
+      }
+      return res;
+    } catch (error) {
+      if (attempt >= ASK_MAX_ATTEMPTS) {
+        throw error;
+      }
+      await sleep(ASK_RETRY_DELAY_MS * attempt);
+      attempt++;
+    }
+  }
+}
+
+function getAuthToken(): string | null {
+  return document.cookie.split('; ').find(row => row.startsWith('authToken='))?.split('=')[1]
+    || sessionStorage.getItem('authToken')
+    || localStorage.getItem('authToken');
+}
+
 /**
  * Sends a question to the chatbot API and returns the response
  */
@@ -49,14 +87,13 @@ export async function askQuestion(
   answer: string;
   sessionId: string;
   chatSession: ChatSession;
+  answerSource?: 'llm' | 'dictionary' | 'dictionary_fallback' | 'lesson_content' | 'mock';
   maxLimitReached?: boolean;
   limitWarning?: boolean;
   remainingMessages?: number;
   subscriptionUrl?: string;
 }> {
-  const authToken = document.cookie.split('; ').find(row => row.startsWith('authToken='))?.split('=')[1]
-    || sessionStorage.getItem('authToken')
-    || localStorage.getItem('authToken');
+  const authToken = getAuthToken();
 
   if (!authToken) {
     throw new Error('Authentication token not found');
@@ -64,21 +101,18 @@ export async function askQuestion(
 
   const headers: Record<string, string> = {
     "Content-Type": "application/json",
-    "Authorization": `Bearer ${authToken}`
+    "Authorization": `Bearer ${authToken}`,
+    "Idempotency-Key": crypto.randomUUID()
   };
 
-  const res = await fetch(ASK_API_URL, {
-    method: "POST",
-    headers,
-    body: JSON.stringify({ 
-      question,
-      week,
-      level,
-      gender,
-      language,
-      sessionId
-    })
-  });
+  const res = await postAskWithRetry(JSON.stringify({ 
+    question,
+    week,
+    level,
+    gender,
+    language,
+    sessionId
+  }), headers);
 
   // Handle limit reached case (403 status)
   if (res.status === 403) {
@@ -197,6 +231,27 @@ export async function fetchChatLogs(
   return res.json();
 }
 
+// Materials carry the published version as their ETag and Cache-Control: no-cache,
+// so the browser revalidates its copy and an unchanged list comes back as a 304
+export async function fetchMaterials<T = Record<string, any>>(): Promise<T[]> {
+  const authToken = getAuthToken();
+  if (!authToken) {
+    throw new Error('Authentication token not found');
+  }
+
+  const res = await fetch(`${CHATLOG_API_URL}/materials`, {
+    method: "GET",
+    headers: { "Authorization": `Bearer ${authToken}` }
+  });
+
+  if (!res.ok) {
+    throw new Error(`fetchMaterials failed: ${res.status} - ${res.statusText}`);
+  }
+
+  const body = await res.json();
+  return body.materials;
+}
+
 export async function deleteChat(sessionId: string): Promise<{success: boolean}> {
   const url = `${CHATLOG_API_URL}/${sessionId}`;
   const res = await fetch(url, { method: "DELETE" });
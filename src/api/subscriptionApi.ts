@@ -1,4 +1,4 @@
-import { doc, getDoc, setDoc, updateDoc } from 'firebase/firestore';
+import { doc, getDoc, setDoc, updateDoc, Timestamp } from 'firebase/firestore';
 import { db } from '../config/firebaseConfig';
 import { getFunctions, httpsCallable } from 'firebase/functions';
 
@@ -106,6 +106,10 @@ export const cancelSubscription = async (userId: string): Promise<boolean> => {
   }
 };
 
+// The backends store end dates as Firestore timestamps; older documents hold ISO strings
+export const toDate = (value: Timestamp | string | Date): Date =>
+  value instanceof Timestamp ? value.toDate() : new Date(value);
+
 /**
  * Get current subscription for a user
  */
@@ -129,7 +133,13 @@ export const getUserSubscription = async (userId: string): Promise<SubscriptionD
       return null;
     }
     
-    return subscriptionDoc.data() as SubscriptionData;
+    const data = subscriptionDoc.data();
+    const isoDate = (value: unknown) => value instanceof Timestamp ? value.toDate().toISOString() : value;
+    return {
+      ...data,
+      startDate: isoDate(data.startDate),
+      endDate: isoDate(data.endDate)
+    } as SubscriptionData;
     
   } catch (error) {
     console.error('Failed to get subscription:', error);
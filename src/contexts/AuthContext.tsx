@@ -18,9 +18,12 @@ import {
 } from "firebase/firestore";
 import Cookies from "js-cookie";
 import { app } from "../config/firebaseConfig";
+import { toDate } from "../api/subscriptionApi";
 
 interface AuthContextType {
   currentUser: string | null;
+  // Firebase uid, the canonical users/ and subscriptions/ document ID
+  userId: string | null;
   email: string;
   userName: string;
   authToken: string | null;
@@ -130,8 +133,7 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
               email: user.email || "",
               userName: user.displayName || user.email || "New User",
               createdAt: new Date().toISOString(),
-              isPremium: false,
-              totalMessages: {}
+              isPremium: false
             });
           } else {
             // partial update
@@ -277,19 +279,14 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
             // Check if subscription is active and not expired
             if (
               (subscriptionData.status === 'active' || subscriptionData.status === 'trial') &&
-              new Date(subscriptionData.endDate) > new Date()
+              toDate(subscriptionData.endDate) > new Date()
             ) {
               setIsPremium(true);
               return true;
             }
           }
           
-          // If we get here, subscription is not active or has expired
-          // Update user document to reflect this
-          await updateDoc(userRef, {
-            isPremium: false,
-            updatedAt: new Date().toISOString()
-          });
+          // Not active or expired; the scheduled sweeper clears isPremium on the server
         }
         
         setIsPremium(false);
@@ -307,6 +304,7 @@ export const AuthProvider: React.FC<{ children: React.ReactNode }> = ({ children
 
   const contextValue = {
     currentUser,
+    userId,
     email,
     userName,
     authToken,
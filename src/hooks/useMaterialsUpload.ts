@@ -1,6 +1,8 @@
 import { useState } from 'react';
 import { useMutation } from '@tanstack/react-query';
-import { doc, setDoc, getFirestore } from 'firebase/firestore';
+import {
+  doc, setDoc, getFirestore, collection, query, where, getDocs, increment, serverTimestamp, Firestore
+} from 'firebase/firestore';
 import { formatFileSize } from '../lib/utils';
 
 // Define the structure of each material item
@@ -11,6 +13,54 @@ export interface MaterialItem {
   pronunciation: string;
 }
 
+// Lesson bundles and the version document the backends watch (see seed_data.py)
+const MATERIALS_META_DOC = ['materialsMeta', 'current'] as const;
+const MATERIAL_BUNDLES_COLLECTION = 'materialBundles';
+
+// 'beginner_week_01_003' -> 'beginner_week_01'
+const lessonKeyFor = (id: string): string => id.slice(0, id.lastIndexOf('_'));
+
+const sha256Hex = async (text: string): Promise<string> => {
+  const digest = await crypto.subtle.digest('SHA-256', new TextEncoder().encode(text));
+  return Array.from(new Uint8Array(digest)).map((b) => b.toString(16).padStart(2, '0')).join('');
+};
+
+// Rebuild the bundles of the given lessons and bump the materials version,
+// so the backends reload those lessons instead of serving cached copies
+const publishLessons = async (firestore: Firestore, lessonKeys: string[]): Promise<void> => {
+  const hashes: Record<string, string> = {};
+
+  for (const lessonKey of lessonKeys) {
+    const snapshot = await getDocs(query(
+      collection(firestore, 'materials'),
+      where('id', '>=', lessonKey),
+      where('id', '<', lessonKey + '_z')
+    ));
+    // Keys in sorted order and no whitespace, so the hash matches seed_data.py's bundle_hash
+    const items = snapshot.docs
+      .map((d) => d.data() as MaterialItem)
+      .filter((item) => lessonKeyFor(item.id) === lessonKey)
+      .map(({ arabic_response, hebrew_input, id, pronunciation }) => ({ arabic_response, hebrew_input, id, pronunciation }))
+      .sort((a, b) => (a.id < b.id ? -1 : a.id > b.id ? 1 : 0));
+    const contentHash = await sha256Hex(JSON.stringify(items));
+
+    await setDoc(doc(firestore, MATERIAL_BUNDLES_COLLECTION, lessonKey), {
+      lessonKey,
+      contentHash,
+      count: items.length,
+      items,
+      updatedAt: serverTimestamp()
+    });
+    hashes[lessonKey] = contentHash;
+  }
+
+  await setDoc(doc(firestore, ...MATERIALS_META_DOC), {
+    version: increment(1),
+    lessons: hashes,
+    updatedAt: serverTimestamp()
+  }, { merge: true });
+};
+
 export interface ValidationResult {
   isValid: boolean;
   errors: string[];
@@ -69,6 +119,9 @@ export const useMaterialsUpload = () => {
       
       // Execute all operations in parallel
       await Promise.all(batch);
+
+      // Publish the touched lessons so the backends pick up the change
+      await publishLessons(firestore, [...new Set(materials.map((m) => lessonKeyFor(m.id)))]);
       return materials.length;
     }
   });
@@ -24,11 +24,9 @@ import ChatMessage from '@/components/ChatMessage';
 import Footer from '@/components/Footer';
 import UploadJsonToFirestore from '../components/UploadJsonToFirestore';
 import { DateRange } from 'react-day-picker';
-import { fetchChatLogs, ChatSession, Message, deleteChat, deleteAllChats } from '@/api/askApi';
+import { fetchChatLogs, fetchMaterials, ChatSession, Message, deleteChat, deleteAllChats } from '@/api/askApi';
 import { useToast } from '@/hooks/use-toast';
 import { useQuery } from '@tanstack/react-query';
-import { collection, getDocs } from 'firebase/firestore';
-import { db } from '@/config/firebaseConfig';
 
 interface Material {
   id: string;
@@ -61,7 +59,7 @@ const ChatLogs: React.FC = () => {
   
   const { toast } = useToast();
   
-  // Fetch materials from Firestore using React Query
+  // Fetch materials from the API using React Query
   const { 
     data: materials, 
     isLoading: isMaterialsLoading, 
@@ -72,15 +70,10 @@ const ChatLogs: React.FC = () => {
     queryKey: ['materials'],
     queryFn: async () => {
       try {
-        console.log('Fetching materials from Firestore...');
-        const materialsRef = collection(db, 'materials');
-        const snapshot = await getDocs(materialsRef);
-        const docs = snapshot.docs.map(doc => ({
-          id: doc.id,
-          ...doc.data()
-        }));
+        console.log('Fetching materials...');
+        const docs = await fetchMaterials<Material>();
         console.log(`Successfully fetched ${docs.length} materials`);
-        return docs as Material[];
+        return docs;
       } catch (err) {
         console.error('Error fetching materials:', err);
         throw err;
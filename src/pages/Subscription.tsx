@@ -23,15 +23,16 @@ const Subscription: React.FC = () => {
   const [isLoadingSubscription, setIsLoadingSubscription] = useState<boolean>(true);
   
   const { toast } = useToast();
-  const { currentUser, email, isAuthenticated, authToken, userName } = useAuth();
+  const { currentUser, userId, email, isAuthenticated, authToken, userName } = useAuth();
   const navigate = useNavigate();
 
   // Fetch current subscription status
   useEffect(() => {
     const fetchSubscription = async () => {
-      if (isAuthenticated && currentUser) {
+      const subscriptionUserId = userId || currentUser;
+      if (isAuthenticated && subscriptionUserId) {
         try {
-          const userSubscription = await getUserSubscription(currentUser);
+          const userSubscription = await getUserSubscription(subscriptionUserId);
           setSubscription(userSubscription);
           
           // Set billing cycle based on current subscription
@@ -54,7 +55,7 @@ const Subscription: React.FC = () => {
     };
     
     fetchSubscription();
-  }, [isAuthenticated, currentUser, toast]);
+  }, [isAuthenticated, userId, currentUser, toast]);
 
   const getBillingCycle = (): BillingCycle => {
     return yearlyBilling ? 'yearly' : 'monthly';